@@ -1,9 +1,68 @@
-from fastapi import FastAPI, HTTPException, Query
+from typing import Literal
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, UUID4, Field
-import requests
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, UUID4, Field, ValidationError, field_validator
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+import asyncio
+import base64
+import codecs
+import csv
+import inspect
+import io
+import os
+import re
+import tempfile
 import json
-from db_control import crud, mymodels_MySQL as mymodels
+from email.utils import format_datetime
+from db_control import crud, mymodels_MySQL as mymodels, pool_settings
+from db_control.connect_MySQL import DB_MODE
+from db_control.cache import customer_cache
+from db_control.instrumentation import GaugeCallback, register, render_metrics
+from db_control.item_catalog import item_catalog, ITEM_CATALOG_REFRESH_SECONDS
+from middleware import MetricsMiddleware
+from upstream import upstream_client, UpstreamError
+from write_batcher import CUSTOMER_WRITE_BATCHING, WriteBatcherFull, create_customer_batcher_from_env
+from responses import FastJSONResponse, dumps
+from exporter import EXPORT_FORMATS, create_export_writer
+from db_control.uuid_types import UUID_VERSION
+from uuid import UUID
+
+# DB_MODE=async なら AsyncSession 版 (crud_async)、それ以外は従来の同期版 crud を使う
+if DB_MODE == "async":
+    from db_control import crud_async as db_crud
+    from db_control.connect_MySQL_async import async_engine as db_engine, ping_db, dispose_engine, pool_stats
+else:
+    db_crud = crud
+    from db_control.connect_MySQL import engine as db_engine, ping_db, dispose_engine, pool_stats
+
+async def _flush_customers(values_list: list[dict]) -> list[dict]:
+    return await call_crud(db_crud.mybulkinsert_orm, mymodels.Customers, values_list)
+
+# CUSTOMER_WRITE_BATCHING=true なら POST /customers の登録をまとめて 1 回の INSERT・コミットにする (write_batcher.py)
+customer_batcher = create_customer_batcher_from_env(_flush_customers) if CUSTOMER_WRITE_BATCHING else None
+
+# /readyz で DB の応答を待つ最大秒数
+READYZ_TIMEOUT = float(os.getenv('READYZ_TIMEOUT', '2'))
+# /fetchtest が返す外部 API
+FETCHTEST_URL = os.getenv('FETCHTEST_URL', 'https://jsonplaceholder.typicode.com/users')
+
+
+async def call_crud(func, *args, **kwargs):
+    """
+    crud 関数を呼び出す。async 版はそのまま await し、
+    同期版はイベントループを塞がないようにスレッドプールで実行する。
+    """
+    if inspect.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await run_in_threadpool(func, *args, **kwargs)
+
+
+# internal_id の型。既定 (UUID_VERSION=4) では従来どおり UUID4 として検証し、
+# UUID_VERSION=7 で採番している場合は v7 の internal_id も受け付けるよう UUID 全般を許可する
+InternalId = UUID4 if UUID_VERSION == 4 else UUID
 
 
 class CustomerBase(BaseModel): # 作成時・更新時用のベースモデル
@@ -18,14 +77,168 @@ class CustomerCreate(CustomerBase):
 class CustomerUpdate(CustomerBase):
     pass # 更新時も internal_id はパスパラメータで指定
 
+class CustomerPatch(BaseModel): # PATCH 用。送られたフィールドだけを更新する
+    customer_id: str | None = None
+    customer_name: str | None = None
+    age: int | None = None
+    gender: str | None = None
+
+    @field_validator("customer_id", "customer_name")
+    @classmethod
+    def _not_null(cls, value):
+        # 省略は「変更しない」。NOT NULL のカラムに明示的な null が送られたら 422 にする
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
 class CustomerResponse(CustomerBase): # レスポンス用モデル
-    internal_id: UUID4 # DBから取得した internal_id を含める
+    internal_id: InternalId # DBから取得した internal_id を含める
 
     class Config:
         # orm_mode = True # SQLAlchemyモデルから自動変換するために必要 (v1)
         from_attributes = True # Pydantic v2
 
-app = FastAPI()
+# レスポンスに含める顧客のフィールド (CustomerResponse と同じ順序)
+CUSTOMER_FIELDS = tuple(CustomerResponse.model_fields)
+
+def _customer_fields(customer) -> dict:
+    # ORM オブジェクトまたはキャッシュの dict から、CustomerResponse のフィールドだけを取り出す
+    if isinstance(customer, dict):
+        return {field: customer[field] for field in CUSTOMER_FIELDS}
+    return {field: getattr(customer, field) for field in CUSTOMER_FIELDS}
+
+def _etag(version) -> str:
+    # 顧客 1 件の ETag は行の version (更新のたびに +1)
+    return f'"{version}"'
+
+def _customer_response(customer, status_code: int = 200) -> FastJSONResponse:
+    version = customer.get("version") if isinstance(customer, dict) else customer.version
+    headers = {"ETag": _etag(version)} if version is not None else {}
+    return FastJSONResponse(_customer_fields(customer), status_code=status_code, headers=headers)
+
+def _if_none_match(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match は弱い比較 (W/ の有無を無視して比べる)。"*" は表現が存在すれば一致
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _if_match_versions(if_match: str | None) -> list[int] | None:
+    """
+    If-Match ヘッダから一致を許す version のリストを作る。None (ヘッダなし・"*") は条件なし。
+    弱い ETag (W/"...") は If-Match では一致しない (RFC 9110 の強い比較) ので無視する
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith('"') and tag.endswith('"') and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+class PurchaseLineCreate(BaseModel):
+    item_id: str
+    quantity: int = Field(..., gt=0)
+
+class PurchaseCreate(BaseModel): # POST /purchases の入力 (顧客とカゴの中身)
+    customer_internal_id: InternalId
+    items: list[PurchaseLineCreate] = Field(..., min_length=1)
+    purchase_date: datetime | None = None # 省略時はサーバーの現在時刻
+
+class PurchaseLineResponse(BaseModel):
+    item_id: str
+    item_name: str
+    price: int
+    quantity: int
+    subtotal: int
+
+class PurchaseResponse(BaseModel):
+    purchase_id: int
+    customer_internal_id: InternalId
+    purchase_date: datetime
+    total: int
+    items: list[PurchaseLineResponse]
+
+class ItemResponse(BaseModel):
+    item_id: str
+    item_name: str
+    price: int
+
+class DailySalesResponse(BaseModel):
+    sales_date: date
+    purchase_count: int
+    quantity: int
+    revenue: int
+
+class ItemSalesResponse(BaseModel):
+    item_id: str
+    item_name: str
+    quantity: int
+    revenue: int
+
+class CustomerSalesResponse(BaseModel):
+    customer_internal_id: InternalId
+    customer_id: str
+    customer_name: str
+    purchase_count: int
+    total_revenue: int
+    first_purchase_date: datetime | None
+    last_purchase_date: datetime | None
+
+class BulkRowResult(BaseModel): # POST /customers/bulk の行ごとの結果
+    index: int # 入力の何行目か (0始まり、CSVはヘッダ行を除く)
+    status: Literal["created", "error", "invalid"]
+    customer_id: str | None = None
+    internal_id: InternalId | None = None
+    error: str | None = None
+
+class BulkInsertResponse(BaseModel):
+    created: int
+    failed: int
+    results: list[BulkRowResult] # 失敗した行 (return_created=true なら登録した行も含む)
+
+async def _load_item_changes(since):
+    return await call_crud(db_crud.myselect_item_changes, since)
+
+_catalog_refresh_tasks = set() # 実行中の臨時の refresh (タスクの参照を持っておかないと途中で回収される)
+
+def _catalog_refresh_done(task):
+    _catalog_refresh_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Failed to refresh the item catalog: {task.exception()}")
+
+def _refresh_item_catalog_now():
+    # 削除済みの商品がカタログに残っていた。次の定期更新を待たずに全件を読み直す
+    item_catalog.request_full_refresh()
+    task = asyncio.create_task(item_catalog.refresh(_load_item_changes))
+    _catalog_refresh_tasks.add(task)
+    task.add_done_callback(_catalog_refresh_done)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時に一度だけ DB への接続を確認する。
+    # 失敗してもワーカーは起動させ、DB が戻るまでは /readyz が 503 を返す (インポート時には接続しない)
+    if await call_crud(ping_db):
+        print(f"Successfully connected to the database: {db_engine.url}")
+    # 商品カタログを全件読み込み、以降は差分だけを定期的に読み直す (失敗しても起動は続け、次回の更新で読み込む)
+    try:
+        await item_catalog.refresh(_load_item_changes)
+    except Exception as e:
+        print(f"Failed to load the item catalog: {e}")
+    refresher = None
+    if ITEM_CATALOG_REFRESH_SECONDS > 0:
+        refresher = asyncio.create_task(item_catalog.run_refresher(_load_item_changes, ITEM_CATALOG_REFRESH_SECONDS))
+    yield
+    if refresher is not None:
+        refresher.cancel()
+    if customer_batcher is not None:
+        await customer_batcher.close() # キューに残っている登録を済ませてから接続を閉じる
+    await upstream_client.close()
+    await call_crud(dispose_engine)
+
+app = FastAPI(lifespan=lifespan)
 
 # CORSミドルウェアの設定
 app.add_middleware(
@@ -34,7 +247,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"], # ブラウザからページネーションのカーソル・ETag を読めるようにする
 )
+# リクエストごとの処理時間・SQL 件数などの計測 (/metrics で公開)
+app.add_middleware(MetricsMiddleware)
+
+register(GaugeCallback(
+    "customer_cache_hits", "Customer cache hits", lambda: customer_cache.stats()["hits"]))
+register(GaugeCallback(
+    "customer_cache_misses", "Customer cache misses", lambda: customer_cache.stats()["misses"]))
+register(GaugeCallback(
+    "db_pool_checked_out", "Connections currently checked out of the pool", lambda: pool_stats()["checked_out"] or 0))
+register(GaugeCallback(
+    "db_pool_overflow", "Connections opened beyond pool_size", lambda: max(pool_stats()["overflow"] or 0, 0)))
+register(GaugeCallback(
+    "db_pool_waiting", "Checkouts currently waiting for a free connection", lambda: pool_stats()["waiting"]))
+
+# /allcustomers の 1 ページあたりの上限件数
+MAX_PAGE_SIZE = 1000
+# ストリーミング時にサーバーサイドカーソルから一度に読む件数
+STREAM_CHUNK_SIZE = 1000
+# /customers/bulk で 1 回の INSERT にまとめる件数の既定値と上限
+BULK_INSERT_BATCH_SIZE = 1000
+MAX_BULK_INSERT_BATCH_SIZE = 10000
+# /customers/bulk の JSON 配列の要素 1 つの上限文字数 (閉じていない要素でボディ全体を溜め込まないため)
+MAX_BULK_JSON_ELEMENT_CHARS = 1024 * 1024
+# /export/{table} でサーバーサイドカーソルから一度に読んでエンコードする件数の既定値と上限
+EXPORT_CHUNK_SIZE = 10000
+MAX_EXPORT_CHUNK_SIZE = 100000
 
 
 @app.get("/")
@@ -42,49 +282,578 @@ def index():
     return {"message": "FastAPI top page!"}
 
 
+@app.get("/healthz")
+def healthz():
+    # liveness: プロセスが応答できるかだけを見る (DB には触らない)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    # readiness: プールから接続を取り出して SELECT 1 が通るか
+    try:
+        ready = await asyncio.wait_for(call_crud(ping_db), READYZ_TIMEOUT)
+    except asyncio.TimeoutError:
+        ready = False
+    body = {"status": "ok" if ready else "unavailable", "pool": db_engine.pool.status()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+@app.get("/pool/stats")
+def get_pool_stats():
+    # このワーカーのコネクションプールの状態と設定 (gunicorn のワーカーごとに別のプール)
+    return {
+        "pid": os.getpid(),
+        "db_mode": DB_MODE,
+        "pool": pool_stats(),
+        "config": {
+            "pool_size": pool_settings.DB_POOL_SIZE,
+            "max_overflow": pool_settings.DB_MAX_OVERFLOW,
+            "pool_timeout": pool_settings.DB_POOL_TIMEOUT,
+            "pool_recycle": pool_settings.DB_POOL_RECYCLE,
+            "pool_pre_ping": pool_settings.DB_POOL_PRE_PING,
+        },
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus のテキスト形式
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    # GET /customers/{internal_id} のキャッシュのヒット・ミス数など
+    return customer_cache.stats()
+
+
+@app.get("/write-batch/stats")
+def write_batch_stats():
+    # POST /customers のまとめ込みの状態 (無効なら enabled: false のみ)
+    if customer_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **customer_batcher.stats()}
+
+
+@app.get("/items/catalog/stats")
+def item_catalog_stats():
+    # このワーカーの商品カタログのスナップショットの状態 (件数・ウォーターマーク・最後の更新からの秒数)
+    return item_catalog.stats()
+
+
 @app.post("/customers", response_model=CustomerResponse)
-def create_customer(customer_data: CustomerCreate): # 入力は CustomerCreate
+async def create_customer(customer_data: CustomerCreate): # 入力は CustomerCreate
     # customer_data には internal_id は含まれない
     # crud.myinsert で internal_id は自動生成される想定
-    new_customer_obj = crud.myinsert_orm(mymodels.Customers, customer_data.model_dump()) # model_dump() (v2) or dict() (v1)
+    if customer_batcher is not None:
+        return await _create_customer_batched(customer_data.model_dump())
+    try:
+        new_customer_obj = await call_crud(db_crud.myinsert_orm, mymodels.Customers, customer_data.model_dump()) # model_dump() (v2) or dict() (v1)
+    except crud.DuplicateCustomerIdError as e:
+        raise HTTPException(status_code=409, detail=str(e)) # まとめ込みの場合と同じ 409
     if not new_customer_obj:
         raise HTTPException(status_code=500, detail="Failed to create customer")
-    return new_customer_obj # ORMオブジェクトをそのまま返す (FastAPIがシリアライズ)
+    # response_model の検証を通さずに直接 JSON にする (スキーマは response_model のまま)
+    return _customer_response(new_customer_obj)
+
+
+async def _create_customer_batched(values: dict):
+    # 他のリクエストの登録とまとめて INSERT し、自分の行の結果だけを受け取る
+    try:
+        result = await customer_batcher.submit(values)
+    except WriteBatcherFull:
+        raise HTTPException(status_code=503, detail="Too many pending customer writes", headers={"Retry-After": "1"})
+    except Exception as e:
+        print(f"Error in batched create_customer: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create customer")
+    if result["status"] != "created":
+        # まとめ込みでは一意制約違反を行ごとに判別できるので 409 で返す
+        raise HTTPException(status_code=409, detail=result["error"])
+    # 登録した行は送った値 + internal_id で、version は初期値の 1
+    return _customer_response({**values, "internal_id": result["internal_id"], "version": 1})
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+async def _json_array_elements(chunks):
+    """
+    バイト列のチャンクの非同期イテレータから、JSON 配列の要素を 1 つずつデコードして返す。
+    JSON として壊れていれば、そこまでの要素を返したあとで ValueError を送出する。
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8-sig")() # json.loads と同じく BOM 付きも受け付ける
+    chunks = chunks.__aiter__()
+    buffer, position, ended = "", 0, False
+
+    async def receive():
+        # 読み終えた部分を捨ててから次のチャンクを足す
+        nonlocal buffer, position, ended
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            chunk, ended = b"", True
+        buffer = buffer[position:] + text.decode(chunk, final=ended)
+        position = 0
+
+    async def next_char() -> str:
+        # 空白を読み飛ばした次の文字 (ボディの終わりなら "")
+        nonlocal position
+        while True:
+            position = _JSON_WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) or ended:
+                return buffer[position:position + 1]
+            await receive()
+
+    char = await next_char()
+    if char != "[":
+        raise ValueError("JSON body must be an array of customers" if char else "Invalid JSON body: empty body")
+    position += 1
+    if await next_char() == "]":
+        position += 1
+    else:
+        while True:
+            # 要素が受信済みの範囲で閉じるまで受信する (受信済みの範囲が値の直後で終わっていれば、数値の続きかもしれないので待つ)
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buffer, position)
+                    if end < len(buffer) or ended:
+                        break
+                except ValueError as e:
+                    if ended:
+                        raise ValueError(f"Invalid JSON body: {e}")
+                if len(buffer) - position > MAX_BULK_JSON_ELEMENT_CHARS:
+                    raise ValueError(f"Invalid JSON body: an array element exceeds {MAX_BULK_JSON_ELEMENT_CHARS} characters")
+                await receive()
+            position = end
+            yield obj
+            char = await next_char()
+            if char == "]":
+                position += 1
+                break
+            if char != ",":
+                raise ValueError(f"Invalid JSON body: expected ',' or ']' but found {char or 'the end of the body'!r}")
+            position += 1
+            await next_char()
+    if await next_char():
+        raise ValueError("Invalid JSON body: extra data after the array")
+
+async def _iter_json_array(request: Request):
+    # 受信したチャンクから配列の要素を 1 つずつ取り出してパースする (ボディ全体をメモリに載せない)。
+    # 配列でなければ何も登録せずに 400。途中で壊れていれば、それより前の要素は登録済みなので 400 にはせず、
+    # 壊れた位置を invalid の行 (ValueError) として返して打ち切る
+    parsed = 0
+    try:
+        async for obj in _json_array_elements(request.stream()):
+            parsed += 1
+            yield obj
+    except ValueError as e:
+        if parsed == 0:
+            raise HTTPException(status_code=400, detail=str(e))
+        yield ValueError(f"{e} (the rest of the body was not processed)")
+
+async def _iter_ndjson(request: Request):
+    # 受信したチャンクから 1 行ずつ取り出してパースする (ボディ全体をメモリに載せない)
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_json_line(line)
+    if buffer.strip():
+        yield _parse_json_line(buffer)
+
+def _parse_json_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e # 行単位のエラーとして呼び出し側で invalid にする
+
+async def _iter_csv(request: Request, content_type: str):
+    if content_type == "multipart/form-data":
+        # ファイルアップロード (フォームの "file" フィールド)。UploadFile は一時ファイルに書き出されている
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="multipart upload must contain a 'file' field")
+        spool = upload.file
+    else:
+        # 大きなボディはディスクに逃がしつつ受け取る
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        async for chunk in request.stream():
+            spool.write(chunk)
+    spool.seek(0)
+    with io.TextIOWrapper(spool, encoding="utf-8-sig", newline="") as text:
+        for row in csv.DictReader(text):
+            yield row
+
+async def _insert_bulk_batch(batch: list[tuple[int, dict]]) -> list[BulkRowResult]:
+    results = await call_crud(db_crud.mybulkinsert_orm, mymodels.Customers, [values for _, values in batch])
+    return [BulkRowResult(index=index, **result) for (index, _), result in zip(batch, results)]
+
+@app.post(
+    "/customers/bulk",
+    response_model=BulkInsertResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "description": "JSON配列 (application/json)、NDJSON (application/x-ndjson)、CSV (text/csv または multipart/form-data の file)",
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/CustomerCreate"}}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+                "text/csv": {"schema": {"type": "string"}},
+                "multipart/form-data": {"schema": {"type": "object", "properties": {"file": {"type": "string", "format": "binary"}}}},
+            },
+        }
+    },
+)
+async def bulk_create_customers(
+    request: Request,
+    batch_size: int = Query(BULK_INSERT_BATCH_SIZE, ge=1, le=MAX_BULK_INSERT_BATCH_SIZE, description="1回のINSERTにまとめる件数"),
+    return_created: bool = Query(False, description="true なら登録に成功した行の internal_id も返す"),
+):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/json":
+        rows = _iter_json_array(request)
+    elif content_type in ("application/x-ndjson", "application/jsonl", "application/json-seq"):
+        rows = _iter_ndjson(request)
+    elif content_type in ("text/csv", "multipart/form-data"):
+        rows = _iter_csv(request, content_type)
+    else:
+        raise HTTPException(status_code=415, detail="Unsupported Content-Type for bulk insert")
+
+    created = 0
+    failed = 0
+    results = []
+    batch = []
+
+    async def flush():
+        nonlocal created, failed
+        for result in await _insert_bulk_batch(batch):
+            if result.status == "created":
+                created += 1
+                if return_created:
+                    results.append(result)
+            else:
+                failed += 1
+                results.append(result)
+        batch.clear()
+
+    index = 0
+    async for obj in rows:
+        try:
+            if isinstance(obj, Exception):
+                raise obj
+            batch.append((index, CustomerCreate.model_validate(obj).model_dump()))
+        except ValidationError as e:
+            failed += 1
+            message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results.append(BulkRowResult(index=index, status="invalid", error=message))
+        except ValueError as e: # NDJSON の行が JSON として壊れている場合
+            failed += 1
+            results.append(BulkRowResult(index=index, status="invalid", error=str(e)))
+        index += 1
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    results.sort(key=lambda result: result.index)
+    return BulkInsertResponse(created=created, failed=failed, results=results)
+
+
+def _encode_cursor(values) -> str:
+    # 検索のカーソルは並び順のカラムの値の JSON 配列を base64url にしたもの (クライアントからは不透明な文字列)
+    return base64.urlsafe_b64encode(dumps(values)).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def _parse_after(after: str) -> UUID:
+    # /allcustomers のカーソルは最後の internal_id。壊れたカーソルは検索と同じく 400 にする
+    try:
+        return UUID(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# /customers/{internal_id} より前に定義する (先に定義したパスから順にマッチするため)
+@app.get("/customers/search", response_model=list[CustomerResponse])
+async def search_customers(
+    customer_id: str | None = Query(None, description="customer_id の完全一致"),
+    customer_name: str | None = Query(None, min_length=1, description="名前の前方一致"),
+    q: str | None = Query(None, min_length=1, description="名前の部分一致 (MySQL では ngram の全文索引を使う)"),
+    age_min: int | None = Query(None, ge=0),
+    age_max: int | None = Query(None, ge=0),
+    gender: str | None = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = Query(None, description="前ページの X-Next-Cursor"),
+):
+    filters = {
+        "customer_id": customer_id,
+        "customer_name": customer_name,
+        "q": q,
+        "age_min": age_min,
+        "age_max": age_max,
+        "gender": gender,
+    }
+    cursor = _decode_cursor(after) if after else None
+    try:
+        rows, next_after = await call_crud(
+            db_crud.mysearch_customers, mymodels.Customers, CUSTOMER_FIELDS, filters, limit, cursor)
+    except ValueError: # カーソルが検索条件と合わない
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": _encode_cursor(next_after)} if next_after else {}
+    return FastJSONResponse([dict(zip(CUSTOMER_FIELDS, row)) for row in rows], headers=headers)
 
 
 # customer_id ではなく internal_id (UUID) をパスパラメータとして受け取る
 @app.get("/customers/{internal_id}", response_model=CustomerResponse)
-def read_one_customer(internal_id: UUID4): # パスパラメータの型を UUID4 に
-    customer = crud.myselect_by_internal_id(mymodels.Customers, internal_id)
+async def read_one_customer(
+    internal_id: InternalId, # パスパラメータの型を UUID に
+    if_none_match: str | None = Header(None, description="前回の ETag。変わっていなければ本文なしの 304"),
+):
+    if if_none_match is not None:
+        # 条件付き GET: version だけを主キーで読み、変わっていなければ行を読まずに 304
+        version = await call_crud(db_crud.myselect_version, mymodels.Customers, internal_id)
+        if version is not None and _if_none_match(if_none_match, _etag(version)):
+            return Response(status_code=304, headers={"ETag": _etag(version)})
+    # キャッシュの dict をそのまま JSON にする (ORM オブジェクトを作らない)
+    customer = await call_crud(db_crud.myselect_dict_by_internal_id, mymodels.Customers, internal_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return customer # ORMオブジェクトをそのまま返す
+    return _customer_response(customer)
+
+@app.get("/customers/{internal_id}/purchases", response_model=list[PurchaseResponse])
+async def read_customer_purchases(
+    internal_id: InternalId,
+    start: date | None = Query(None, description="この日以降の購入"),
+    end: date | None = Query(None, description="この日までの購入 (その日を含む)"),
+    limit: int = Query(20, ge=1, le=100),
+    after: str | None = Query(None, description="前のページの X-Next-Cursor"),
+):
+    # 購入履歴 (新しい順)。明細と商品はまとめて読むので、1 ページのクエリ数は件数によらず一定
+    cursor = _decode_cursor(after) if after else None
+    try:
+        purchases, next_after = await call_crud(
+            db_crud.myselect_purchase_history, internal_id, start, end, limit, cursor)
+    except crud.CustomerNotFoundError:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": _encode_cursor(next_after)} if next_after else {}
+    return FastJSONResponse(purchases, headers=headers)
+
+def _aiter_chunks(chunks):
+    # 同期版のジェネレータはチャンク単位でスレッドプールに逃がして読む
+    return chunks if hasattr(chunks, "__aiter__") else iterate_in_threadpool(chunks)
+
+async def _ndjson_lines(chunks):
+    async for chunk in _aiter_chunks(chunks):
+        yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+async def _json_array_chunks(chunks):
+    # チャンクごとに書き出す JSON 配列 (クライアントからは通常の JSON 配列に見える)
+    yield b"["
+    first = True
+    async for chunk in _aiter_chunks(chunks):
+        if not chunk:
+            continue
+        yield (b"" if first else b",") + b",".join(dumps(row) for row in chunk)
+        first = False
+    yield b"]"
+
+def _table_version_headers(table_version) -> dict:
+    """
+    一覧の ETag / Last-Modified (同じ URL で同じバージョンなら同じ内容)。
+    If-Modified-Since は秒単位で同じ秒の書き込みを見分けられないので、304 の判定には ETag だけを使う
+    """
+    if table_version is None: # バージョンを読めなかったときは条件付き GET なし
+        return {}
+    version, updated_at = table_version
+    headers = {"ETag": f'"customers-{version}"', "Cache-Control": "no-cache"} # キャッシュしてよいが毎回再検証させる
+    if updated_at is not None:
+        headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
 
 @app.get("/allcustomers", response_model=list[CustomerResponse]) # response_model を指定
-def read_all_customer():
-    result_list = crud.myselectAll(mymodels.Customers)
-    # crud.myselectAll が Python のリストを返すようになったので json.loads は不要
-    if not result_list: # result_list が空の場合
-        return []
-    return result_list
+async def read_all_customer(
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE, description="1ページの件数。指定するとキーセットページネーションになる"),
+    after: str | None = Query(None, description="前ページの X-Next-Cursor (最後の internal_id)"),
+    stream: Literal["ndjson", "json"] | None = Query(None, description="指定するとサーバーサイドカーソルからストリーミングで返す"),
+    if_none_match: str | None = Header(None, description="前回の ETag。customers が変わっていなければ本文なしの 304"),
+):
+    # 条件付き GET: customers のテーブルのバージョンを主キー検索 1 回で読み、変わっていなければ一覧を読まずに 304。
+    # バージョンは一覧より先に読む (間に書き込みがあっても ETag が古くなるだけで、次のポーリングで取り直される)
+    headers = _table_version_headers(await call_crud(db_crud.mytable_version, mymodels.Customers))
+    if "ETag" in headers and _if_none_match(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    after = _parse_after(after) if after else None
 
-@app.put("/customers/{internal_id}", response_model=CustomerResponse)
-def update_customer(internal_id: UUID4, customer_data: CustomerUpdate):
-    updated_customer = crud.myupdate_orm(mymodels.Customers, internal_id, customer_data.model_dump())
-    if not updated_customer:
+    if stream:
+        # 全件をメモリに載せず、読んだ順にそのまま書き出す
+        chunks = db_crud.myselect_stream(mymodels.Customers, after=after, limit=limit, chunk_size=STREAM_CHUNK_SIZE)
+        if stream == "ndjson":
+            return StreamingResponse(_ndjson_lines(chunks), media_type="application/x-ndjson", headers=headers)
+        return StreamingResponse(_json_array_chunks(chunks), media_type="application/json", headers=headers)
+
+    # 必要なカラムだけをタプルで読み、1 行ずつの Pydantic 検証を通さずに直接 JSON にする
+    # (limit 未指定時は従来どおり全件 = 既存クライアント互換)
+    rows = await call_crud(db_crud.myselect_rows, mymodels.Customers, CUSTOMER_FIELDS, limit, after)
+    if limit is not None and len(rows) == limit: # 続きがある可能性があるので次のカーソルを返す
+        headers["X-Next-Cursor"] = str(rows[-1][CUSTOMER_FIELDS.index("internal_id")])
+    return FastJSONResponse([dict(zip(CUSTOMER_FIELDS, row)) for row in rows], headers=headers)
+
+async def _export_chunks(writer, chunks):
+    # エンコード (特に Parquet の圧縮) はイベントループを止めないようにスレッドプールで行う
+    yield writer.begin()
+    async for rows in _aiter_chunks(chunks):
+        yield await run_in_threadpool(writer.write, rows)
+    yield await run_in_threadpool(writer.finish)
+
+@app.get("/export/{table}")
+async def export_table(
+    table: Literal["customers", "purchases"],
+    format: Literal["csv", "arrow", "parquet"] = Query("csv", description="csv / arrow (IPC ストリーム) / parquet"),
+    chunk_size: int = Query(EXPORT_CHUNK_SIZE, ge=1, le=MAX_EXPORT_CHUNK_SIZE),
+):
+    # テーブル全体をチャンクごとに読んでは書き出す (メモリに載るのは 1 チャンク分だけ)
+    # purchases は購入明細 1 行 = 1 レコード
+    writer = create_export_writer(format, crud.export_columns(table))
+    chunks = db_crud.myexport_stream(table, chunk_size=chunk_size)
+    media_type, extension = EXPORT_FORMATS[format]
+    headers = {"Content-Disposition": f'attachment; filename="{table}.{extension}"'}
+    return StreamingResponse(_export_chunks(writer, chunks), media_type=media_type, headers=headers)
+
+async def _patch_customer(internal_id, values: dict, if_match: str | None, prefer: str | None):
+    # PUT / PATCH 共通。事前に読まずに UPDATE 1 文で更新する (If-Match があれば version を検査する)
+    expected_versions = _if_match_versions(if_match)
+    minimal = prefer is not None and "return=minimal" in prefer
+    try:
+        updated = await call_crud(
+            db_crud.mypatch, mymodels.Customers, internal_id, values, expected_versions, returning=not minimal)
+    except crud.VersionMismatchError as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": _etag(e.current_version)})
+    except crud.DuplicateCustomerIdError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not updated:
         raise HTTPException(status_code=404, detail="Customer not found or failed to update")
-    return updated_customer
+    if minimal:
+        # 更新後の行を読まない (MySQL でも 1 往復)。If-Match の version が 1 つなら新しい version は +1 と分かる
+        headers = {"ETag": _etag(expected_versions[0] + 1)} if expected_versions and len(expected_versions) == 1 else {}
+        return Response(status_code=204, headers=headers)
+    return _customer_response(updated)
+
+@app.put("/customers/{internal_id}", response_model=CustomerResponse)
+async def update_customer(
+    internal_id: InternalId,
+    customer_data: CustomerUpdate,
+    if_match: str | None = Header(None, description="GET で受け取った ETag。一致しなければ 412"),
+    prefer: str | None = Header(None, description="return=minimal なら 204 で本文を返さない"),
+):
+    return await _patch_customer(internal_id, customer_data.model_dump(), if_match, prefer)
+
+@app.patch("/customers/{internal_id}", response_model=CustomerResponse)
+async def patch_customer(
+    internal_id: InternalId,
+    customer_data: CustomerPatch,
+    if_match: str | None = Header(None, description="GET で受け取った ETag。一致しなければ 412"),
+    prefer: str | None = Header(None, description="return=minimal なら 204 で本文を返さない"),
+):
+    # 送られたフィールドだけを更新する
+    return await _patch_customer(internal_id, customer_data.model_dump(exclude_unset=True), if_match, prefer)
 
 
 @app.delete("/customers/{internal_id}", status_code=204) # 成功時は No Content
-def delete_customer(internal_id: UUID4):
-    success = crud.mydelete_orm(mymodels.Customers, internal_id)
+async def delete_customer(
+    internal_id: InternalId,
+    if_match: str | None = Header(None, description="GET で受け取った ETag。一致しなければ 412"),
+):
+    # 行を読まずに DELETE 1 文で削除する
+    try:
+        success = await call_crud(db_crud.mydelete_orm, mymodels.Customers, internal_id, _if_match_versions(if_match))
+    except crud.VersionMismatchError as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": _etag(e.current_version)})
+    except crud.CustomerHasPurchasesError as e: # 購入履歴のある顧客は削除できない
+        raise HTTPException(status_code=409, detail=str(e))
     if not success:
         raise HTTPException(status_code=404, detail="Customer not found")
     return # No Content なのでボディは返さない
 
 
+# --- 商品 (DB ではなくプロセス内の商品カタログから返す) ---
+@app.get("/items", response_model=list[ItemResponse])
+async def read_items(
+    if_none_match: str | None = Header(None, description="前回の ETag。カタログが変わっていなければ本文なしの 304"),
+):
+    snapshot = item_catalog.snapshot # 1 リクエストの中では同じスナップショットを使う
+    etag = f'"items-{snapshot.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _if_none_match(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse([snapshot.items[item_id].as_dict() for item_id in snapshot.item_ids], headers=headers)
+
+@app.get("/items/{item_id}", response_model=ItemResponse)
+async def read_one_item(item_id: str):
+    item = item_catalog.get(item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return FastJSONResponse(item.as_dict())
+
+
+@app.post("/purchases", response_model=PurchaseResponse, status_code=201)
+async def create_purchase(purchase_data: PurchaseCreate):
+    """
+    購入を登録する。価格・商品名はワーカーごとの商品カタログから取るため、DB で価格を変えてから
+    ITEM_CATALOG_REFRESH_SECONDS (既定 30 秒) 以内の購入は変更前の価格で登録されることがある。
+    レスポンスの price / subtotal / total は実際に登録した金額で、明細の unit_price として保存され、
+    購入履歴と売上集計 (加算・rebuild_rollups とも) も同じ金額になる。
+    """
+    lines = [line.model_dump() for line in purchase_data.items]
+    catalog_items = item_catalog.snapshot.items
+    try:
+        # 価格・商品名はカタログから取る (カタログにない商品が含まれるときだけ DB を引く)
+        return await call_crud(
+            db_crud.myinsert_purchase, purchase_data.customer_internal_id, lines, purchase_data.purchase_date,
+            catalog_items,
+        )
+    except crud.CustomerNotFoundError:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    except crud.UnknownItemsError as e:
+        if any(item_id in catalog_items for item_id in e.item_ids):
+            _refresh_item_catalog_now()
+        raise HTTPException(status_code=422, detail={"message": "Unknown item_id", "item_ids": e.item_ids})
+
+
+# --- 売上分析 (集計テーブルから読むので購入履歴の件数に依存しない) ---
+@app.get("/analytics/daily-sales", response_model=list[DailySalesResponse])
+async def read_daily_sales(start: date | None = None, end: date | None = None):
+    return await call_crud(db_crud.myselect_daily_sales, start, end)
+
+@app.get("/analytics/item-sales", response_model=list[ItemSalesResponse])
+async def read_item_sales(
+    start: date | None = None,
+    end: date | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # 期間内の商品別売上 (売上の多い順)
+    return await call_crud(db_crud.myselect_item_sales, start, end, limit)
+
+@app.get("/analytics/customer-sales", response_model=list[CustomerSalesResponse])
+async def read_customer_sales(limit: int = Query(100, ge=1, le=1000)):
+    # 顧客別の累計売上 (顧客生涯価値) の上位
+    return await call_crud(db_crud.myselect_customer_sales, limit)
+
+
 @app.get("/fetchtest")
-def fetchtest():
-    response = requests.get('https://jsonplaceholder.typicode.com/users')
-    return response.json()
+async def fetchtest():
+    # 共有クライアント経由 (キャッシュ・同時リクエストのまとめ込みあり) で取得し、スレッドを塞がない
+    try:
+        return await upstream_client.get_json(FETCHTEST_URL)
+    except UpstreamError as e:
+        raise HTTPException(status_code=504 if e.timeout else 502, detail=str(e))
@@ -0,0 +1,258 @@
+# CRUD エンドポイントの負荷テスト・レイテンシのベンチマーク
+#
+# アプリをプロセス内で起動し (httpx の ASGITransport)、customers を seed 件投入したうえで
+# シナリオごとに requests 件のリクエストを concurrency 並列で送る。
+#   create    : POST   /customers
+#   get       : GET    /customers/{internal_id}
+#   update    : PUT    /customers/{internal_id}
+#   list_page : GET    /allcustomers?limit=100 (カーソルをたどる)
+#   list_all  : GET    /allcustomers (全件)
+#   poll_all  : GET    /allcustomers (If-None-Match に現在の ETag を付けたポーリング。変更がなければ 304)
+#   delete    : DELETE /customers/{internal_id} (create で作った行を消す)
+# シナリオごとにスループット、レイテンシ (p50/p95/p99)、1 リクエストあたりの SQL 件数・DB 時間
+# (MetricsMiddleware の Server-Timing ヘッダから読む) を JSON で出力する。
+# 結果は benchmarks/compare.py でコミット間の比較ができる。
+#
+# DATABASE_URL が未設定なら一時ディレクトリの SQLite を使う。
+# MySQL などを指定した場合は customers 以下のテーブルを作り直すので --reset が必要。
+#
+# 実行例:
+#   python benchmarks/bench_crud.py --seed 10000 --requests 2000 --concurrency 16 --output before.json
+#   DB_MODE=async python benchmarks/bench_crud.py --output after.json
+#   python benchmarks/compare.py before.json after.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from common import ROOT, percentile, run_metadata, use_local_database
+
+SCENARIOS = ("create", "get", "update", "list_page", "list_all", "poll_all", "delete")
+LIST_PAGE_SIZE = 100
+
+_SERVER_TIMING = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def seed_customers(engine, mymodels, count: int, rng: random.Random, batch_size: int = 1000) -> list[str]:
+    """テーブルを作り直して customers を count 件投入し、internal_id の一覧を返す"""
+    from sqlalchemy import insert
+    from db_control.uuid_types import new_internal_id
+
+    mymodels.Base.metadata.drop_all(engine)
+    mymodels.Base.metadata.create_all(engine)
+    ids = []
+    with engine.begin() as connection:
+        for start in range(0, count, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, count)):
+                internal_id = new_internal_id()
+                ids.append(str(internal_id))
+                rows.append({
+                    "internal_id": internal_id,
+                    "customer_id": f"S{i:08d}",
+                    "customer_name": f"seed-{i}",
+                    "age": rng.randint(18, 90),
+                    "gender": rng.choice(("male", "female", "other")),
+                })
+            connection.execute(insert(mymodels.Customers), rows)
+    return ids
+
+
+def _customer_payload(rng: random.Random, customer_id: str) -> dict:
+    return {
+        "customer_id": customer_id,
+        "customer_name": f"bench-{rng.randrange(1_000_000)}",
+        "age": rng.randint(18, 90),
+        "gender": rng.choice(("male", "female", "other")),
+    }
+
+
+def build_requests(scenario: str, count: int, rng: random.Random, seeded_ids: list[str], created_ids: list[str], etag=None):
+    """シナリオの (method, url, json, headers) を count 件作る (乱数は固定シードなので実行ごとに同じ内容になる)"""
+    if scenario == "create":
+        return [("POST", "/customers", _customer_payload(rng, f"B{i:08d}"), None) for i in range(count)]
+    if scenario == "get":
+        return [("GET", f"/customers/{rng.choice(seeded_ids)}", None, None) for _ in range(count)]
+    if scenario == "update":
+        return [("PUT", f"/customers/{internal_id}", _customer_payload(rng, f"U{i:08d}"), None)
+                for i, internal_id in enumerate(rng.choice(seeded_ids) for _ in range(count))]
+    if scenario == "list_all":
+        return [("GET", "/allcustomers", None, None) for _ in range(count)]
+    if scenario == "poll_all":
+        return [("GET", "/allcustomers", None, {"If-None-Match": etag}) for _ in range(count)]
+    if scenario == "delete":
+        return [("DELETE", f"/customers/{internal_id}", None, None) for internal_id in created_ids[:count]]
+    raise ValueError(scenario)
+
+
+async def _send(client, method, url, body, headers=None):
+    started = time.perf_counter()
+    response = await client.request(method, url, json=body, headers=headers)
+    elapsed = time.perf_counter() - started
+    match = _SERVER_TIMING.search(response.headers.get("server-timing", ""))
+    db_ms, queries = (float(match.group(1)), int(match.group(2))) if match else (0.0, 0)
+    return response, elapsed, queries, db_ms
+
+
+async def run_scenario(client, requests_, concurrency: int, on_response=None) -> dict:
+    queue = asyncio.Queue()
+    for request in requests_:
+        queue.put_nowait(request)
+    latencies, queries, db_times = [], [], []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                method, url, body, headers = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            response, elapsed, query_count, db_ms = await _send(client, method, url, body, headers)
+            if response.status_code >= 400:
+                errors += 1
+            elif on_response is not None:
+                on_response(response)
+            latencies.append(elapsed * 1000)
+            queries.append(query_count)
+            db_times.append(db_ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summarize(latencies, queries, db_times, errors, time.perf_counter() - started)
+
+
+async def run_list_page(client, count: int, concurrency: int) -> dict:
+    """カーソルをたどってページを読む。最後まで読んだら先頭に戻る (並列の各ワーカーが独立にたどる)"""
+    latencies, queries, db_times = [], [], []
+    errors = 0
+    remaining = count
+
+    async def worker():
+        nonlocal errors, remaining
+        cursor = None
+        while remaining > 0:
+            remaining -= 1
+            url = f"/allcustomers?limit={LIST_PAGE_SIZE}" + (f"&after={cursor}" if cursor else "")
+            response, elapsed, query_count, db_ms = await _send(client, "GET", url, None)
+            if response.status_code >= 400:
+                errors += 1
+            cursor = response.headers.get("x-next-cursor")
+            latencies.append(elapsed * 1000)
+            queries.append(query_count)
+            db_times.append(db_ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summarize(latencies, queries, db_times, errors, time.perf_counter() - started)
+
+
+def _summarize(latencies, queries, db_times, errors, duration) -> dict:
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(count / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / count, 3) if count else 0.0,
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if count else 0.0,
+        },
+        "queries_per_request": {
+            "mean": round(sum(queries) / count, 2) if count else 0.0,
+            "max": max(queries, default=0),
+        },
+        "db_ms_per_request": round(sum(db_times) / count, 3) if count else 0.0,
+    }
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    import app as app_module
+    from db_control.connect_MySQL import engine
+    from db_control import mymodels_MySQL as mymodels
+
+    rng = random.Random(args.random_seed)
+    seeded_ids = seed_customers(engine, mymodels, args.seed, rng)
+    created_ids = []
+
+    results = {}
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for scenario in args.scenarios:
+                count = args.list_all_requests if scenario == "list_all" else args.requests
+                if args.warmup and scenario == "get":
+                    # キャッシュを温めてから計測する
+                    for internal_id in seeded_ids[:args.warmup]:
+                        await client.get(f"/customers/{internal_id}")
+                if scenario == "list_page":
+                    results[scenario] = await run_list_page(client, count, args.concurrency)
+                else:
+                    # poll_all は直前の一覧の ETag を付けて送る
+                    etag = (await client.get("/allcustomers", params={"limit": 1})).headers.get("etag") if scenario == "poll_all" else None
+                    requests_ = build_requests(scenario, count, rng, seeded_ids, created_ids, etag)
+                    on_response = (lambda response: created_ids.append(response.json()["internal_id"])) if scenario == "create" else None
+                    results[scenario] = await run_scenario(client, requests_, args.concurrency, on_response)
+                summary = results[scenario]
+                print(f"{scenario:10s} {summary['throughput_rps']:9.1f} req/s  "
+                      f"p50 {summary['latency_ms']['p50']:8.2f}ms  p95 {summary['latency_ms']['p95']:8.2f}ms  "
+                      f"p99 {summary['latency_ms']['p99']:8.2f}ms  queries/req {summary['queries_per_request']['mean']:5.2f}  "
+                      f"errors {summary['errors']}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the customer CRUD endpoints")
+    parser.add_argument("--seed", type=int, default=10000, help="number of customers inserted before the run")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--list-all-requests", type=int, default=20, help="requests for the list_all scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=100, help="GET requests sent before read scenarios")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="allow recreating tables on DATABASE_URL")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    args = parser.parse_args()
+    if "delete" in args.scenarios and "create" not in args.scenarios:
+        parser.error("the delete scenario deletes the rows created by the create scenario")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not use_local_database(workdir, "bench_crud") and not args.reset:
+            parser.error("DATABASE_URL is set: pass --reset to drop and recreate its tables")
+        os.environ.setdefault("SQL_SLOW_QUERY_MS", "1000000") # 計測中はスロークエリのログを出さない
+        sys.path.insert(0, ROOT)
+        results = asyncio.run(run_benchmark(args))
+        from db_control.connect_MySQL import engine
+        dialect = engine.dialect.name
+
+    report = {
+        **run_metadata(),
+        "dialect": dialect,
+        "config": {
+            "seed": args.seed,
+            "requests": args.requests,
+            "list_all_requests": args.list_all_requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "random_seed": args.random_seed,
+        },
+        "scenarios": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
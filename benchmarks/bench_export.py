@@ -0,0 +1,155 @@
+# エクスポート (exporter.py) のベンチマーク
+#
+# customers を --rows 件、purchases を購入 1 件あたり明細 --lines-per-purchase 行で入れた SQLite に対して、
+# テーブル・形式ごとに別プロセスでエクスポートを実行し、rows/s とプロセスのピーク RSS を測る。
+#   stream : exporter.export_to_file (サーバーサイドカーソルから --chunk-size 件ずつ読んで書き出す)
+#   pandas : 比較用の従来の方法。pd.read_sql_query でテーブル全体を DataFrame に読んでから書き出す
+# --rows を複数指定すると、stream のピーク RSS が行数によらずほぼ一定であることを確認できる。
+#
+# 実行例:
+#   python benchmarks/bench_export.py --rows 100000 400000 --formats csv parquet
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from common import ROOT, run_metadata, use_local_database
+
+TABLES = ("customers", "purchases")
+FORMATS = ("csv", "arrow", "parquet")
+
+
+def seed(rows: int, lines_per_purchase: int, rng: random.Random):
+    """customers を rows 件、purchases を明細がおよそ rows 行になるように入れる"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+
+    from bench_crud import seed_customers
+    from db_control import mymodels_MySQL as mymodels
+    from db_control.connect_MySQL import engine
+
+    customer_ids = seed_customers(engine, mymodels, rows, rng)
+    item_ids = [f"I{i:04d}" for i in range(100)]
+    started = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        prices = {item_id: rng.randint(100, 10000) for item_id in item_ids}
+        connection.execute(insert(mymodels.Items), [
+            {"item_id": item_id, "item_name": f"item-{item_id}", "price": price} for item_id, price in prices.items()
+        ])
+        purchase_count = rows // lines_per_purchase
+        for start in range(1, purchase_count + 1, 1000):
+            purchase_ids = range(start, min(start + 1000, purchase_count + 1))
+            connection.execute(insert(mymodels.Purchases), [
+                {
+                    "purchase_id": purchase_id,
+                    "customer_internal_id": uuid.UUID(rng.choice(customer_ids)),
+                    "purchase_date": started + timedelta(minutes=purchase_id),
+                }
+                for purchase_id in purchase_ids
+            ])
+            connection.execute(insert(mymodels.PurchaseDetails), [
+                {"purchase_id": purchase_id, "item_id": item_id, "quantity": rng.randint(1, 5), "unit_price": prices[item_id]}
+                for purchase_id in purchase_ids
+                for item_id in rng.sample(item_ids, lines_per_purchase)
+            ])
+    engine.dispose()
+
+
+def child(method: str, table: str, format: str, output: str, chunk_size: int):
+    """別プロセスで 1 回エクスポートして、行数と時間を JSON で標準出力に書く"""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    if method == "stream":
+        from exporter import export_to_file
+
+        with open(output, "wb") as f:
+            rows = export_to_file(table, format, f, chunk_size)
+    else:
+        import pandas as pd
+
+        from db_control import crud
+        from db_control.connect_MySQL import engine
+
+        df = pd.read_sql_query(crud.EXPORT_QUERIES[table](), con=engine)
+        for column in df.columns[df.dtypes == object]: # UUID は Arrow / Parquet に書けないので文字列にする
+            df[column] = df[column].map(lambda value: str(value) if isinstance(value, uuid.UUID) else value)
+        if format == "csv":
+            df.to_csv(output, index=False)
+        elif format == "parquet":
+            df.to_parquet(output, index=False)
+        else:
+            df.to_feather(output)
+        rows = len(df)
+    print(json.dumps({"rows": rows, "elapsed_s": time.perf_counter() - started}))
+
+
+def measure(method: str, table: str, format: str, chunk_size: int, workdir: str) -> dict:
+    output = os.path.join(workdir, f"{method}-{table}.{format}")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--child", method, table, format, output, "--chunk-size", str(chunk_size)],
+        stdout=subprocess.PIPE,
+    )
+    stdout = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"export failed: {method} {table} {format}")
+    result = json.loads(stdout)
+    return {
+        "method": method,
+        "table": table,
+        "format": format,
+        "rows": result["rows"],
+        "elapsed_s": round(result["elapsed_s"], 3),
+        "rows_per_s": round(result["rows"] / result["elapsed_s"]) if result["elapsed_s"] else None,
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1), # Linux の ru_maxrss は KB
+        "output_mb": round(os.path.getsize(output) / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure export throughput and peak memory")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50000, 200000])
+    parser.add_argument("--lines-per-purchase", type=int, default=3)
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--tables", nargs="+", choices=TABLES, default=list(TABLES))
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the pandas (whole table in memory) baseline")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    parser.add_argument("--child", nargs=4, metavar=("METHOD", "TABLE", "FORMAT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child, args.chunk_size)
+        return
+
+    methods = ["stream"] if args.no_baseline else ["stream", "pandas"]
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        use_local_database(workdir, "bench_export")
+        os.environ.setdefault("SQL_SLOW_QUERY_MS", "1000000")
+        sys.path.insert(0, ROOT)
+        for rows in args.rows:
+            seed(rows, args.lines_per_purchase, random.Random(42))
+            for table in args.tables:
+                for format in args.formats:
+                    for method in methods:
+                        result = measure(method, table, format, args.chunk_size, workdir)
+                        print(f"{rows:>8} {table:10s} {format:8s} {method:7s} {result['rows']:>8} rows "
+                              f"{result['rows_per_s']:>9} rows/s  peak RSS {result['peak_rss_mb']:7.1f}MB", file=sys.stderr)
+                        results.append({"seeded_rows": rows, **result})
+
+    report = {**run_metadata(), "chunk_size": args.chunk_size, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
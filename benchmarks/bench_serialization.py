@@ -0,0 +1,111 @@
+# /allcustomers のシリアライズ方式のベンチマーク
+#
+# customers を --rows 件入れた SQLite に対して、次の 2 つを --repeat 回ずつ計測して中央値を出す。
+#   pydantic : 従来の経路。myselectAll (ORM オブジェクト -> dict) の結果を response_model=list[CustomerResponse] で
+#              検証・変換し (FastAPI の serialize_response)、JSONResponse でエンコードする
+#   fast     : 現在の経路。myselect_rows でタプルを読み、dict にして FastJSONResponse (orjson) でエンコードする
+# それぞれ読み取り (query_ms) とシリアライズ (serialize_ms) を分けて出し、両者の JSON が同じ内容であることも確認する。
+#
+# 実行例:
+#   python benchmarks/bench_serialization.py --rows 10000 50000 --repeat 5
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from common import ROOT, run_metadata, use_local_database
+
+
+def _median_ms(timings) -> float:
+    return round(statistics.median(timings) * 1000, 3)
+
+
+async def measure(rows: int, repeat: int) -> dict:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    import app as app_module
+    from bench_crud import seed_customers
+    from db_control import crud, mymodels_MySQL as mymodels
+    from db_control.connect_MySQL import engine
+    from responses import FastJSONResponse, orjson
+
+    seed_customers(engine, mymodels, rows, random.Random(42))
+    field = create_response_field(name="Response_bench", type_=list[app_module.CustomerResponse])
+    fields = app_module.CUSTOMER_FIELDS
+
+    timings = {name: {"query": [], "serialize": []} for name in ("pydantic", "fast")}
+    bodies = {}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result_list = crud.myselectAll(mymodels.Customers)
+        queried = time.perf_counter()
+        content = await serialize_response(field=field, response_content=result_list)
+        bodies["pydantic"] = JSONResponse(content).body
+        finished = time.perf_counter()
+        timings["pydantic"]["query"].append(queried - started)
+        timings["pydantic"]["serialize"].append(finished - queried)
+
+        started = time.perf_counter()
+        tuples = crud.myselect_rows(mymodels.Customers, fields)
+        queried = time.perf_counter()
+        bodies["fast"] = FastJSONResponse([dict(zip(fields, row)) for row in tuples]).body
+        finished = time.perf_counter()
+        timings["fast"]["query"].append(queried - started)
+        timings["fast"]["serialize"].append(finished - queried)
+
+    def by_id(body):
+        return sorted(json.loads(body), key=lambda row: row["internal_id"])
+
+    result = {"rows": rows, "encoder": "orjson" if orjson is not None else "json", "same_content": by_id(bodies["pydantic"]) == by_id(bodies["fast"])}
+    for name, parts in timings.items():
+        total = [q + s for q, s in zip(parts["query"], parts["serialize"])]
+        result[name] = {
+            "query_ms": _median_ms(parts["query"]),
+            "serialize_ms": _median_ms(parts["serialize"]),
+            "total_ms": _median_ms(total),
+            "rows_per_s": round(rows / statistics.median(total)),
+            "body_bytes": len(bodies[name]),
+        }
+    result["speedup"] = {
+        "serialize": round(result["pydantic"]["serialize_ms"] / result["fast"]["serialize_ms"], 2),
+        "total": round(result["pydantic"]["total_ms"] / result["fast"]["total_ms"], 2),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the pydantic and fast JSON paths for /allcustomers")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        use_local_database(workdir, "bench_serialization")
+        os.environ.setdefault("SQL_SLOW_QUERY_MS", "1000000")
+        sys.path.insert(0, ROOT)
+        for rows in args.rows:
+            result = asyncio.run(measure(rows, args.repeat))
+            print(f"{rows:>8} rows  pydantic {result['pydantic']['total_ms']:9.2f}ms "
+                  f"(serialize {result['pydantic']['serialize_ms']:9.2f}ms)  "
+                  f"fast {result['fast']['total_ms']:9.2f}ms (serialize {result['fast']['serialize_ms']:9.2f}ms)  "
+                  f"x{result['speedup']['total']}", file=sys.stderr)
+            results.append(result)
+
+    report = {**run_metadata(), "repeat": args.repeat, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
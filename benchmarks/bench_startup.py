@@ -0,0 +1,109 @@
+# 起動時間のベンチマーク
+#
+# 新しい Python プロセスで以下を計測し、runs 回の中央値・最小値を出す (プロセスごとに計測するのでキャッシュの影響を受けない)
+#   import_s        : import app にかかった時間
+#   startup_s       : lifespan の起動処理 (DB への接続確認) にかかった時間
+#   first_request_s : 起動後の最初の GET /healthz
+#   first_ready_s   : 最初の GET /readyz (プールから初めて接続を取り出す)
+#   process_s       : インタプリタの起動から最初のリクエストまでの合計
+# --importtime を付けると、python -X importtime でインポートに時間がかかっているモジュールの上位を表示する
+#
+# DATABASE_URL が未設定なら一時ディレクトリの SQLite を使う
+#
+# 実行例:
+#   python benchmarks/bench_startup.py --runs 10 --output startup.json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, run_metadata, use_local_database
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.app) as client:
+    ready = time.perf_counter()
+    client.get("/healthz")
+    first = time.perf_counter()
+    status = client.get("/readyz").status_code
+    first_ready = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "startup_s": ready - imported,
+    "first_request_s": first - ready,
+    "first_ready_s": first_ready - first,
+    "readyz_status": status,
+}))
+"""
+
+METRICS = ("import_s", "startup_s", "first_request_s", "first_ready_s", "process_s")
+
+
+def _env(workdir):
+    env = dict(os.environ)
+    use_local_database(workdir, "bench_startup", env)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def run_once(env) -> dict:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+
+def top_imports(env, limit: int = 15):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.rstrip()))
+    rows.sort(reverse=True)
+    return [{"module": module.strip(), "cumulative_ms": round(us / 1000, 1), "depth": (len(module) - len(module.lstrip())) // 2}
+            for us, module in rows[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="show the slowest imports")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = _env(workdir)
+        runs = [run_once(env) for _ in range(args.runs)]
+        result = {
+            **run_metadata(),
+            "runs": args.runs,
+            "readyz_status": runs[-1]["readyz_status"],
+            "median": {name: round(statistics.median(run[name] for run in runs), 4) for name in METRICS},
+            "min": {name: round(min(run[name] for run in runs), 4) for name in METRICS},
+        }
+        if args.importtime:
+            result["slowest_imports"] = top_imports(env)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
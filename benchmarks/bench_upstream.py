@@ -0,0 +1,117 @@
+# /fetchtest (upstream.UpstreamClient) のベンチマーク
+#
+# ローカルにスタブの HTTP サーバーを立て (応答まで --delay 秒かかる)、FETCHTEST_URL をそこに向けて
+# GET /fetchtest を --requests 件、--concurrency 並列で送る。
+# single-flight とキャッシュが効いていれば、upstream への呼び出しは 1 回 (TTL 切れのたびに 1 回) になる。
+# --no-cache ではキャッシュを無効にして (UPSTREAM_CACHE_TTL=0) まとめ込みだけの効果を見る。
+# --status を指定するとスタブがそのステータスを返し、エラー時の応答 (502) を確認できる。
+#
+# 実行例:
+#   python benchmarks/bench_upstream.py --requests 500 --concurrency 500 --delay 0.2
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import ROOT, percentile, run_metadata, use_local_database
+
+PAYLOAD = json.dumps([{"id": i, "name": f"user{i}"} for i in range(10)]).encode()
+
+
+def start_stub_server(delay: float, status: int):
+    """別スレッドでスタブサーバーを起動し、(server, 受けたリクエスト数を返す関数) を返す"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            time.sleep(delay)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, lambda: len(hits)
+
+
+async def run(args, upstream_hits) -> dict:
+    import httpx
+    import app as app_module
+
+    latencies = []
+    statuses = {}
+
+    async def one(client):
+        started = time.perf_counter()
+        response = await client.get("/fetchtest")
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited():
+                async with semaphore:
+                    await one(client)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(limited() for _ in range(args.requests)))
+            duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "upstream_calls": upstream_hits(),
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(args.requests / duration, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /fetchtest against a local stub upstream")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--delay", type=float, default=0.2, help="stub response delay in seconds")
+    parser.add_argument("--status", type=int, default=200, help="status code returned by the stub")
+    parser.add_argument("--no-cache", action="store_true", help="disable the TTL cache (coalescing only)")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    server, upstream_hits = start_stub_server(args.delay, args.status)
+    with tempfile.TemporaryDirectory() as workdir:
+        use_local_database(workdir, "bench_upstream")
+        os.environ["FETCHTEST_URL"] = f"http://127.0.0.1:{server.server_port}/users"
+        if args.no_cache:
+            os.environ["UPSTREAM_CACHE_TTL"] = "0"
+        sys.path.insert(0, ROOT)
+        result = asyncio.run(run(args, upstream_hits))
+    server.shutdown()
+
+    report = {**run_metadata(), "config": vars(args), "result": result}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
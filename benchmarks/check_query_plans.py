@@ -0,0 +1,233 @@
+# 実行計画のチェック
+#
+# アプリが実際に発行する SQL (crud の関数を呼んで before_cursor_execute で捕まえたもの) を EXPLAIN し、
+# 索引を使わない全件走査や、ORDER BY のための一時ソート (SQLite の TEMP B-TREE / MySQL の filesort) が
+# 起きていないかを確認する。問題があれば終了コード 1 を返す (CI 用)。
+#
+# 対象
+#   GET /customers/search の検索条件ごとの 1 ページ目と 2 ページ目 (カーソルあり)
+#   GET /customers/{internal_id}/purchases の 1 ページ目と 2 ページ目。
+#     実行計画に加えて、1 ページのクエリ数がページの件数によらず一定 (PURCHASE_HISTORY_QUERIES) であることも確認する (N+1 の検出)
+#   索引の列構成が mymodels_MySQL.py の定義と同じか (MySQL は列を DROP すると複合索引からその列だけを黙って外すので、
+#     migrate_uuid_binary_MySQL.py の cutover 後などに internal_id の抜けた索引が残っていないかを確認する)
+#
+# DATABASE_URL が未設定なら一時ディレクトリの SQLite にテストデータを入れて確認する。
+# MySQL などを指定した場合は既存のデータに対して EXPLAIN だけを行う (--reset でテーブルを作り直してデータを入れる)。
+#
+# 実行例:
+#   python benchmarks/check_query_plans.py
+#   DATABASE_URL=mysql+pymysql://... python benchmarks/check_query_plans.py
+import argparse
+import random
+import re
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert, inspect, select, text
+
+from common import ROOT, use_local_database
+
+# (名前, 検索条件, 索引を使わない走査を許すか)
+SEARCH_CASES = [
+    ("customer_id", {"customer_id": "S00000042"}, False),
+    ("name_prefix", {"customer_name": "seed-1"}, False),
+    ("age_range", {"age_min": 30, "age_max": 40}, False),
+    ("gender_age", {"gender": "female", "age_min": 30, "age_max": 40}, False),
+    ("gender", {"gender": "female"}, False), # 選択性が低いので主キー順に読んで LIMIT で打ち切る計画になる
+    ("name_text", {"q": "seed"}, None), # MySQL では全文索引を使う。それ以外の DB は部分一致なので全件走査になる
+    ("all", {}, False),
+]
+
+# 購入履歴 1 ページのクエリ数 (購入 + 明細と商品)
+PURCHASE_HISTORY_QUERIES = 2
+PURCHASE_HISTORY_LIMITS = (5, 50)
+
+
+class StatementCapture:
+    """with の間に実行された SQL とパラメータを記録する"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+
+def explain(engine, statement, parameters) -> list[str]:
+    """EXPLAIN の結果を 1 行 1 文字列で返す"""
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(prefix + statement, parameters)
+        if engine.dialect.name == "sqlite":
+            return [row[3] for row in result]
+        return [" ".join(f"{key}={value}" for key, value in row._mapping.items()) for row in result]
+
+
+def plan_problems(dialect_name: str, plan: list[str], allow_scan: bool, tables=("customers",)) -> list[str]:
+    problems = []
+    for line in plan:
+        if dialect_name == "sqlite":
+            match = re.fullmatch(r"SCAN (\w+)", line)
+            if match and match.group(1) in tables and not allow_scan:
+                problems.append("full table scan")
+            if "USE TEMP B-TREE" in line:
+                problems.append("sort without an index")
+        elif dialect_name == "mysql":
+            match = re.search(r"table=(\w+)", line)
+            if match and match.group(1) in tables and "type=ALL" in line and not allow_scan:
+                problems.append("full table scan")
+            if "Using filesort" in line:
+                problems.append("sort without an index")
+    return problems
+
+
+def check_search(engine, crud, mymodels, fields) -> bool:
+    ok = True
+    dialect_name = engine.dialect.name
+    for name, filters, allow_scan in SEARCH_CASES:
+        if allow_scan is None:
+            allow_scan = dialect_name != "mysql"
+        after = None
+        for page in (1, 2):
+            with StatementCapture(engine) as capture:
+                rows, next_after = crud.mysearch_customers(mymodels.Customers, fields, filters, 10, after)
+            statement, parameters = capture.statements[-1]
+            plan = explain(engine, statement, parameters)
+            problems = plan_problems(dialect_name, plan, allow_scan)
+            ok = ok and not problems
+            status = "FAIL " + ", ".join(problems) if problems else "ok"
+            print(f"search {name:12s} page {page}: {status}")
+            for line in plan:
+                print(f"    {line}")
+            if next_after is None:
+                break
+            after = next_after
+    return ok
+
+
+def check_indexes(engine, mymodels) -> bool:
+    ok = True
+    inspector = inspect(engine)
+    for table in mymodels.Base.metadata.sorted_tables:
+        actual = {index["name"]: index["column_names"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            expected = [column.name for column in index.columns]
+            if index.name not in actual:
+                if index.kwargs.get("mysql_prefix") == "FULLTEXT" and engine.dialect.name != "mysql":
+                    continue # MySQL でだけ作る索引
+                status = "FAIL missing (run db_control/create_indexes.py)"
+            elif actual[index.name] != expected:
+                status = f"FAIL columns ({', '.join(actual[index.name])}), expected ({', '.join(expected)})"
+            else:
+                status = "ok"
+            ok = ok and status == "ok"
+            print(f"index {table.name}.{index.name}: {status}")
+    return ok
+
+
+def seed_purchases(engine, mymodels, customer_ids, rng: random.Random, heavy_purchases: int = 300):
+    """顧客ごとに 0-3 件、先頭の顧客だけ heavy_purchases 件の購入 (明細 1-4 行) を入れる"""
+    item_ids = [f"I{i:03d}" for i in range(50)]
+    started = datetime(2024, 1, 1)
+    purchases = []
+    for index, customer_id in enumerate(customer_ids):
+        for _ in range(heavy_purchases if index == 0 else rng.randint(0, 3)):
+            purchases.append({
+                "purchase_id": len(purchases) + 1,
+                "customer_internal_id": uuid.UUID(str(customer_id)),
+                "purchase_date": started + timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            })
+    with engine.begin() as connection:
+        prices = {item_id: rng.randint(100, 10000) for item_id in item_ids}
+        connection.execute(insert(mymodels.Items), [
+            {"item_id": item_id, "item_name": f"item-{item_id}", "price": price} for item_id, price in prices.items()
+        ])
+        connection.execute(insert(mymodels.Purchases), purchases)
+        connection.execute(insert(mymodels.PurchaseDetails), [
+            {"purchase_id": purchase["purchase_id"], "item_id": item_id, "quantity": rng.randint(1, 5), "unit_price": prices[item_id]}
+            for purchase in purchases
+            for item_id in rng.sample(item_ids, rng.randint(1, 4))
+        ])
+
+
+def check_purchase_history(engine, crud, mymodels) -> bool:
+    with engine.connect() as connection:
+        customer_internal_id = connection.execute(
+            select(mymodels.Purchases.customer_internal_id)
+            .group_by(mymodels.Purchases.customer_internal_id)
+            .order_by(func.count().desc())
+            .limit(1)
+        ).scalar()
+    if customer_internal_id is None:
+        print("purchase history: skipped (no purchases)")
+        return True
+
+    ok = True
+    dialect_name = engine.dialect.name
+    tables = ("purchases", "purchase_details", "items")
+    for limit in PURCHASE_HISTORY_LIMITS:
+        after = None
+        for page in (1, 2):
+            with StatementCapture(engine) as capture:
+                purchases, next_after = crud.myselect_purchase_history(customer_internal_id, limit=limit, after=after)
+            problems = []
+            if purchases and len(capture.statements) != PURCHASE_HISTORY_QUERIES:
+                problems.append(f"{len(capture.statements)} queries for {len(purchases)} purchases")
+            plans = [explain(engine, statement, parameters) for statement, parameters in capture.statements]
+            for plan in plans:
+                problems += plan_problems(dialect_name, plan, False, tables)
+            ok = ok and not problems
+            status = "FAIL " + ", ".join(problems) if problems else "ok"
+            print(f"purchases limit {limit:<3d} page {page}: {status} ({len(capture.statements)} queries)")
+            for plan in plans:
+                for line in plan:
+                    print(f"    {line}")
+            if next_after is None:
+                break
+            after = next_after
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check query plans of the search and purchase history queries")
+    parser.add_argument("--rows", type=int, default=5000, help="rows inserted into the local database")
+    parser.add_argument("--reset", action="store_true", help="recreate tables on DATABASE_URL and insert test rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        local = use_local_database(workdir, "check_query_plans")
+        sys.path.insert(0, ROOT)
+        from bench_crud import seed_customers
+        from db_control import crud, mymodels_MySQL as mymodels
+        from db_control.connect_MySQL import engine
+        import app as app_module
+
+        if local or args.reset:
+            rng = random.Random(42)
+            customer_ids = seed_customers(engine, mymodels, args.rows, rng)
+            seed_purchases(engine, mymodels, customer_ids, rng)
+            if engine.dialect.name == "sqlite":
+                with engine.begin() as connection:
+                    connection.execute(text("ANALYZE")) # 実際の運用に近い統計情報で計画を立てさせる
+
+        ok = check_search(engine, crud, mymodels, app_module.CUSTOMER_FIELDS)
+        ok = check_purchase_history(engine, crud, mymodels) and ok
+        ok = check_indexes(engine, mymodels) and ok
+        engine.dispose()
+
+    print("all query plans ok" if ok else "some query plans need attention")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
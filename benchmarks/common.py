@@ -0,0 +1,53 @@
+# ベンチマークスクリプトの共通処理
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_local_database(workdir: str, name: str, env=None) -> bool:
+    """
+    DATABASE_URL が未設定なら workdir の SQLite を使うよう環境変数を設定する。
+    ローカルの DB を用意した場合は True (テーブルを作り直してよい) を返す。
+    """
+    env = os.environ if env is None else env
+    if env.get("DATABASE_URL"):
+        return False
+    db_path = os.path.join(workdir, f"{name}.db")
+    env["DATABASE_URL"] = f"sqlite:///{db_path}"
+    env["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    return True
+
+
+def percentile(sorted_values, q: float) -> float:
+    """ソート済みの値の q パーセンタイル (線形補間)"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata() -> dict:
+    """結果の JSON に含める実行環境の情報 (コミット間で比較するときの確認用)"""
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db_mode": os.getenv("DB_MODE", "sync"),
+        "cache_backend": os.getenv("CUSTOMER_CACHE_BACKEND", "local"),
+    }
@@ -0,0 +1,84 @@
+# 2 つのベンチマーク結果 (bench_crud.py の JSON) を比較する
+#
+# シナリオごとにスループット・p50/p95/p99・SQL 件数の変化率を表示する。
+# --threshold を指定すると、p95 がその割合 (%) 以上悪化したシナリオがあれば終了コード 1 を返す (CI 用)
+#
+# 実行例:
+#   python benchmarks/compare.py before.json after.json --threshold 10
+import argparse
+import json
+import sys
+
+COLUMNS = (
+    ("throughput_rps", ("throughput_rps",)),
+    ("p50_ms", ("latency_ms", "p50")),
+    ("p95_ms", ("latency_ms", "p95")),
+    ("p99_ms", ("latency_ms", "p99")),
+    ("queries", ("queries_per_request", "mean")),
+)
+
+
+def _get(summary: dict, path):
+    for key in path:
+        summary = summary[key]
+    return summary
+
+
+def _change(before: float, after: float) -> float | None:
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(before: dict, after: dict) -> list[dict]:
+    rows = []
+    for scenario, after_summary in after["scenarios"].items():
+        before_summary = before["scenarios"].get(scenario)
+        if before_summary is None:
+            continue
+        row = {"scenario": scenario}
+        for name, path in COLUMNS:
+            old, new = _get(before_summary, path), _get(after_summary, path)
+            row[name] = (old, new, _change(old, new))
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two bench_crud.py results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, help="fail if any p95 latency regresses by this many percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before.get('commit')} ({before.get('db_mode')}, {before.get('dialect')})  "
+          f"after: {after.get('commit')} ({after.get('db_mode')}, {after.get('dialect')})")
+    if before.get("config") != after.get("config"):
+        print("warning: the runs used different configurations", file=sys.stderr)
+
+    rows = compare(before, after)
+    print(f"{'scenario':10s}" + "".join(f"{name:>28s}" for name, _ in COLUMNS))
+    regressions = []
+    for row in rows:
+        cells = []
+        for name, _ in COLUMNS:
+            old, new, change = row[name]
+            change_text = "   n/a" if change is None else f"{change:+6.1f}%"
+            cells.append(f"{old:>10.2f} -> {new:>9.2f} {change_text}")
+        print(f"{row['scenario']:10s}" + "".join(f"{cell:>28s}" for cell in cells))
+        p95_change = row["p95_ms"][2]
+        if args.threshold is not None and p95_change is not None and p95_change > args.threshold:
+            regressions.append(row["scenario"])
+
+    if regressions:
+        print(f"p95 latency regressed by more than {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+from sqlalchemy import inspect, text
+
+from db_control.connect_MySQL import engine
+
+# 既存の customers テーブルに楽観的排他制御用の version カラムを追加する
+# (create_all は既存のテーブルにカラムを追加しないため。既存の行は version=1 から始まる)
+if __name__ == "__main__":
+    print(f"Adding customers.version on: {engine.url}")
+    columns = {column["name"] for column in inspect(engine).get_columns("customers")}
+    if "version" in columns:
+        print("  customers.version: already exists")
+    else:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE customers ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+        print("  customers.version: added")
+    print("Done")
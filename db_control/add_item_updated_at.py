@@ -0,0 +1,37 @@
+from sqlalchemy import inspect, text
+
+from db_control.connect_MySQL import engine
+from db_control.mymodels_MySQL import ITEMS_UPDATED_AT_DDL
+
+# 既存の items テーブルに商品カタログの差分更新用の updated_at カラムと索引を追加する
+# (create_all は既存のテーブルにカラムを追加しないため。既存の行は実行時の時刻になる)
+# UPDATE のたびに DB 側で updated_at を更新する設定 (MySQL の ON UPDATE / SQLite のトリガー) は
+# カラムがすでにあっても付け直す (create_all で作った古いスキーマは ORM 経由の UPDATE でしか更新されなかった)
+if __name__ == "__main__":
+    print(f"Adding items.updated_at on: {engine.url}")
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("items")}
+    indexes = {index["name"] for index in inspector.get_indexes("items")}
+    with engine.begin() as connection:
+        if "updated_at" in columns:
+            print("  items.updated_at: already exists")
+        elif engine.dialect.name == "mysql":
+            connection.execute(text(
+                "ALTER TABLE items ADD COLUMN updated_at DATETIME NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"
+            ))
+            print("  items.updated_at: added")
+        else:
+            # SQLite は ALTER TABLE で非定数の DEFAULT を付けられないので、追加してから埋める
+            connection.execute(text("ALTER TABLE items ADD COLUMN updated_at DATETIME"))
+            connection.execute(text("UPDATE items SET updated_at = CURRENT_TIMESTAMP"))
+            print("  items.updated_at: added")
+        if engine.dialect.name in ITEMS_UPDATED_AT_DDL:
+            connection.execute(text(ITEMS_UPDATED_AT_DDL[engine.dialect.name]))
+            print("  items.updated_at: updated on every UPDATE")
+        if "ix_items_updated_at" in indexes:
+            print("  ix_items_updated_at: already exists")
+        else:
+            connection.execute(text("CREATE INDEX ix_items_updated_at ON items (updated_at)"))
+            print("  ix_items_updated_at: added")
+    print("Done")
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+
+from db_control.connect_MySQL import engine
+
+# 既存の purchase_details テーブルに購入時の単価 unit_price カラムを追加する
+# (create_all は既存のテーブルにカラムを追加しないため)
+# 既存の行は購入時の価格が残っていないので、実行時点の items.price で埋める
+# (集計テーブルもそれまでは現在の価格で計算していたので、埋めたあとに rebuild_rollups を実行しても金額は変わらない)
+if __name__ == "__main__":
+    print(f"Adding purchase_details.unit_price on: {engine.url}")
+    columns = {column["name"] for column in inspect(engine).get_columns("purchase_details")}
+    backfill = (
+        "UPDATE purchase_details SET unit_price = "
+        "(SELECT items.price FROM items WHERE items.item_id = purchase_details.item_id)"
+    )
+    with engine.begin() as connection:
+        if "unit_price" in columns:
+            print("  purchase_details.unit_price: already exists")
+        elif engine.dialect.name == "mysql":
+            connection.execute(text("ALTER TABLE purchase_details ADD COLUMN unit_price INT NULL"))
+            connection.execute(text(backfill))
+            connection.execute(text("ALTER TABLE purchase_details MODIFY COLUMN unit_price INT NOT NULL"))
+            print("  purchase_details.unit_price: added")
+        else:
+            # SQLite は ALTER TABLE でカラムを NOT NULL に変えられないので、定数の既定値を付けて追加してから埋める
+            connection.execute(text("ALTER TABLE purchase_details ADD COLUMN unit_price INTEGER NOT NULL DEFAULT 0"))
+            connection.execute(text(backfill))
+            print("  purchase_details.unit_price: added")
+    print("Done")
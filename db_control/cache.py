@@ -0,0 +1,266 @@
+# 主キー (internal_id) 単位の読み取りキャッシュ
+# crud の myselect_by_internal_id が読み取り時に埋め、myinsert_orm / myupdate_orm / mypatch / mydelete_orm が書き込み時に更新・削除する
+#
+# 読み取りと書き込みが競合しても古い行で上書きしないように
+# - set は行の version が今のエントリより古ければ何もしない
+#   (書き込み前に読んだ行を、書き込み後に set しても書き込み側の新しい行が残る)
+# - delete は TTL の間「削除済み」の印を残し、その間の set を無視する
+#   (行の削除のあと。削除前に読んだ行で埋め直されないようにする)
+# - delete に version を渡すと、その version より古い値の set だけを無視する
+#   (更新後の行を読んでいない更新のあと。更新後の行を読めばすぐに埋め直せる)
+#
+# バックエンドは環境変数で切り替える
+#   CUSTOMER_CACHE_BACKEND = local (既定、プロセス内 LRU) / redis (gunicorn の複数ワーカーで共有) / none (無効)
+#   CUSTOMER_CACHE_TTL      = エントリの有効秒数
+#   CUSTOMER_CACHE_MAX_SIZE = local バックエンドの最大件数 (超えたら古いものから追い出す)
+#   CUSTOMER_CACHE_REDIS_URL = redis バックエンドの接続先
+# local バックエンドはワーカーごとに独立しているので、他ワーカーでの更新は TTL が切れるまで反映されない。
+# ワーカー間で整合性が必要な場合は redis を使う。
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from uuid import UUID
+
+_DELETED = "__deleted__" # delete の印のキー (値はテーブルの行の dict なので衝突しない)
+
+
+def _tombstone(version) -> dict:
+    # delete の印。version が None ならすべての set を、そうでなければ version より古い値の set を無視する
+    return {_DELETED: True, "version": version}
+
+def _is_tombstone(value) -> bool:
+    return isinstance(value, dict) and _DELETED in value
+
+def _rejects(current, value: dict) -> bool:
+    # 今のエントリ current が value の set を拒むか
+    if _is_tombstone(current) and (current["version"] is None or value.get("version") is None):
+        return True
+    return _is_older(value, current)
+
+
+def _is_older(value: dict, current) -> bool:
+    # current (今のエントリ) より value の version が古いか。version のない値は比べない
+    return (
+        isinstance(current, dict)
+        and value.get("version") is not None and current.get("version") is not None
+        and value["version"] < current["version"]
+    )
+
+
+class CacheBackend(ABC):
+    """キャッシュバックエンドのインターフェース。値は JSON 化できる dict を想定"""
+
+    # get / set / delete がネットワーク I/O を伴うか (True なら crud_async はスレッドプールで呼ぶ)
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str):
+        """値 (なければ None)"""
+
+    @abstractmethod
+    def set(self, key: str, value: dict):
+        """値を入れる。削除の印があるか、今の値より version が古ければ何もしない"""
+
+    @abstractmethod
+    def delete(self, key: str, version: int | None = None):
+        """値を消し、TTL の間は set を無視する (version を渡すと、それより古い値の set だけを無視する)"""
+
+    @abstractmethod
+    def clear(self):
+        """すべての値と削除の印を消す"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """/cache/stats と metrics 用の集計"""
+
+
+class NullCache(CacheBackend):
+    """キャッシュ無効時のバックエンド (常にミス)"""
+
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key, version=None):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": "none", "hits": 0, "misses": self.misses}
+
+
+class LocalTTLCache(CacheBackend):
+    """プロセス内の TTL 付き LRU キャッシュ (スレッドセーフ)"""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 30.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict() # key -> (expires_at, value)。末尾が最近使ったもの
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if _is_tombstone(value):
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _put(self, key, value):
+        # ロックを持った状態で呼ぶ
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                if _rejects(entry[1], value):
+                    return
+            self._put(key, value)
+
+    def delete(self, key, version=None):
+        with self._lock:
+            self._put(key, _tombstone(version))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {
+            "backend": "local",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": size,
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class RedisCache(CacheBackend):
+    """
+    Redis を使う共有キャッシュ。複数の gunicorn ワーカー・複数インスタンスで同じエントリを見るので、
+    どのワーカーで書き込んでも他のワーカーの読み取りに即座に反映される。
+    LRU による追い出しは Redis 側の maxmemory-policy (allkeys-lru など) に任せる。
+    set の version の比較は Lua スクリプトで Redis 側で行う (読んでから書くまでの間に他のワーカーが書いても古い値で上書きしない)
+    """
+
+    blocking = True
+
+    # KEYS[1] = キー、ARGV = (値の JSON, version (なければ空文字), TTL ミリ秒, 削除の印のキー)
+    # 判定は _rejects と同じ (削除の印に version がなければ拒否、あればそれより古い値だけ拒否)
+    _SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, decoded = pcall(cjson.decode, current)
+    if not ok then return 0 end -- 以前の形式の削除の印 (JSON ではない文字列)
+    local version = tonumber(ARGV[2])
+    local current_version = decoded['version']
+    if decoded[ARGV[4]] and (type(current_version) ~= 'number' or not version) then return 0 end
+    if version and type(current_version) == 'number' and version < current_version then return 0 end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+return 1
+"""
+
+    def __init__(self, url: str, ttl_seconds: float = 30.0, prefix: str = "cache:"):
+        try:
+            import redis # 任意依存。redis バックエンドを使うときだけ必要
+        except ImportError as e:
+            raise RuntimeError("CUSTOMER_CACHE_BACKEND=redis には redis パッケージが必要です (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self._set = self._client.register_script(self._SET_SCRIPT)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0 # ヒット・ミスはこのワーカーでの集計
+        self.misses = 0
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        # 以前の形式の削除の印 (JSON ではない文字列) も削除の印として扱う
+        value = json.loads(raw) if raw is not None and raw != _DELETED.encode() else None
+        if value is None or _is_tombstone(value):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        version = value.get("version")
+        self._set(
+            keys=[self.prefix + key],
+            args=[json.dumps(value, ensure_ascii=False), "" if version is None else version, int(self.ttl_seconds * 1000), _DELETED],
+        )
+
+    def delete(self, key, version=None):
+        self._client.set(self.prefix + key, json.dumps(_tombstone(version)), px=int(self.ttl_seconds * 1000))
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + "*"):
+            self._client.delete(key)
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl_seconds}
+
+
+def create_cache_from_env() -> CacheBackend:
+    backend = os.getenv('CUSTOMER_CACHE_BACKEND', 'local').lower()
+    ttl = float(os.getenv('CUSTOMER_CACHE_TTL', '30'))
+    if backend == "none":
+        return NullCache()
+    if backend == "redis":
+        return RedisCache(os.getenv('CUSTOMER_CACHE_REDIS_URL', 'redis://localhost:6379/0'), ttl_seconds=ttl)
+    return LocalTTLCache(max_size=int(os.getenv('CUSTOMER_CACHE_MAX_SIZE', '10000')), ttl_seconds=ttl)
+
+
+def cache_key(mymodel, internal_id) -> str:
+    # テーブル名を含めて、モデルが増えてもキーが衝突しないようにする
+    return f"{mymodel.__tablename__}:{internal_id}"
+
+
+def to_cache_value(db_item) -> dict:
+    """ORMオブジェクトをキャッシュ用の dict に変換 (UUID は文字列にして JSON 化できるようにする)"""
+    value = {}
+    for column in db_item.__table__.columns:
+        v = getattr(db_item, column.key)
+        value[column.key] = str(v) if isinstance(v, UUID) else v
+    return value
+
+
+# プロセス全体で共有するキャッシュ
+customer_cache = create_cache_from_env()
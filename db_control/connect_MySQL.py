@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 
 import os
 from dotenv import load_dotenv
+from db_control.instrumentation import SQL_ECHO, instrument_engine, pool_stats as _pool_stats
+from db_control.pool_settings import pool_options
 
 # 環境変数の読み込み
 load_dotenv()
@@ -14,34 +16,64 @@ DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 
 # MySQLのURL構築
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# DATABASE_URL が設定されていればそちらを優先 (ローカル検証用に sqlite:///local.db なども指定できる)
+DATABASE_URL = os.getenv('DATABASE_URL') or f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 SSL_CA_PATH = os.getenv('SSL_CA_PATH')
+
+# DB アクセス方式の切り替え: "sync" (従来の Session + スレッドプール) / "async" (AsyncSession)
+# 両方を同じコードベースで動かしてベンチマーク比較できるようにしている
+DB_MODE = os.getenv('DB_MODE', 'sync').lower()
+
 # エンジンの作成
 engine = create_engine(
     DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,
-    pool_recycle=3600,
+    echo=SQL_ECHO, # 全件ログは SQL_ECHO=true のときだけ (通常はサンプリング + スロークエリのログ)
+    **pool_options(DATABASE_URL), # プールのサイズ・タイムアウトなどは環境変数で調整する (db_control/pool_settings.py)
     connect_args={
         # "ssl_ca": SSL_CA_PATH
         "ssl_verify_cert": True
-    }
+    } if DATABASE_URL.startswith("mysql") else {}
 )
 
-# --- 接続テスト (任意だが推奨) ---
-def test_db_connection():
+# SQL ごとの実行時間・プール待ち時間を計測する (/metrics で公開)
+instrument_engine(engine)
+
+# fork された子プロセス (gunicorn の preload_app、multiprocessing など) では、親が開いた接続を使わずに
+# 新しいプールから始める。close=False なので親の接続 (ソケット) を子から閉じてしまうこともない
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+if engine.dialect.name == "sqlite":
+    # SQLite は既定で外部キーを検証しないので、MySQL と同じく制約違反をエラーにする
+    @event.listens_for(engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+# --- 接続テスト ---
+# インポート時には接続しない (起動が遅くなり、DB が一時的に落ちているとワーカーが起動できなくなるため)
+# アプリでは app.py の lifespan と /readyz から ping_db を呼ぶ
+def ping_db() -> bool:
+    """プールから接続を取り出して SELECT 1 を実行できるか確認する"""
     try:
-        with engine.connect() as connection: # 実際に接続を試みる
-            print("Successfully connected to the database via SQLAlchemy engine!")
-            print(f"Connected to: {engine.url}") # 接続先URLを再確認
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
     except Exception as e:
         print(f"Failed to connect to the database via SQLAlchemy engine: {e}")
+        return False
+
+def dispose_engine():
+    engine.dispose()
+
+def pool_stats() -> dict:
+    return _pool_stats(engine.pool)
+
+def test_db_connection():
+    if ping_db():
+        print("Successfully connected to the database via SQLAlchemy engine!")
+        print(f"Connected to: {engine.url}") # 接続先URLを再確認
 
 if __name__ == "__main__": # このファイルが直接実行された場合にテスト
-    test_db_connection()
-else: # app.py などからインポートされた場合にテスト (任意)
-    # アプリケーション起動時に一度だけ接続テストを行う場合
-    # ただし、FastAPIの起動シーケンスによっては、ここでエラーになるとアプリが起動しない可能性も
-    test_db_connection()
-    # pass
\ No newline at end of file
+    test_db_connection()
\ No newline at end of file
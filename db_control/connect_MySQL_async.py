@@ -0,0 +1,63 @@
+import os
+import ssl
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+# 接続情報・SSL設定は同期版と共通 (.env の読み込みも connect_MySQL 側で行われる)
+from db_control.connect_MySQL import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, SSL_CA_PATH
+from db_control.instrumentation import SQL_ECHO, instrument_engine, pool_stats as _pool_stats
+from db_control.pool_settings import pool_options
+
+# 非同期ドライバ (aiomysql) 用のURL
+# ASYNC_DATABASE_URL が設定されていればそちらを優先 (テスト・ローカル検証では sqlite+aiosqlite:///local.db など)
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL') or f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+def _connect_args():
+    if not ASYNC_DATABASE_URL.startswith("mysql"):
+        return {}
+    # aiomysql は pymysql の ssl_verify_cert ではなく SSLContext を受け取る
+    # SSL_CA_PATH が未設定ならシステムのCAで検証する (同期版の ssl_verify_cert=True と同じ挙動)
+    return {"ssl": ssl.create_default_context(cafile=SSL_CA_PATH)}
+
+# 非同期エンジンの作成 (設定は同期版の engine に合わせる)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=SQL_ECHO,
+    **pool_options(ASYNC_DATABASE_URL),
+    connect_args=_connect_args(),
+)
+
+instrument_engine(async_engine.sync_engine)
+
+# 同期版と同じく、fork された子プロセスでは親の接続を引き継がない
+os.register_at_fork(after_in_child=lambda: async_engine.sync_engine.dispose(close=False))
+
+if async_engine.dialect.name == "sqlite":
+    # 同期版と同じく SQLite でも外部キーを検証する
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+# commit 後に属性を再読み込みしないようにする
+# (AsyncSession では期限切れ属性への暗黙の遅延ロードができないため)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+# 同期版 (connect_MySQL.ping_db / dispose_engine) と同じ役割の async 版
+async def ping_db() -> bool:
+    try:
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        print(f"Failed to connect to the database via SQLAlchemy async engine: {e}")
+        return False
+
+async def dispose_engine():
+    await async_engine.dispose()
+
+def pool_stats() -> dict:
+    return _pool_stats(async_engine.sync_engine.pool)
+
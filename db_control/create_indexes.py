@@ -0,0 +1,28 @@
+import time
+
+from sqlalchemy import inspect
+
+from db_control.connect_MySQL import engine
+from db_control.mymodels_MySQL import Base
+
+# mymodels_MySQL.py に追加された索引のうち、既存のテーブルにまだないものを作成する
+# (create_all は既存のテーブルには索引を追加しないため。MySQL の全文索引などは ddl_if に従って対象の DB でだけ作られる)
+# 大きなテーブルでは索引の作成に時間がかかるので、負荷の低い時間帯に実行する
+if __name__ == "__main__":
+    print(f"Creating missing indexes on: {engine.url}")
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            started = time.perf_counter()
+            index.create(engine)
+            if index.name in {created["name"] for created in inspect(engine).get_indexes(table.name)}:
+                print(f"  {table.name}.{index.name}: {time.perf_counter() - started:.1f}s")
+            else:
+                print(f"  {table.name}.{index.name}: skipped (not used on {engine.dialect.name})")
+    print("Done")
@@ -93,10 +93,10 @@ def insert_sample_data():
 
             if item1 and item2 and item3:
                 details = [
-                    PurchaseDetails(purchase_id=purchase1.purchase_id, item_id=item1.item_id, quantity=1),
-                    PurchaseDetails(purchase_id=purchase1.purchase_id, item_id=item2.item_id, quantity=1),
-                    PurchaseDetails(purchase_id=purchase2.purchase_id, item_id=item3.item_id, quantity=2),
-                    PurchaseDetails(purchase_id=purchase2.purchase_id, item_id=item2.item_id, quantity=1),
+                    PurchaseDetails(purchase_id=purchase1.purchase_id, item_id=item1.item_id, quantity=1, unit_price=item1.price),
+                    PurchaseDetails(purchase_id=purchase1.purchase_id, item_id=item2.item_id, quantity=1, unit_price=item2.price),
+                    PurchaseDetails(purchase_id=purchase2.purchase_id, item_id=item3.item_id, quantity=2, unit_price=item3.price),
+                    PurchaseDetails(purchase_id=purchase2.purchase_id, item_id=item2.item_id, quantity=1, unit_price=item2.price),
                 ]
                 session.add_all(details)
         else:
@@ -1,16 +1,94 @@
-# uname() error回避
-import platform
-print("platform", platform.uname())
-
-
-from sqlalchemy import create_engine, insert, delete, update, select
+from sqlalchemy import create_engine, insert, delete, update, select, and_, or_, func
+from sqlalchemy.dialects.mysql import match
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, selectinload, joinedload
 import json
-import pandas as pd
 from db_control.connect_MySQL import engine
-from db_control.mymodels_MySQL import Customers
+from db_control.mymodels_MySQL import Customers, Items, Purchases, PurchaseDetails, TableVersions
+from db_control.cache import customer_cache, cache_key, to_cache_value
+from db_control import rollups
+from db_control.uuid_types import new_internal_id
 from uuid import UUID
+from datetime import datetime, timedelta, timezone
+
+
+class PurchaseError(Exception):
+    """購入登録の入力エラー (app.py で 4xx に変換する)"""
+
+class CustomerNotFoundError(PurchaseError):
+    def __init__(self, customer_internal_id):
+        super().__init__(f"Customer not found: {customer_internal_id}")
+        self.customer_internal_id = customer_internal_id
+
+class UnknownItemsError(PurchaseError):
+    def __init__(self, item_ids):
+        super().__init__(f"Unknown item_id: {', '.join(item_ids)}")
+        self.item_ids = item_ids
+
+
+class VersionMismatchError(Exception):
+    """If-Match で指定されたバージョンが現在の行と一致しない (app.py で 412 に変換する)"""
+    def __init__(self, current_version: int):
+        super().__init__(f"Version mismatch: current version is {current_version}")
+        self.current_version = current_version
+
+class DuplicateCustomerIdError(Exception):
+    """customer_id の一意制約違反 (app.py で 409 に変換する)"""
+    def __init__(self, customer_id):
+        super().__init__("customer_id already exists")
+        self.customer_id = customer_id
+
+class CustomerHasPurchasesError(Exception):
+    """削除しようとした顧客に購入履歴がある (外部キー制約違反。app.py で 409 に変換する)"""
+    def __init__(self, internal_id):
+        super().__init__("Customer has purchases")
+        self.internal_id = internal_id
+
+
+# --- テーブルのバージョン (一覧の条件付き GET) ---
+# 書き込み関数はコミットの後に、別の短いトランザクションで table_versions の該当行を +1 する。
+# table_versions の行はテーブルごとに 1 行しかないので、顧客の書き込みトランザクションの中で加算すると
+# すべての書き込みがコミットまでこの行のロックを待ち合う (書き込みが直列になる)。コミット後なら行ロックは 1 文の間だけ。
+# 加算の前に一覧を読んだクライアントは古いバージョンで新しい内容を受け取るが、次の加算で ETag が変わるので 200 で読み直す。
+# 読み取り側は mytable_version の主キー検索 1 回で、前回から変わったかどうかを判定できる
+
+def _table_version_bump(dialect_name: str, mymodel):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return rollups._upsert(
+        dialect_name, TableVersions,
+        [{"table_name": mymodel.__tablename__, "version": 1, "updated_at": now}],
+        key_columns=["table_name"], add_columns=["version"], max_columns=["updated_at"],
+    )
+
+def _bump_table_version(mymodel):
+    # 書き込みはコミット済みなので、加算に失敗しても書き込みは失敗にしない (次の書き込みで ETag は変わる)
+    try:
+        with engine.begin() as connection:
+            connection.execute(_table_version_bump(engine.dialect.name, mymodel))
+    except Exception as e:
+        print(f"Error in _bump_table_version: {e}")
+
+def _table_version_query(mymodel):
+    return select(TableVersions.version, TableVersions.updated_at).where(TableVersions.table_name == mymodel.__tablename__)
+
+def mytable_version(mymodel):
+    """(version, updated_at)。まだ書き込みがなければ (0, None)、エラー時は None"""
+    with Session(engine) as session:
+        try:
+            row = session.execute(_table_version_query(mymodel)).first()
+        except Exception as e:
+            print(f"Error in mytable_version: {e}")
+            return None
+    return (row.version, row.updated_at) if row else (0, None)
+
+def myselect_version(mymodel, internal_id: UUID) -> int | None:
+    # 行の version だけを主キーで読む (行がなければ None)
+    with Session(engine) as session:
+        try:
+            return session.scalar(_current_version_query(mymodel, internal_id))
+        except Exception as e:
+            print(f"Error in myselect_version: {e}")
+            return None
 
 
 def myinsert(mymodel, values):
@@ -24,6 +102,7 @@ def myinsert(mymodel, values):
         with session.begin():
             # データの挿入
             result = session.execute(query)
+        _bump_table_version(mymodel)
     except sqlalchemy.exc.IntegrityError:
         print("一意制約違反により、挿入に失敗しました")
         session.rollback()
@@ -33,23 +112,272 @@ def myinsert(mymodel, values):
     return "inserted"
 
 def myinsert_orm(mymodel, values: dict): # values は Pydantic モデルの dict
+    # customer_id が重複していれば DuplicateCustomerIdError、その他のエラーは None
     with Session(engine) as session:
         try:
-            # internal_id はモデル定義の default=uuid.uuid4 で自動生成されるので、values には不要
+            # internal_id はモデル定義の default=new_internal_id で自動生成されるので、values には不要
             db_item = mymodel(**values)
             session.add(db_item)
             session.commit()
+            _bump_table_version(mymodel)
             session.refresh(db_item) # DBから最新の状態（生成されたinternal_idなど）を読み込む
+            customer_cache.set(cache_key(mymodel, db_item.internal_id), to_cache_value(db_item))
             return db_item # ORMオブジェクトを返す
         except sqlalchemy.exc.IntegrityError as e:
             print(f"IntegrityError during insert: {e}")
             session.rollback()
-            return None
+            raise DuplicateCustomerIdError(values.get("customer_id"))
         except Exception as e:
             print(f"Error in myinsert_orm: {e}")
             session.rollback()
             return None
 
+def _bulk_prepare(values_list: list[dict]):
+    """
+    バルク登録の前処理。internal_id を採番し、リクエスト内での customer_id 重複を弾く。
+    戻り値: (結果リスト (未確定の行は None), 登録候補の (index, 行dict) リスト)
+    """
+    results = [None] * len(values_list)
+    seen = set()
+    candidates = []
+    for i, values in enumerate(values_list):
+        customer_id = values["customer_id"]
+        if customer_id in seen:
+            results[i] = {"status": "error", "customer_id": customer_id, "error": "duplicate customer_id in request"}
+            continue
+        seen.add(customer_id)
+        candidates.append((i, {**values, "internal_id": new_internal_id()}))
+    return results, candidates
+
+def _bulk_exclude_existing(results, candidates, existing_ids):
+    rows = []
+    for i, row in candidates:
+        if row["customer_id"] in existing_ids:
+            results[i] = {"status": "error", "customer_id": row["customer_id"], "error": "customer_id already exists"}
+        else:
+            rows.append((i, row))
+    return rows
+
+def _bulk_created(row):
+    return {"status": "created", "customer_id": row["customer_id"], "internal_id": str(row["internal_id"])}
+
+def mybulkinsert_orm(mymodel, values_list: list[dict]) -> list[dict]:
+    """
+    複数の顧客を 1 トランザクション・multi-row INSERT (executemany) でまとめて登録する。
+    customer_id の一意制約違反は行ごとの結果として返し、バッチ全体は失敗させない。
+    戻り値は values_list と同じ順序の結果 dict のリスト。
+    """
+    results, candidates = _bulk_prepare(values_list)
+    rows = []
+    with Session(engine) as session:
+        try:
+            # 既存の customer_id を 1 回の IN 検索でまとめて確認する
+            customer_ids = [row["customer_id"] for _, row in candidates]
+            existing_ids = set(session.scalars(select(mymodel.customer_id).where(mymodel.customer_id.in_(customer_ids))))
+            rows = _bulk_exclude_existing(results, candidates, existing_ids)
+            if rows:
+                session.execute(insert(mymodel), [row for _, row in rows])
+            session.commit()
+            if rows:
+                _bump_table_version(mymodel)
+            for i, row in rows:
+                results[i] = _bulk_created(row)
+        except sqlalchemy.exc.IntegrityError:
+            # 確認後に別リクエストが同じ customer_id を登録した場合など。
+            # 1 行ずつ SAVEPOINT で入れ直して、違反した行だけをエラーにする
+            session.rollback()
+            for i, row in rows:
+                try:
+                    with session.begin_nested():
+                        session.execute(insert(mymodel), [row])
+                    results[i] = _bulk_created(row)
+                except sqlalchemy.exc.IntegrityError as e:
+                    results[i] = {"status": "error", "customer_id": row["customer_id"], "error": f"integrity error: {e.orig}"}
+            session.commit()
+            if any(result is not None and result["status"] == "created" for result in results):
+                _bump_table_version(mymodel)
+    return results
+
+def _merge_purchase_lines(lines: list[dict]) -> dict:
+    # 同じ item_id が複数行あれば数量を合算する (purchase_details の主キーは (purchase_id, item_id))
+    quantities = {}
+    for line in lines:
+        quantities[line["item_id"]] = quantities.get(line["item_id"], 0) + line["quantity"]
+    return quantities
+
+def _items_query(item_ids):
+    return select(Items.item_id, Items.item_name, Items.price).where(Items.item_id.in_(item_ids))
+
+def _check_items(quantities: dict, items: dict):
+    missing = [item_id for item_id in quantities if item_id not in items]
+    if missing:
+        raise UnknownItemsError(missing)
+
+def _purchase_rows(quantities: dict, items: dict, purchase_id: int):
+    """
+    明細の INSERT 用の行と、レスポンス用の明細・合計金額を作る。
+    請求する単価は items (カタログまたは DB) から 1 回だけ読み、明細の unit_price・レスポンスの小計と合計・
+    集計テーブルへの加算 (rollups.rollup_statements に lines と total を渡す) のすべてに同じ値を使う。
+    """
+    detail_rows = []
+    lines = []
+    total = 0
+    for item_id, quantity in quantities.items():
+        item = items[item_id]
+        unit_price = item.price
+        subtotal = unit_price * quantity
+        total += subtotal
+        detail_rows.append({"purchase_id": purchase_id, "item_id": item_id, "quantity": quantity, "unit_price": unit_price})
+        lines.append({"item_id": item_id, "item_name": item.item_name, "price": unit_price, "quantity": quantity, "subtotal": subtotal})
+    return detail_rows, lines, total
+
+def _catalog_items(quantities: dict, catalog_items):
+    # 商品カタログのスナップショットに全商品がそろっていればそれを使う (1 つでも欠けていれば None で DB から読む)
+    if catalog_items is None or any(item_id not in catalog_items for item_id in quantities):
+        return None
+    return {item_id: catalog_items[item_id] for item_id in quantities}
+
+def myinsert_purchase(customer_internal_id: UUID, lines: list[dict], purchase_date: datetime | None = None, catalog_items=None) -> dict:
+    """
+    購入ヘッダ (purchases) と明細 (purchase_details) を 1 トランザクションで登録する。
+    商品は IN 検索 1 回でまとめて確認し、明細は multi-row INSERT 1 回で入れる (商品数によらず一定の往復回数)。
+    catalog_items (item_id -> item_name / price を持つオブジェクト) に全商品があれば、商品の検索を省く
+    (価格はカタログの値で登録する。カタログに残っている削除済みの商品は明細の外部キー違反で見つけ、UnknownItemsError にする)。
+    登録した価格は明細の unit_price に残すので、購入履歴と集計テーブルの金額はレスポンスの total と一致する。
+    存在しない顧客・商品は CustomerNotFoundError / UnknownItemsError を送出する。
+    """
+    quantities = _merge_purchase_lines(lines)
+    purchase_date = purchase_date or datetime.now() # サーバー側デフォルトを読み直す往復を省くためアプリ側で決める
+    with Session(engine) as session:
+        try:
+            items = _catalog_items(quantities, catalog_items)
+            if items is None:
+                items = {item.item_id: item for item in session.execute(_items_query(list(quantities)))}
+            _check_items(quantities, items) # INSERT 前に存在しない商品を弾く
+
+            purchase = Purchases(customer_internal_id=customer_internal_id, purchase_date=purchase_date)
+            session.add(purchase)
+            try:
+                session.flush() # ヘッダの INSERT で purchase_id を確定 (顧客は外部キーで検証される)
+            except sqlalchemy.exc.IntegrityError:
+                raise CustomerNotFoundError(customer_internal_id)
+
+            purchase_id = purchase.purchase_id # commit 後は属性が期限切れになるので控えておく
+            detail_rows, result_lines, total = _purchase_rows(quantities, items, purchase_id)
+            try:
+                session.execute(insert(PurchaseDetails), detail_rows)
+            except sqlalchemy.exc.IntegrityError:
+                # カタログには残っているが DB からは削除された商品 (外部キー違反)。DB で確認し直して未知の商品として返す
+                session.rollback()
+                _check_items(quantities, {item.item_id: item for item in session.execute(_items_query(list(quantities)))})
+                raise
+            # 集計テーブルも同じトランザクションで加算しておく (分析エンドポイントは集計済みの行だけを読む)
+            for stmt in rollups.rollup_statements(engine.dialect.name, customer_internal_id, purchase_date, result_lines, total):
+                session.execute(stmt)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return {
+        "purchase_id": purchase_id,
+        "customer_internal_id": str(customer_internal_id),
+        "purchase_date": purchase_date,
+        "total": total,
+        "items": result_lines,
+    }
+
+def _item_changes_query(since):
+    query = select(Items.item_id, Items.item_name, Items.price, Items.updated_at)
+    if since is not None:
+        query = query.where(Items.updated_at >= since) # ix_items_updated_at の範囲検索
+    return query
+
+def myselect_item_changes(since=None):
+    """商品カタログの更新用: (items の件数, updated_at が since 以降の行のタプルのリスト)。since=None なら全件"""
+    with Session(engine) as session:
+        count = session.scalar(select(func.count()).select_from(Items))
+        return count, [tuple(row) for row in session.execute(_item_changes_query(since))]
+
+def myselect_daily_sales(start=None, end=None) -> list[dict]:
+    with Session(engine) as session:
+        return [row._asdict() for row in session.execute(rollups.daily_sales_query(start, end))]
+
+def myselect_item_sales(start=None, end=None, limit: int = 100) -> list[dict]:
+    with Session(engine) as session:
+        return [row._asdict() for row in session.execute(rollups.item_sales_query(start, end, limit))]
+
+def myselect_customer_sales(limit: int = 100) -> list[dict]:
+    with Session(engine) as session:
+        return [row._asdict() for row in session.execute(rollups.customer_sales_query(limit))]
+
+def _purchase_history_cursor(after):
+    # カーソルは [purchase_date の ISO 文字列, purchase_id] (不正なら ValueError)
+    if len(after) != 2 or not isinstance(after[0], str) or not isinstance(after[1], int) or isinstance(after[1], bool):
+        raise ValueError("Invalid cursor for purchase history")
+    return [datetime.fromisoformat(after[0]), after[1]]
+
+def _purchase_history_query(customer_internal_id: UUID, start=None, end=None, after=None, limit: int | None = None):
+    # 新しい順。ix_purchases_customer_date を逆順に読むのでソート不要
+    sort_columns = [Purchases.purchase_date, Purchases.purchase_id]
+    query = (
+        select(Purchases)
+        .where(Purchases.customer_internal_id == customer_internal_id)
+        # 明細と商品は 1 ページ分の purchase_id の IN 検索 1 回でまとめて読む (ページの件数によらずクエリ数は一定)
+        .options(selectinload(Purchases.details).joinedload(PurchaseDetails.item, innerjoin=True))
+    )
+    if start is not None:
+        query = query.where(Purchases.purchase_date >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        query = query.where(Purchases.purchase_date < datetime.combine(end + timedelta(days=1), datetime.min.time())) # end の日を含む
+    if after is not None:
+        query = query.where(_keyset_clause(sort_columns, _purchase_history_cursor(after), descending=True))
+    query = query.order_by(*(column.desc() for column in sort_columns))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def _customer_exists_query(customer_internal_id: UUID):
+    return select(Customers.internal_id).where(Customers.internal_id == customer_internal_id)
+
+def _purchase_to_dict(purchase) -> dict:
+    # 価格は明細に保存した購入時の単価 (商品の現在の価格が変わっても過去の購入の金額は変わらない)。商品名は現在の名前
+    # 明細の並べ替えは SQL の ORDER BY にすると IN 検索の結果の一時ソートになるので、ここで行う (1 購入あたり数行)
+    lines = [
+        {
+            "item_id": detail.item_id,
+            "item_name": detail.item.item_name,
+            "price": detail.unit_price,
+            "quantity": detail.quantity,
+            "subtotal": detail.unit_price * detail.quantity,
+        }
+        for detail in sorted(purchase.details, key=lambda detail: detail.item_id)
+    ]
+    return {
+        "purchase_id": purchase.purchase_id,
+        "customer_internal_id": str(purchase.customer_internal_id),
+        "purchase_date": purchase.purchase_date,
+        "total": sum(line["subtotal"] for line in lines),
+        "items": lines,
+    }
+
+def _purchase_history_next_after(purchases, limit: int):
+    if len(purchases) < limit:
+        return None
+    return [purchases[-1].purchase_date.isoformat(), purchases[-1].purchase_id]
+
+def myselect_purchase_history(customer_internal_id: UUID, start=None, end=None, limit: int = 20, after=None):
+    """
+    顧客の購入履歴を新しい順に 1 ページ分読み、(購入の dict のリスト, 次ページの after または None) を返す。
+    購入の SELECT 1 回 + 明細と商品の SELECT 1 回 (結果が空のときだけ顧客の存在確認が 1 回増える)。
+    存在しない顧客は CustomerNotFoundError、after が不正なら ValueError を送出する。
+    """
+    query = _purchase_history_query(customer_internal_id, start, end, after, limit)
+    with Session(engine) as session:
+        purchases = session.scalars(query).all()
+        if not purchases and session.scalar(_customer_exists_query(customer_internal_id)) is None:
+            raise CustomerNotFoundError(customer_internal_id)
+        return [_purchase_to_dict(purchase) for purchase in purchases], _purchase_history_next_after(purchases, limit)
+
 def myselect(mymodel, customer_id):
     # session構築
     Session = sessionmaker(bind=engine)
@@ -77,12 +405,29 @@ def myselect(mymodel, customer_id):
     session.close()
     return result_json
 
-def myselect_by_internal_id(mymodel, internal_id: UUID): # 引数を UUID 型に
+def myselect_dict_by_internal_id(mymodel, internal_id: UUID):
+    """
+    主キーで 1 件を dict (キャッシュと同じ形) で返す。
+    キャッシュヒット時は ORM オブジェクトを作らずにそのまま返す (app.py のレスポンス高速化用)
+    """
+    key = cache_key(mymodel, internal_id)
+    cached = customer_cache.get(key)
+    if cached is not None:
+        return cached
     with Session(engine) as session:
         # internal_id で検索
         result = session.get(mymodel, internal_id) #主キーでの検索は session.get が効率的
         # result = session.scalars(select(mymodel).filter_by(internal_id=internal_id)).first() # filter_by も使える
-        return result # ORMオブジェクトまたはNoneを返す
+        if result is None:
+            return None
+        value = to_cache_value(result)
+        customer_cache.set(key, value)
+        return value
+
+def myselect_by_internal_id(mymodel, internal_id: UUID): # 引数を UUID 型に
+    value = myselect_dict_by_internal_id(mymodel, internal_id)
+    # セッションに属さないORMオブジェクトとして復元する
+    return mymodel(**value) if value is not None else None
 
 # def myselectAll(mymodel):
 #     # session構築
@@ -92,7 +437,7 @@ def myselect_by_internal_id(mymodel, internal_id: UUID): # 引数を UUID 型に
 #     try:
 #         # トランザクションを開始
 #         with session.begin():
-#             df = pd.read_sql_query(query, con=engine)
+#             df = pd.read_sql_query(query, con=engine) # pandas は起動を遅くするので、使う場合は関数内でインポートする
 #             print(df)
 #             result_json = df.to_json(orient='records', force_ascii=False)
 
@@ -142,6 +487,212 @@ def myselectAll(mymodel):
     # session は with ブロックを抜ける際に自動的に close される
 
 
+def _customer_row_to_dict(row):
+    return {
+        "internal_id": str(row.internal_id), # UUID を文字列に変換
+        "customer_id": row.customer_id,
+        "customer_name": row.customer_name,
+        "age": row.age,
+        "gender": row.gender,
+    }
+
+def _customer_page_query(mymodel, after: UUID | None = None, limit: int | None = None):
+    # 必要なカラムだけを internal_id (主キー) 順に取得する
+    # after を指定すると internal_id > after の範囲だけを読む (キーセットページネーション)
+    # OFFSET と違い、読み飛ばす行のコストがかからない
+    query = select(
+        mymodel.internal_id,
+        mymodel.customer_id,
+        mymodel.customer_name,
+        mymodel.age,
+        mymodel.gender,
+    ).order_by(mymodel.internal_id)
+    if after is not None:
+        query = query.where(mymodel.internal_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def myselect_page(mymodel, limit: int, after: UUID | None = None):
+    """
+    internal_id をカーソルにして最大 limit 件を返す。
+    次ページは最後の行の internal_id を after に渡して取得する。
+    """
+    with Session(engine) as session:
+        try:
+            rows = session.execute(_customer_page_query(mymodel, after, limit)).all()
+            return [_customer_row_to_dict(row) for row in rows]
+        except Exception as e:
+            print(f"Error in myselect_page: {e}")
+            return []
+
+def _rows_query(mymodel, columns, after: UUID | None = None, limit: int | None = None):
+    # columns で指定したカラムだけを internal_id 順に取得する (after / limit は _customer_page_query と同じ)
+    query = select(*(getattr(mymodel, column) for column in columns)).order_by(mymodel.internal_id)
+    if after is not None:
+        query = query.where(mymodel.internal_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def myselect_rows(mymodel, columns, limit: int | None = None, after: UUID | None = None):
+    """
+    columns の値をタプルのリストで返す (ORM オブジェクトも dict も作らない)。
+    app.py で JSON に直接エンコードするための読み取り
+    """
+    with Session(engine) as session:
+        try:
+            return [tuple(row) for row in session.execute(_rows_query(mymodel, columns, after, limit))]
+        except Exception as e:
+            print(f"Error in myselect_rows: {e}")
+            return []
+
+def myselect_stream(mymodel, after: UUID | None = None, limit: int | None = None, chunk_size: int = 1000):
+    """
+    サーバーサイドカーソル (stream_results / yield_per) で chunk_size 件ずつ読みながら
+    dict のリストをチャンク単位で yield する。テーブル全体をメモリに載せないのでピークメモリは一定。
+    """
+    with Session(engine) as session:
+        result = session.execute(
+            _customer_page_query(mymodel, after, limit).execution_options(yield_per=chunk_size)
+        )
+        for partition in result.partitions():
+            yield [_customer_row_to_dict(row) for row in partition]
+
+
+# --- エクスポート (GET /export/{table} と exporter.py の CLI) ---
+# テーブル全体をサーバーサイドカーソルで chunk_size 件ずつ読み、タプルのリストをチャンク単位で yield する。
+# (コメントアウトした pd.read_sql_query 版と違い、テーブル全体を DataFrame に載せない)
+
+def _export_customers_query():
+    return select(*Customers.__table__.columns).order_by(Customers.internal_id)
+
+def _export_purchases_query():
+    # 購入明細 1 行 = 1 レコード (購入のヘッダを結合して平坦にする)
+    return (
+        select(
+            Purchases.purchase_id,
+            Purchases.customer_internal_id,
+            Purchases.purchase_date,
+            PurchaseDetails.item_id,
+            PurchaseDetails.quantity,
+        )
+        .join(PurchaseDetails, PurchaseDetails.purchase_id == Purchases.purchase_id)
+        .order_by(Purchases.purchase_id, PurchaseDetails.item_id)
+    )
+
+EXPORT_QUERIES = {
+    "customers": _export_customers_query,
+    "purchases": _export_purchases_query,
+}
+
+def export_columns(table: str) -> list[tuple]:
+    """エクスポートする (カラム名, SQLAlchemy の型) のリスト (myexport_stream のタプルと同じ順)"""
+    return [(column.key, column.type) for column in EXPORT_QUERIES[table]().selected_columns]
+
+def myexport_stream(table: str, chunk_size: int = 10000):
+    with Session(engine) as session:
+        result = session.execute(EXPORT_QUERIES[table]().execution_options(yield_per=chunk_size))
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+
+# --- 顧客検索 (GET /customers/search) ---
+# 並び順は使う索引に合わせて条件ごとに変える (mymodels_MySQL.Customers の索引を参照)
+#   customer_name (前方一致) あり : customer_name, internal_id
+#   age_min / age_max あり        : age, internal_id
+#   それ以外                      : internal_id
+# after には前ページ最後の行の並び順のカラムの値を渡す (キーセットページネーション)
+
+# ngram パーサーの最小トークン長 (MySQL の ngram_token_size の既定値)。これより短い語は全文検索では見つからない
+FULLTEXT_MIN_LENGTH = 2
+
+def _search_sort_columns(filters: dict) -> tuple:
+    if filters.get("customer_name"):
+        return ("customer_name", "internal_id")
+    if filters.get("age_min") is not None or filters.get("age_max") is not None:
+        return ("age", "internal_id")
+    return ("internal_id",)
+
+def _keyset_clause(columns, values, descending: bool = False):
+    # (c1, c2) > (v1, v2) を c1 >= v1 AND (c1 > v1 OR (c1 = v1 AND c2 > v2)) に展開する (descending なら < で同様)
+    # (行値の比較をサポートしない・索引を使わない DB でも範囲検索になるように)
+    alternatives = [
+        and_(*(column == value for column, value in zip(columns[:i], values[:i])),
+             columns[i] < values[i] if descending else columns[i] > values[i])
+        for i in range(len(columns))
+    ]
+    return and_(columns[0] <= values[0] if descending else columns[0] >= values[0], or_(*alternatives))
+
+def _name_prefix_clause(column, prefix: str, dialect_name: str):
+    if dialect_name == "mysql":
+        return column.startswith(prefix, autoescape=True) # LIKE 'prefix%' は索引の範囲検索になる
+    # SQLite の LIKE は大文字小文字を区別しないため索引を使わない。同じ意味の範囲条件にする
+    return and_(column >= prefix, column < prefix + "\U0010ffff")
+
+def _name_text_clause(column, text: str, dialect_name: str):
+    if dialect_name == "mysql" and len(text) >= FULLTEXT_MIN_LENGTH:
+        # ngram の全文検索。フレーズ検索にして、入力中の + - * などを演算子として解釈させない
+        return match(column, against='"' + text.replace('"', " ") + '"').in_boolean_mode()
+    return column.contains(text, autoescape=True) # 全文索引がない場合は部分一致 (全件走査)
+
+def _search_cursor_value(name: str, value):
+    # クライアントから戻ってきたカーソルの値を検証する (不正なら ValueError)
+    if name == "internal_id":
+        return UUID(str(value))
+    expected = int if name == "age" else str
+    if not isinstance(value, expected) or isinstance(value, bool):
+        raise ValueError(f"Invalid cursor value for {name}")
+    return value
+
+def _customer_search_query(mymodel, columns, dialect_name: str, filters: dict, after=None, limit: int | None = None):
+    sort_names = _search_sort_columns(filters)
+    sort_columns = [getattr(mymodel, name) for name in sort_names]
+    query = select(*(getattr(mymodel, column) for column in columns))
+    if filters.get("customer_id"):
+        query = query.where(mymodel.customer_id == filters["customer_id"])
+    if filters.get("customer_name"):
+        query = query.where(_name_prefix_clause(mymodel.customer_name, filters["customer_name"], dialect_name))
+    if filters.get("q"):
+        query = query.where(_name_text_clause(mymodel.customer_name, filters["q"], dialect_name))
+    if filters.get("age_min") is not None:
+        query = query.where(mymodel.age >= filters["age_min"])
+    if filters.get("age_max") is not None:
+        query = query.where(mymodel.age <= filters["age_max"])
+    if filters.get("gender"):
+        query = query.where(mymodel.gender == filters["gender"])
+    if after is not None:
+        if len(after) != len(sort_names):
+            raise ValueError("Cursor does not match the search conditions")
+        values = [_search_cursor_value(name, value) for name, value in zip(sort_names, after)]
+        query = query.where(_keyset_clause(sort_columns, values))
+    query = query.order_by(*sort_columns)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def _search_next_after(columns, filters: dict, rows, limit: int):
+    # 1 ページ分埋まっていれば、最後の行の並び順のカラムの値を次の after にする
+    if len(rows) < limit:
+        return None
+    return [rows[-1][columns.index(name)] for name in _search_sort_columns(filters)]
+
+def mysearch_customers(mymodel, columns, filters: dict, limit: int, after=None):
+    """
+    filters (customer_id / customer_name / q / age_min / age_max / gender) で顧客を検索し、
+    (columns の値のタプルのリスト, 次ページの after または None) を返す。
+    after が検索条件と合わない場合は ValueError。
+    """
+    query = _customer_search_query(mymodel, columns, engine.dialect.name, filters, after, limit)
+    with Session(engine) as session:
+        try:
+            rows = [tuple(row) for row in session.execute(query)]
+        except Exception as e:
+            print(f"Error in mysearch_customers: {e}")
+            return [], None
+    return rows, _search_next_after(columns, filters, rows, limit)
+
+
 def myupdate(mymodel, values):
     # session構築
     Session = sessionmaker(bind=engine)
@@ -159,6 +710,7 @@ def myupdate(mymodel, values):
         # トランザクションを開始
         with session.begin():
             result = session.execute(query)
+        _bump_table_version(mymodel)
     except sqlalchemy.exc.IntegrityError:
         print("一意制約違反により、挿入に失敗しました")
         session.rollback()
@@ -178,13 +730,115 @@ def myupdate_orm(mymodel, internal_id: UUID, values: dict):
             
             session.add(db_item) # 変更を追跡
             session.commit()
+            _bump_table_version(mymodel)
             session.refresh(db_item)
+            customer_cache.set(cache_key(mymodel, internal_id), to_cache_value(db_item))
             return db_item
         except Exception as e:
             print(f"Error in myupdate_orm: {e}")
             session.rollback()
             return None
 
+# --- 1 往復の書き込み (PATCH / PUT / DELETE) ---
+# 事前に行を読まずに UPDATE / DELETE を 1 文で発行し、影響行数で存在を判定する。
+# expected_versions (If-Match) を渡すと WHERE version IN (...) を付けて楽観的排他制御を行う。
+# 0 行だったときだけ、存在しないのか (404)、バージョンが違うのか (412) を主キーで確認する。
+
+def _row_cache_value(mymodel, row) -> dict:
+    # RETURNING / SELECT で読んだ行をキャッシュと同じ形の dict にする (cache.to_cache_value の Row 版)
+    mapping = row._mapping
+    return {
+        column.key: str(mapping[column.key]) if isinstance(mapping[column.key], UUID) else mapping[column.key]
+        for column in mymodel.__table__.columns
+    }
+
+def _patch_statement(mymodel, internal_id: UUID, values: dict, expected_versions):
+    statement = (
+        update(mymodel)
+        .where(mymodel.internal_id == internal_id)
+        .values(**values, version=mymodel.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_versions is not None:
+        statement = statement.where(mymodel.version.in_(expected_versions))
+    return statement
+
+def _delete_statement(mymodel, internal_id: UUID, expected_versions):
+    statement = delete(mymodel).where(mymodel.internal_id == internal_id).execution_options(synchronize_session=False)
+    if expected_versions is not None:
+        statement = statement.where(mymodel.version.in_(expected_versions))
+    return statement
+
+def _current_version_query(mymodel, internal_id: UUID):
+    return select(mymodel.version).where(mymodel.internal_id == internal_id)
+
+def _select_row_query(mymodel, internal_id: UUID):
+    return select(*mymodel.__table__.columns).where(mymodel.internal_id == internal_id)
+
+def _patch_returning(mymodel, returning: bool):
+    # returning=False でも RETURNING が使えれば更新後の version だけは読む (キャッシュの削除の印に使う)
+    return mymodel.__table__.columns if returning else [mymodel.version]
+
+def _patched_version(row, expected_versions):
+    """returning=False で更新したあとの version。RETURNING で読んだ値か、If-Match の version が 1 つならその +1 (分からなければ None)"""
+    if row is not None:
+        return row.version
+    if expected_versions is not None and len(expected_versions) == 1:
+        return expected_versions[0] + 1
+    return None
+
+def mypatch(mymodel, internal_id: UUID, values: dict, expected_versions: list[int] | None = None, returning: bool = True):
+    """
+    values のカラムだけを UPDATE し、version を +1 する。
+    戻り値: 更新後の行の dict (returning=False なら True)、行がなければ None、エラー時も None。
+    expected_versions と現在の version が一致しなければ VersionMismatchError、customer_id が他の行と重複すれば DuplicateCustomerIdError。
+    RETURNING に対応した DB (SQLite / PostgreSQL) では UPDATE 1 文、MySQL では同じトランザクションで主キー検索を 1 回追加する。
+    """
+    key = cache_key(mymodel, internal_id)
+    if not values:
+        # 変更なし。現在の行を返す (If-Match の検査だけ行う)
+        current = myselect_dict_by_internal_id(mymodel, internal_id)
+        if current is not None and expected_versions is not None and current["version"] not in expected_versions:
+            raise VersionMismatchError(current["version"])
+        return current if returning or current is None else True
+
+    statement = _patch_statement(mymodel, internal_id, values, expected_versions)
+    use_returning = engine.dialect.update_returning
+    if use_returning:
+        statement = statement.returning(*_patch_returning(mymodel, returning))
+    with Session(engine) as session:
+        try:
+            result = session.execute(statement)
+            row = result.first() if use_returning else None
+            updated = row is not None if use_returning else result.rowcount > 0
+            if not updated:
+                current_version = session.scalar(_current_version_query(mymodel, internal_id))
+                session.rollback()
+                if current_version is not None: # 行はあるがバージョンが違う
+                    raise VersionMismatchError(current_version)
+                return None
+            if returning and not use_returning:
+                row = session.execute(_select_row_query(mymodel, internal_id)).first()
+            session.commit()
+            _bump_table_version(mymodel)
+        except VersionMismatchError:
+            raise
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            raise DuplicateCustomerIdError(values.get("customer_id"))
+        except Exception as e:
+            print(f"Error in mypatch: {e}")
+            session.rollback()
+            return None
+    if not returning:
+        # 更新後の行を読んでいないので値を消し、次の読み取りで DB から埋め直す。
+        # 新しい version が分かれば、それより古い行での set だけを無視する (分からなければ TTL の間すべて無視する)
+        customer_cache.delete(key, _patched_version(row, expected_versions))
+        return True
+    value = _row_cache_value(mymodel, row)
+    customer_cache.set(key, value)
+    return value
+
 def mydelete(mymodel, customer_id):
     # session構築
     Session = sessionmaker(bind=engine)
@@ -194,6 +848,7 @@ def mydelete(mymodel, customer_id):
         # トランザクションを開始
         with session.begin():
             result = session.execute(query)
+        _bump_table_version(mymodel)
     except sqlalchemy.exc.IntegrityError:
         print("一意制約違反により、挿入に失敗しました")
         session.rollback()
@@ -202,16 +857,27 @@ def mydelete(mymodel, customer_id):
     session.close()
     return customer_id + " is deleted"
 
-def mydelete_orm(mymodel, internal_id: UUID) -> bool:
+def mydelete_orm(mymodel, internal_id: UUID, expected_versions: list[int] | None = None) -> bool:
+    # 行を読み込まずに DELETE 1 文で削除する (影響行数 0 なら見つからない)
     with Session(engine) as session:
         try:
-            db_item = session.get(mymodel, internal_id)
-            if not db_item:
+            result = session.execute(_delete_statement(mymodel, internal_id, expected_versions))
+            if result.rowcount == 0:
+                current_version = session.scalar(_current_version_query(mymodel, internal_id)) if expected_versions is not None else None
+                session.rollback()
+                if current_version is not None: # 行はあるがバージョンが違う
+                    raise VersionMismatchError(current_version)
                 return False # 見つからなければ False
-            
-            session.delete(db_item)
             session.commit()
+            _bump_table_version(mymodel)
+            customer_cache.delete(cache_key(mymodel, internal_id))
             return True # 成功すれば True
+        except VersionMismatchError:
+            raise
+        except sqlalchemy.exc.IntegrityError as e: # purchases から参照されている (見つからない扱いにはしない)
+            print(f"IntegrityError in mydelete_orm: {e}")
+            session.rollback()
+            raise CustomerHasPurchasesError(internal_id)
         except Exception as e:
             print(f"Error in mydelete_orm: {e}")
             session.rollback()
@@ -0,0 +1,322 @@
+# crud.py の *_orm 系関数の asyncio 版
+# DB_MODE=async のときに app.py から使われる。関数名・引数・戻り値は同期版と揃えている
+import sqlalchemy
+from sqlalchemy import func, insert, select
+from uuid import UUID
+from datetime import datetime
+
+from db_control.connect_MySQL_async import AsyncSessionLocal, async_engine
+from db_control import rollups
+from db_control.crud import (
+    _customer_page_query, _customer_row_to_dict, _rows_query,
+    _customer_search_query, _search_next_after,
+    _bulk_prepare, _bulk_exclude_existing, _bulk_created,
+    _merge_purchase_lines, _items_query, _check_items, _purchase_rows, _catalog_items, _item_changes_query,
+    _purchase_history_query, _customer_exists_query, _purchase_to_dict, _purchase_history_next_after,
+    _row_cache_value, _patch_statement, _patch_returning, _patched_version, _delete_statement,
+    _current_version_query, _select_row_query,
+    _table_version_bump, _table_version_query,
+    EXPORT_QUERIES, CustomerNotFoundError, VersionMismatchError, DuplicateCustomerIdError, CustomerHasPurchasesError,
+)
+from db_control.mymodels_MySQL import Items, Purchases, PurchaseDetails
+from db_control.cache import customer_cache, cache_key, to_cache_value
+from starlette.concurrency import run_in_threadpool
+
+
+async def _cache_call(method, *args):
+    # redis バックエンドは同期クライアントなので、スレッドプールで呼んでイベントループを止めない (local / none はそのまま)
+    if customer_cache.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+async def _bump_table_version(mymodel):
+    # コミット後に別の短いトランザクションで加算する (crud._bump_table_version と同じ)
+    try:
+        async with async_engine.begin() as connection:
+            await connection.execute(_table_version_bump(async_engine.dialect.name, mymodel))
+    except Exception as e:
+        print(f"Error in _bump_table_version (async): {e}")
+
+async def mytable_version(mymodel):
+    async with AsyncSessionLocal() as session:
+        try:
+            row = (await session.execute(_table_version_query(mymodel))).first()
+        except Exception as e:
+            print(f"Error in mytable_version (async): {e}")
+            return None
+    return (row.version, row.updated_at) if row else (0, None)
+
+async def myselect_version(mymodel, internal_id: UUID) -> int | None:
+    async with AsyncSessionLocal() as session:
+        try:
+            return await session.scalar(_current_version_query(mymodel, internal_id))
+        except Exception as e:
+            print(f"Error in myselect_version (async): {e}")
+            return None
+
+async def myinsert_orm(mymodel, values: dict):
+    async with AsyncSessionLocal() as session:
+        try:
+            db_item = mymodel(**values)
+            session.add(db_item)
+            await session.commit()
+            await _bump_table_version(mymodel)
+            await session.refresh(db_item) # DBから最新の状態（生成されたinternal_idなど）を読み込む
+            await _cache_call(customer_cache.set, cache_key(mymodel, db_item.internal_id), to_cache_value(db_item))
+            return db_item
+        except sqlalchemy.exc.IntegrityError as e:
+            print(f"IntegrityError during insert: {e}")
+            await session.rollback()
+            raise DuplicateCustomerIdError(values.get("customer_id"))
+        except Exception as e:
+            print(f"Error in myinsert_orm (async): {e}")
+            await session.rollback()
+            return None
+
+async def mybulkinsert_orm(mymodel, values_list: list[dict]) -> list[dict]:
+    results, candidates = _bulk_prepare(values_list)
+    rows = []
+    async with AsyncSessionLocal() as session:
+        try:
+            customer_ids = [row["customer_id"] for _, row in candidates]
+            existing_ids = set(await session.scalars(select(mymodel.customer_id).where(mymodel.customer_id.in_(customer_ids))))
+            rows = _bulk_exclude_existing(results, candidates, existing_ids)
+            if rows:
+                await session.execute(insert(mymodel), [row for _, row in rows])
+            await session.commit()
+            if rows:
+                await _bump_table_version(mymodel)
+            for i, row in rows:
+                results[i] = _bulk_created(row)
+        except sqlalchemy.exc.IntegrityError:
+            await session.rollback()
+            for i, row in rows:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(insert(mymodel), [row])
+                    results[i] = _bulk_created(row)
+                except sqlalchemy.exc.IntegrityError as e:
+                    results[i] = {"status": "error", "customer_id": row["customer_id"], "error": f"integrity error: {e.orig}"}
+            await session.commit()
+            if any(result is not None and result["status"] == "created" for result in results):
+                await _bump_table_version(mymodel)
+    return results
+
+async def myinsert_purchase(customer_internal_id: UUID, lines: list[dict], purchase_date: datetime | None = None, catalog_items=None) -> dict:
+    quantities = _merge_purchase_lines(lines)
+    purchase_date = purchase_date or datetime.now()
+    async with AsyncSessionLocal() as session:
+        try:
+            items = _catalog_items(quantities, catalog_items)
+            if items is None:
+                items = {item.item_id: item for item in await session.execute(_items_query(list(quantities)))}
+            _check_items(quantities, items)
+
+            purchase = Purchases(customer_internal_id=customer_internal_id, purchase_date=purchase_date)
+            session.add(purchase)
+            try:
+                await session.flush()
+            except sqlalchemy.exc.IntegrityError:
+                raise CustomerNotFoundError(customer_internal_id)
+
+            purchase_id = purchase.purchase_id # commit 後は属性が期限切れになるので控えておく
+            detail_rows, result_lines, total = _purchase_rows(quantities, items, purchase_id)
+            try:
+                await session.execute(insert(PurchaseDetails), detail_rows)
+            except sqlalchemy.exc.IntegrityError:
+                await session.rollback()
+                _check_items(quantities, {item.item_id: item for item in await session.execute(_items_query(list(quantities)))})
+                raise
+            for stmt in rollups.rollup_statements(async_engine.dialect.name, customer_internal_id, purchase_date, result_lines, total):
+                await session.execute(stmt)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+    return {
+        "purchase_id": purchase_id,
+        "customer_internal_id": str(customer_internal_id),
+        "purchase_date": purchase_date,
+        "total": total,
+        "items": result_lines,
+    }
+
+async def myselect_item_changes(since=None):
+    async with AsyncSessionLocal() as session:
+        count = await session.scalar(select(func.count()).select_from(Items))
+        return count, [tuple(row) for row in await session.execute(_item_changes_query(since))]
+
+async def myselect_purchase_history(customer_internal_id: UUID, start=None, end=None, limit: int = 20, after=None):
+    query = _purchase_history_query(customer_internal_id, start, end, after, limit)
+    async with AsyncSessionLocal() as session:
+        purchases = (await session.scalars(query)).all()
+        if not purchases and await session.scalar(_customer_exists_query(customer_internal_id)) is None:
+            raise CustomerNotFoundError(customer_internal_id)
+        return [_purchase_to_dict(purchase) for purchase in purchases], _purchase_history_next_after(purchases, limit)
+
+async def myselect_daily_sales(start=None, end=None) -> list[dict]:
+    async with AsyncSessionLocal() as session:
+        return [row._asdict() for row in await session.execute(rollups.daily_sales_query(start, end))]
+
+async def myselect_item_sales(start=None, end=None, limit: int = 100) -> list[dict]:
+    async with AsyncSessionLocal() as session:
+        return [row._asdict() for row in await session.execute(rollups.item_sales_query(start, end, limit))]
+
+async def myselect_customer_sales(limit: int = 100) -> list[dict]:
+    async with AsyncSessionLocal() as session:
+        return [row._asdict() for row in await session.execute(rollups.customer_sales_query(limit))]
+
+async def myselect_dict_by_internal_id(mymodel, internal_id: UUID):
+    key = cache_key(mymodel, internal_id)
+    cached = await _cache_call(customer_cache.get, key)
+    if cached is not None:
+        return cached
+    async with AsyncSessionLocal() as session:
+        result = await session.get(mymodel, internal_id)
+        if result is None:
+            return None
+        value = to_cache_value(result)
+        await _cache_call(customer_cache.set, key, value)
+        return value
+
+async def myselect_by_internal_id(mymodel, internal_id: UUID):
+    value = await myselect_dict_by_internal_id(mymodel, internal_id)
+    return mymodel(**value) if value is not None else None
+
+async def myselectAll(mymodel):
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(_customer_page_query(mymodel))).all()
+            return [_customer_row_to_dict(row) for row in rows]
+        except Exception as e:
+            print(f"Error in myselectAll (async): {e}")
+            return []
+
+async def myselect_page(mymodel, limit: int, after: UUID | None = None):
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = (await session.execute(_customer_page_query(mymodel, after, limit))).all()
+            return [_customer_row_to_dict(row) for row in rows]
+        except Exception as e:
+            print(f"Error in myselect_page (async): {e}")
+            return []
+
+async def myselect_rows(mymodel, columns, limit: int | None = None, after: UUID | None = None):
+    async with AsyncSessionLocal() as session:
+        try:
+            return [tuple(row) for row in await session.execute(_rows_query(mymodel, columns, after, limit))]
+        except Exception as e:
+            print(f"Error in myselect_rows (async): {e}")
+            return []
+
+async def myselect_stream(mymodel, after: UUID | None = None, limit: int | None = None, chunk_size: int = 1000):
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(
+            _customer_page_query(mymodel, after, limit).execution_options(yield_per=chunk_size)
+        )
+        async for partition in result.partitions():
+            yield [_customer_row_to_dict(row) for row in partition]
+
+async def myexport_stream(table: str, chunk_size: int = 10000):
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(EXPORT_QUERIES[table]().execution_options(yield_per=chunk_size))
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+async def mysearch_customers(mymodel, columns, filters: dict, limit: int, after=None):
+    query = _customer_search_query(mymodel, columns, async_engine.dialect.name, filters, after, limit)
+    async with AsyncSessionLocal() as session:
+        try:
+            rows = [tuple(row) for row in await session.execute(query)]
+        except Exception as e:
+            print(f"Error in mysearch_customers (async): {e}")
+            return [], None
+    return rows, _search_next_after(columns, filters, rows, limit)
+
+async def myupdate_orm(mymodel, internal_id: UUID, values: dict):
+    async with AsyncSessionLocal() as session:
+        try:
+            db_item = await session.get(mymodel, internal_id)
+            if not db_item:
+                return None
+
+            for key, value in values.items():
+                setattr(db_item, key, value)
+
+            await session.commit()
+            await _bump_table_version(mymodel)
+            await session.refresh(db_item)
+            await _cache_call(customer_cache.set, cache_key(mymodel, internal_id), to_cache_value(db_item))
+            return db_item
+        except Exception as e:
+            print(f"Error in myupdate_orm (async): {e}")
+            await session.rollback()
+            return None
+
+async def mypatch(mymodel, internal_id: UUID, values: dict, expected_versions: list[int] | None = None, returning: bool = True):
+    key = cache_key(mymodel, internal_id)
+    if not values:
+        current = await myselect_dict_by_internal_id(mymodel, internal_id)
+        if current is not None and expected_versions is not None and current["version"] not in expected_versions:
+            raise VersionMismatchError(current["version"])
+        return current if returning or current is None else True
+
+    statement = _patch_statement(mymodel, internal_id, values, expected_versions)
+    use_returning = async_engine.dialect.update_returning
+    if use_returning:
+        statement = statement.returning(*_patch_returning(mymodel, returning))
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(statement)
+            row = result.first() if use_returning else None
+            updated = row is not None if use_returning else result.rowcount > 0
+            if not updated:
+                current_version = await session.scalar(_current_version_query(mymodel, internal_id))
+                await session.rollback()
+                if current_version is not None:
+                    raise VersionMismatchError(current_version)
+                return None
+            if returning and not use_returning:
+                row = (await session.execute(_select_row_query(mymodel, internal_id))).first()
+            await session.commit()
+            await _bump_table_version(mymodel)
+        except VersionMismatchError:
+            raise
+        except sqlalchemy.exc.IntegrityError:
+            await session.rollback()
+            raise DuplicateCustomerIdError(values.get("customer_id"))
+        except Exception as e:
+            print(f"Error in mypatch (async): {e}")
+            await session.rollback()
+            return None
+    if not returning:
+        await _cache_call(customer_cache.delete, key, _patched_version(row, expected_versions))
+        return True
+    value = _row_cache_value(mymodel, row)
+    await _cache_call(customer_cache.set, key, value)
+    return value
+
+async def mydelete_orm(mymodel, internal_id: UUID, expected_versions: list[int] | None = None) -> bool:
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(_delete_statement(mymodel, internal_id, expected_versions))
+            if result.rowcount == 0:
+                current_version = await session.scalar(_current_version_query(mymodel, internal_id)) if expected_versions is not None else None
+                await session.rollback()
+                if current_version is not None:
+                    raise VersionMismatchError(current_version)
+                return False
+            await session.commit()
+            await _bump_table_version(mymodel)
+            await _cache_call(customer_cache.delete, cache_key(mymodel, internal_id))
+            return True
+        except VersionMismatchError:
+            raise
+        except sqlalchemy.exc.IntegrityError as e:
+            print(f"IntegrityError in mydelete_orm (async): {e}")
+            await session.rollback()
+            raise CustomerHasPurchasesError(internal_id)
+        except Exception as e:
+            print(f"Error in mydelete_orm (async): {e}")
+            await session.rollback()
+            return False
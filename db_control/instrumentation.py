@@ -0,0 +1,275 @@
+# SQL の計測とメトリクス (Prometheus のテキスト形式で /metrics から公開する)
+#
+# - instrument_engine: エンジンのイベントで SQL ごとの実行時間・件数を記録する
+# - timed_pool_class: コネクションプールの取得待ち時間を記録するプールのクラス (pool_settings.pool_options がエンジンの作成時に渡す)
+# - RequestStats: リクエスト単位の集計 (クエリ数・DB時間・一番遅かった SQL の時間・プール待ち時間)。
+#   middleware.MetricsMiddleware がリクエストごとに用意し、contextvars 経由でスレッドプール内の crud からも参照される
+# - SQL のログは echo=True の全件出力をやめて、サンプリング + スロークエリのみにする
+#     SQL_ECHO=true           : SQLAlchemy の echo (全件ログ) を有効にする (デバッグ用)
+#     SQL_LOG_SAMPLE_RATE=0.01: 実行された SQL の 1% をログに出す (既定 0 = 出さない)
+#     SQL_SLOW_QUERY_MS=200   : この時間を超えた SQL は必ずログに出す
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy import exc as sa_exc
+
+SQL_ECHO = os.getenv('SQL_ECHO', 'false').lower() == 'true'
+SQL_LOG_SAMPLE_RATE = float(os.getenv('SQL_LOG_SAMPLE_RATE', '0'))
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '200'))
+
+logger = logging.getLogger("db_control.sql")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# --- メトリクスの入れ物 ---
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class Histogram:
+    """ラベルごとの累積バケット・合計・件数を持つヒストグラム (スレッドセーフ)"""
+
+    def __init__(self, name: str, documentation: str, buckets, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {} # ラベル値のタプル -> [バケットごとの件数, 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(series[0]), series[1], series[2]) for labels, series in self._series.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in sorted(self.snapshot().items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, ('le', bound))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.label_names:
+            values = [((), 0)]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in values]
+        return lines
+
+class GaugeCallback:
+    """描画のたびに関数を呼んで値を読むゲージ。関数は数値か {ラベル値のタプル: 数値} を返す"""
+
+    def __init__(self, name: str, documentation: str, func, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.label_names = tuple(label_names)
+
+    def render(self) -> list[str]:
+        value = self.func()
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_format_labels(self.label_names, labels)} {v}" for labels, v in values]
+        return lines
+
+_registry = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- DB のメトリクス ---
+
+db_statement_seconds = register(Histogram(
+    "db_statement_duration_seconds", "Duration of individual SQL statements", STATEMENT_BUCKETS))
+db_pool_wait_seconds = register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool", STATEMENT_BUCKETS))
+db_slow_statements = register(Counter(
+    "db_slow_statements_total", "SQL statements slower than SQL_SLOW_QUERY_MS"))
+
+
+class RequestStats:
+    """1 リクエストで実行された SQL の集計"""
+    __slots__ = ("query_count", "db_time", "slowest_time", "pool_wait")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0 # SQL の本文はスロークエリのログで確認する
+        self.pool_wait = 0.0
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+def start_request_stats() -> tuple[RequestStats, object]:
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+def end_request_stats(token):
+    _request_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 開始時刻は実行コンテキストに持たせる (conn.info のスタックだと、失敗した SQL では after が呼ばれず積み残る)
+    if context is not None:
+        context._query_start_time = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_start_time", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    db_statement_seconds.observe(elapsed)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.db_time += elapsed
+        stats.slowest_time = max(stats.slowest_time, elapsed)
+
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms >= SQL_SLOW_QUERY_MS:
+        db_slow_statements.inc()
+        logger.warning("slow query %.1fms: %s", elapsed_ms, " ".join(statement.split())[:1000])
+    elif SQL_LOG_SAMPLE_RATE > 0 and random.random() < SQL_LOG_SAMPLE_RATE:
+        logger.info("sampled query %.1fms: %s", elapsed_ms, " ".join(statement.split())[:1000])
+
+def _record_pool_wait(elapsed: float):
+    db_pool_wait_seconds.observe(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.pool_wait += elapsed
+
+class _PoolWaiters:
+    """接続が空くのを今待っている数と、待ち時間の最大値・タイムアウト数 (プロセス全体)"""
+
+    def __init__(self):
+        self.waiting = 0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.waiting += 1
+
+    def leave(self, elapsed: float, timed_out: bool):
+        with self._lock:
+            self.waiting -= 1
+            self.max_wait = max(self.max_wait, elapsed)
+            self.timeouts += timed_out
+
+_pool_waiters = _PoolWaiters()
+
+
+_timed_pool_classes = {}
+
+def timed_pool_class(pool_class):
+    """
+    プールから接続を取り出すまでの待ち時間を測るサブクラス。create_engine の poolclass に渡す
+    (プールのイベントは取り出した後の checkout しかなく、待ち始めを捕まえられないため _do_get を包む。
+    engine.dispose() で作り直されるプールも同じクラスで作られるので計測が引き継がれる)
+    """
+    if pool_class not in _timed_pool_classes:
+        def _do_get(self):
+            started = time.perf_counter()
+            timed_out = False
+            _pool_waiters.enter()
+            try:
+                return pool_class._do_get(self)
+            except sa_exc.TimeoutError:
+                timed_out = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                _pool_waiters.leave(elapsed, timed_out)
+                _record_pool_wait(elapsed)
+        _timed_pool_classes[pool_class] = type(
+            f"Timed{pool_class.__name__}", (pool_class,), {"_do_get": _do_get, "base_pool_class": pool_class})
+    return _timed_pool_classes[pool_class]
+
+def instrument_engine(sync_engine):
+    """同期エンジン (非同期エンジンは async_engine.sync_engine) に計測用のイベントを登録する"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+def pool_stats(pool) -> dict:
+    """
+    プールの現在の状態 (/pool/stats と /metrics で公開)。
+    checked_out / overflow などは QueuePool 系だけが持つ (NullPool などでは None)
+    """
+    def _call(name):
+        method = getattr(pool, name, None)
+        return method() if callable(method) else None
+
+    _, wait_total, wait_count = db_pool_wait_seconds.snapshot().get((), ([], 0.0, 0))
+    return {
+        "pool_class": getattr(pool, "base_pool_class", type(pool)).__name__,
+        "size": _call("size"),
+        "checked_in": _call("checkedin"),
+        "checked_out": _call("checkedout"),
+        "overflow": _call("overflow"),
+        "max_overflow": getattr(pool, "_max_overflow", None),
+        "timeout_seconds": _call("timeout"),
+        "waiting": _pool_waiters.waiting,
+        "checkouts": wait_count,
+        "wait_seconds_total": round(wait_total, 6),
+        "wait_seconds_mean": round(wait_total / wait_count, 6) if wait_count else 0.0,
+        "wait_seconds_max": round(_pool_waiters.max_wait, 6),
+        "timeouts": _pool_waiters.timeouts,
+    }
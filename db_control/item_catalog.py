@@ -0,0 +1,161 @@
+# 商品カタログ (items) のプロセス内スナップショット
+# GET /items・GET /items/{item_id} と購入登録の価格計算 (crud.myinsert_purchase) がここから読む
+#
+# - 起動時 (app.py の lifespan) に全件を読み込み、以降は ITEM_CATALOG_REFRESH_SECONDS ごとに差分だけを読み直す
+# - 差分は items.updated_at を目印 (ウォーターマーク) にして、前回の最大値以降の行を読む。
+#   遅れてコミットされた行を取りこぼさないよう ITEM_CATALOG_OVERLAP_SECONDS だけ遡って読む (同じ行を読み直しても無害)
+# - 件数が合わなければ (商品の削除など) 全件を読み直す。削除と追加が同じ間隔で起きると件数では気づけないので、
+#   ITEM_CATALOG_FULL_REFRESH_SECONDS ごとに必ず全件を読み直す。購入登録でカタログにあるのに DB にない商品が
+#   見つかったときは request_full_refresh で次回を全件にする (app.py がすぐに refresh する)
+# - スナップショットは作ったあと変更しない。更新時は新しいスナップショットを作って参照ごと入れ替えるので、
+#   読み取り側はロックなしで一貫した内容を読める (1 リクエストの中では snapshot を一度だけ取り出して使う)
+# ワーカーごとに独立しているので、他ワーカーでの商品の変更は次の差分更新まで反映されない。
+#
+# 設定 (環境変数)
+#   ITEM_CATALOG_REFRESH_SECONDS = 差分更新の間隔秒 (既定 30、0 で定期更新なし)
+#   ITEM_CATALOG_OVERLAP_SECONDS = 差分を読むときに遡る秒数 (既定 60)
+#   ITEM_CATALOG_FULL_REFRESH_SECONDS = 全件を読み直す間隔秒 (既定 300。削除された商品がカタログに残る最大時間)
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from types import MappingProxyType
+
+from db_control.instrumentation import Counter, GaugeCallback, register
+
+logger = logging.getLogger("db_control.item_catalog")
+
+item_catalog_refreshes_total = register(Counter(
+    "item_catalog_refreshes_total", "Item catalog refreshes by kind (incremental, full, error)", ("kind",)))
+
+
+class CatalogItem:
+    """スナップショットの 1 商品 (crud._purchase_rows が item_name / price を読む)"""
+    __slots__ = ("item_id", "item_name", "price")
+
+    def __init__(self, item_id: str, item_name: str, price: int):
+        self.item_id = item_id
+        self.item_name = item_name
+        self.price = price
+
+    def as_dict(self) -> dict:
+        return {"item_id": self.item_id, "item_name": self.item_name, "price": self.price}
+
+
+class CatalogSnapshot:
+    __slots__ = ("items", "item_ids", "watermark", "version", "loaded_at")
+
+    def __init__(self, items: dict, watermark, version: int):
+        self.items = MappingProxyType(items) # item_id -> CatalogItem (読み取り専用)
+        self.item_ids = tuple(sorted(items)) # 一覧の並び順
+        self.watermark = watermark # 読み込んだ行の updated_at の最大値
+        self.version = version # 内容が変わるたびに +1 (GET /items の ETag)
+        self.loaded_at = time.time()
+
+
+class ItemCatalog:
+    def __init__(self, overlap_seconds: float = 60.0, full_refresh_seconds: float = 300.0):
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.full_refresh_seconds = full_refresh_seconds
+        self.snapshot = CatalogSnapshot({}, None, 0)
+        self.refreshed_at = None # 最後に refresh が成功した時刻
+        self.full_refreshed_at = None # 最後に全件を読み直した時刻 (None なら次回は全件)
+        self._refreshing = False
+
+    def get(self, item_id: str) -> CatalogItem | None:
+        return self.snapshot.items.get(item_id)
+
+    def since(self):
+        """差分として読む updated_at の下限 (None なら全件)"""
+        watermark = self.snapshot.watermark
+        if watermark is None or self.full_refreshed_at is None:
+            return None
+        if time.time() - self.full_refreshed_at >= self.full_refresh_seconds:
+            return None
+        return watermark - self.overlap
+
+    def request_full_refresh(self):
+        """次の refresh で全件を読み直す (削除された商品がスナップショットに残っていると分かったとき)"""
+        self.full_refreshed_at = None
+
+    def apply(self, count: int, rows, full: bool) -> bool:
+        """
+        rows ((item_id, item_name, price, updated_at) のタプル) を反映したスナップショットに入れ替える。
+        差分を反映しても件数が count と合わなければ入れ替えずに False (全件の読み直しが必要)
+        """
+        old = self.snapshot
+        items = {} if full else dict(old.items)
+        changed = full
+        watermark = None if full else old.watermark
+        for item_id, item_name, price, updated_at in rows:
+            current = items.get(item_id)
+            if current is None or current.item_name != item_name or current.price != price:
+                items[item_id] = CatalogItem(item_id, item_name, price)
+                changed = True
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+        if len(items) != count:
+            return False
+        if changed or watermark != old.watermark:
+            self.snapshot = CatalogSnapshot(items, watermark, old.version + 1 if changed else old.version)
+        return True
+
+    async def refresh(self, load) -> str:
+        """
+        load(since) は (items の件数, since 以降に更新された行) を返すコルーチン関数 (app.py が crud を渡す)。
+        差分で済めば "incremental"、全件を読み直したら "full"、他の refresh の実行中なら "skipped" を返す
+        """
+        if self._refreshing:
+            return "skipped"
+        self._refreshing = True
+        try:
+            since = self.since()
+            count, rows = await load(since)
+            if self.apply(count, rows, full=since is None):
+                kind = "full" if since is None else "incremental"
+            else:
+                count, rows = await load(None)
+                self.apply(count, rows, full=True)
+                kind = "full"
+        finally:
+            self._refreshing = False
+        self.refreshed_at = time.time()
+        if kind == "full":
+            self.full_refreshed_at = self.refreshed_at
+        item_catalog_refreshes_total.inc(kind)
+        return kind
+
+    async def run_refresher(self, load, interval: float):
+        """interval 秒ごとに refresh する (lifespan でタスクとして起動し、終了時にキャンセルする)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(load)
+            except Exception as e:
+                item_catalog_refreshes_total.inc("error")
+                logger.warning("item catalog refresh failed: %s", e) # 古いスナップショットのまま次回に再試行する
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "items": len(snapshot.items),
+            "version": snapshot.version,
+            "watermark": snapshot.watermark.isoformat() if snapshot.watermark else None,
+            "snapshot_age_seconds": round(time.time() - snapshot.loaded_at, 3),
+            "refresh_age_seconds": round(time.time() - self.refreshed_at, 3) if self.refreshed_at else None,
+        }
+
+
+ITEM_CATALOG_REFRESH_SECONDS = float(os.getenv('ITEM_CATALOG_REFRESH_SECONDS', '30'))
+
+# プロセス全体で共有するカタログ
+item_catalog = ItemCatalog(
+    overlap_seconds=float(os.getenv('ITEM_CATALOG_OVERLAP_SECONDS', '60')),
+    full_refresh_seconds=float(os.getenv('ITEM_CATALOG_FULL_REFRESH_SECONDS', '300')),
+)
+
+register(GaugeCallback("item_catalog_items", "Items in the catalog snapshot", lambda: len(item_catalog.snapshot.items)))
+register(GaugeCallback(
+    "item_catalog_refresh_age_seconds", "Seconds since the last successful catalog refresh",
+    lambda: item_catalog.stats()["refresh_age_seconds"] or 0))
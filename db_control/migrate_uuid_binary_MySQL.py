@@ -0,0 +1,297 @@
+# internal_id を CHAR(36) から BINARY(16) に移行するスクリプト (MySQL 専用)
+#
+# 対象: customers.internal_id (主キー) と、それを参照する purchases.customer_internal_id / customer_sales.customer_internal_id
+#
+# 手順 (サービスを止めずに進められるよう段階に分けている)
+#   1. prepare  : BINARY(16) の新しい列 (*_bin) を追加し、INSERT/UPDATE 時に新しい列も埋めるトリガーを作る
+#   2. backfill : 既存行の新しい列を主キー範囲ごとに batch_size 件ずつ埋める (1 バッチ 1 トランザクション)
+#   3. cutover  : トリガーを削除し、古い列を落として新しい列に差し替え、主キー・索引・外部キーを張り直す
+#                 DDL の前に変換漏れの行がないかを確認し、あればトリガーを戻して何も変えずに中止する。
+#                 DDL の途中で失敗した場合は戻せる外部キーを戻して止まる。再実行すると差し替え済みの表を飛ばして続きから行う
+#                 (benchmarks/check_query_plans.py を MySQL に向けて実行すると、索引の列構成が定義どおりかも確認できる)
+#                 テーブルの再構築が走るので、書き込みを止められる時間帯に実行する
+#                 (取りこぼしがあれば NOT NULL への変更が失敗して中断されるので、不整合なまま切り替わることはない)
+#   cutover 後は UUID_STORAGE=binary でアプリを起動する。
+#
+#   benchmark : インデックスサイズと主キー検索のレイテンシを計測する。移行の前後で実行して比較する
+#
+# 実行例:
+#   python -m db_control.migrate_uuid_binary_MySQL prepare
+#   python -m db_control.migrate_uuid_binary_MySQL backfill --batch-size 5000
+#   python -m db_control.migrate_uuid_binary_MySQL benchmark
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import text, inspect
+
+from db_control.connect_MySQL import engine
+
+# (テーブル, UUID列, バックフィルの範囲分割に使う主キー列)
+UUID_COLUMNS = [
+    ("customers", "internal_id", "internal_id"),
+    ("purchases", "customer_internal_id", "purchase_id"),
+    ("customer_sales", "customer_internal_id", "customer_internal_id"),
+]
+
+def _to_binary_sql(expr: str) -> str:
+    return f"UNHEX(REPLACE({expr}, '-', ''))"
+
+def _existing_tables(current_engine):
+    names = set(inspect(current_engine).get_table_names())
+    return [entry for entry in UUID_COLUMNS if entry[0] in names]
+
+def _execute(connection, sql: str, params=None):
+    print(f"  {sql}")
+    return connection.execute(text(sql), params or {})
+
+
+def prepare(current_engine):
+    print("Adding BINARY(16) columns and sync triggers...")
+    with current_engine.begin() as connection:
+        tables = _existing_tables(current_engine)
+        for table, column, _ in tables:
+            _execute(connection, f"ALTER TABLE {table} ADD COLUMN {column}_bin BINARY(16) NULL")
+        _create_triggers(connection, tables)
+
+
+def backfill(current_engine, batch_size: int = 5000):
+    """主キーの範囲ごとに新しい列を埋める (WHERE ... IS NULL の全表走査を繰り返さない)"""
+    for table, column, key in _existing_tables(current_engine):
+        print(f"Backfilling {table}.{column}_bin ...")
+        total = 0
+        last = None
+        started = time.perf_counter()
+        while True:
+            with current_engine.begin() as connection:
+                where = f"WHERE {key} > :last" if last is not None else ""
+                # このバッチの上端 (batch_size 件目の主キー) を求める
+                upper = connection.execute(
+                    text(f"SELECT {key} FROM {table} {where} ORDER BY {key} LIMIT 1 OFFSET :offset"),
+                    {"last": last, "offset": batch_size - 1},
+                ).scalar()
+                range_sql = f"{key} <= :upper" if upper is not None else "1 = 1"
+                if last is not None:
+                    range_sql += f" AND {key} > :last"
+                result = connection.execute(
+                    text(f"UPDATE {table} SET {column}_bin = {_to_binary_sql(column)} WHERE {range_sql}"),
+                    {"last": last, "upper": upper},
+                )
+                total += result.rowcount
+            if upper is None:
+                break
+            last = upper
+            print(f"  {total} rows ({total / (time.perf_counter() - started):.0f} rows/s)")
+        print(f"  done: {total} rows")
+
+
+def _foreign_keys_to_customers(connection):
+    rows = connection.execute(text(
+        "SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME = 'customers' "
+        "AND REFERENCED_COLUMN_NAME = 'internal_id'"
+    ))
+    return list(rows)
+
+def _has_column(connection, table: str, column: str) -> bool:
+    return connection.execute(text(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column"
+    ), {"table": table, "column": column}).scalar() > 0
+
+def _indexes_with_column(connection, table: str, column: str) -> list[tuple[str, str]]:
+    """
+    column を含むセカンダリ索引の (索引名, ADD INDEX 句) のリスト。
+    MySQL は列を DROP すると複合索引からその列だけを黙って外すので、差し替えと同じ ALTER で作り直す
+    """
+    rows = connection.execute(text(
+        "SELECT INDEX_NAME, NON_UNIQUE, INDEX_TYPE, COLUMN_NAME, SUB_PART FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME <> 'PRIMARY' "
+        "ORDER BY INDEX_NAME, SEQ_IN_INDEX"
+    ), {"table": table})
+    indexes = {}
+    for row in rows:
+        index = indexes.setdefault(row.INDEX_NAME, {"unique": not row.NON_UNIQUE, "type": row.INDEX_TYPE, "names": [], "parts": []})
+        index["names"].append(row.COLUMN_NAME)
+        index["parts"].append(row.COLUMN_NAME + (f"({row.SUB_PART})" if row.SUB_PART else ""))
+    clauses = []
+    for name, index in indexes.items():
+        if column not in index["names"]:
+            continue
+        kind = "FULLTEXT INDEX" if index["type"] == "FULLTEXT" else "UNIQUE INDEX" if index["unique"] else "INDEX"
+        clauses.append((name, f"ADD {kind} {name} ({', '.join(index['parts'])})"))
+    return clauses
+
+def _create_triggers(connection, tables):
+    for table, column, _ in tables:
+        for event in ("INSERT", "UPDATE"):
+            _execute(
+                connection,
+                f"CREATE TRIGGER {table}_{column}_bin_{event.lower()} BEFORE {event} ON {table} "
+                f"FOR EACH ROW SET NEW.{column}_bin = {_to_binary_sql(f'NEW.{column}')}",
+            )
+
+def _unconverted_rows(connection, tables) -> dict:
+    """新しい列が埋まっていない・古い列と一致しない行の数 (0 でなければ差し替えられない)"""
+    counts = {}
+    for table, column, _ in tables:
+        count = connection.execute(text(
+            f"SELECT COUNT(*) FROM {table} WHERE {column}_bin IS NULL OR {column}_bin <> {_to_binary_sql(column)}"
+        )).scalar()
+        if count:
+            counts[f"{table}.{column}"] = count
+    return counts
+
+def _swap_column(connection, table: str, column: str, key: str):
+    # 主キー・索引の張り直しまで 1 つの ALTER で行う (途中で失敗しても表が中途半端な状態にならない)
+    indexes = _indexes_with_column(connection, table, column)
+    primary_key = key == column
+    changes = [f"DROP INDEX {name}" for name, _ in indexes]
+    changes += ["DROP PRIMARY KEY"] if primary_key else []
+    changes += [
+        f"DROP COLUMN {column}",
+        f"CHANGE COLUMN {column}_bin {column} BINARY(16) NOT NULL" + (" FIRST" if table == "customers" else ""),
+    ]
+    changes += [f"ADD PRIMARY KEY ({column})"] if primary_key else []
+    changes += [clause for _, clause in indexes]
+    _execute(connection, f"ALTER TABLE {table} " + ", ".join(changes))
+
+def _restore_foreign_keys(connection, names: dict) -> list[str]:
+    """
+    customers.internal_id を参照する列のうち外部キーがないものに外部キーを張る。張れなかったものを返す
+    (names は元の制約名。前回の cutover が途中で止まって名前が分からないものは fk_<表>_<列> にする)
+    """
+    existing = {(row.TABLE_NAME, row.COLUMN_NAME) for row in _foreign_keys_to_customers(connection)}
+    tables = set(inspect(connection).get_table_names())
+    failed = []
+    for table, column, _ in UUID_COLUMNS:
+        if table == "customers" or table not in tables or (table, column) in existing:
+            continue
+        constraint = names.get((table, column), f"fk_{table}_{column}")
+        try:
+            _execute(connection,
+                f"ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) REFERENCES customers (internal_id)")
+        except Exception as e:
+            print(f"  failed: {e}")
+            failed.append(f"{table}.{column}")
+    return failed
+
+
+def cutover(current_engine):
+    with current_engine.connect() as connection:
+        # 前回の cutover が途中で止まった場合は、差し替え済み (*_bin 列がない) の表を飛ばして続きから行う
+        tables = [entry for entry in _existing_tables(current_engine) if _has_column(connection, entry[0], f"{entry[1]}_bin")]
+
+        # DDL は暗黙にコミットされるので、ステートメントごとに実行する
+        print("Dropping sync triggers and catching up remaining rows...")
+        for table, column, _ in tables:
+            for event in ("insert", "update"):
+                _execute(connection, f"DROP TRIGGER IF EXISTS {table}_{column}_bin_{event}")
+            _execute(connection, f"UPDATE {table} SET {column}_bin = {_to_binary_sql(column)} WHERE {column}_bin IS NULL")
+        connection.commit()
+
+        # 事前確認: 1 行でも変換できていなければ、DDL を始める前にトリガーを戻して中止する (prepare 後の状態に戻る)
+        unconverted = _unconverted_rows(connection, tables)
+        if unconverted:
+            _create_triggers(connection, tables)
+            connection.commit()
+            raise SystemExit(
+                f"Cutover aborted before any schema change: unconverted rows {unconverted}. "
+                "Sync triggers were restored; stop writes and rerun cutover."
+            )
+
+        names = {(row.TABLE_NAME, row.COLUMN_NAME): row.CONSTRAINT_NAME for row in _foreign_keys_to_customers(connection)}
+        _execute(connection, "SET FOREIGN_KEY_CHECKS = 0")
+        try:
+            print("Dropping foreign keys that reference customers.internal_id...")
+            for table, column in names:
+                _execute(connection, f"ALTER TABLE {table} DROP FOREIGN KEY {names[(table, column)]}")
+
+            print("Swapping columns and rebuilding their indexes...")
+            for table, column, key in sorted(tables, key=lambda entry: entry[0] != "customers"): # customers を最初に
+                _swap_column(connection, table, column, key)
+        except Exception:
+            # 型が揃っている組み合わせだけは外部キーを戻せる。戻せなかったものは再実行で張り直す
+            print("Cutover failed. Restoring foreign keys where possible...")
+            failed = _restore_foreign_keys(connection, names)
+            remaining = [f"{table}.{column}" for table, column, _ in tables if _has_column(connection, table, f"{column}_bin")]
+            print(f"Cutover stopped midway: columns not yet swapped {remaining}, foreign keys missing {failed}. "
+                  "Fix the cause (e.g. stop writes) and rerun cutover.")
+            raise
+        else:
+            print("Restoring foreign keys...")
+            failed = _restore_foreign_keys(connection, names)
+            if failed:
+                raise SystemExit(f"Foreign keys could not be restored: {failed}. Rerun cutover.")
+        finally:
+            _execute(connection, "SET FOREIGN_KEY_CHECKS = 1")
+    print("Cutover finished. Start the application with UUID_STORAGE=binary.")
+
+
+def benchmark(current_engine, lookups: int = 1000) -> dict:
+    """
+    customers / purchases のデータ・インデックスサイズと、internal_id による主キー検索・
+    外部キー経由の検索のレイテンシを計測する。列の型に依存しないよう、DB から読んだ値をそのままバインドする。
+    """
+    with current_engine.connect() as connection:
+        for table in ("customers", "purchases"):
+            connection.execute(text(f"ANALYZE TABLE {table}"))
+        column_type = connection.execute(text(
+            "SELECT COLUMN_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'customers' AND COLUMN_NAME = 'internal_id'"
+        )).scalar()
+        sizes = {
+            row.TABLE_NAME: {"rows": row.TABLE_ROWS, "data_bytes": row.DATA_LENGTH, "index_bytes": row.INDEX_LENGTH}
+            for row in connection.execute(text(
+                "SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('customers', 'purchases')"
+            ))
+        }
+        ids = connection.execute(text("SELECT internal_id FROM customers ORDER BY RAND() LIMIT :n"), {"n": lookups}).scalars().all()
+
+        def measure(sql):
+            timings = []
+            for internal_id in ids:
+                started = time.perf_counter()
+                connection.execute(text(sql), {"id": internal_id}).all()
+                timings.append((time.perf_counter() - started) * 1000)
+            if not timings:
+                return {}
+            timings.sort()
+            return {
+                "mean_ms": round(statistics.fmean(timings), 3),
+                "p50_ms": round(timings[len(timings) // 2], 3),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+            }
+
+        result = {
+            "internal_id_type": column_type,
+            "tables": sizes,
+            "lookups": len(ids),
+            "pk_lookup": measure("SELECT customer_id, customer_name FROM customers WHERE internal_id = :id"),
+            "fk_lookup": measure("SELECT purchase_id FROM purchases WHERE customer_internal_id = :id"),
+        }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate customers.internal_id from CHAR(36) to BINARY(16)")
+    parser.add_argument("phase", choices=["prepare", "backfill", "cutover", "all", "benchmark"])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    if engine.dialect.name != "mysql":
+        raise SystemExit("This migration only supports MySQL")
+    print(f"Using database engine for MySQL: {engine.url}")
+
+    if args.phase in ("prepare", "all"):
+        prepare(engine)
+    if args.phase in ("backfill", "all"):
+        backfill(engine, args.batch_size)
+    if args.phase in ("cutover", "all"):
+        cutover(engine)
+    if args.phase == "benchmark":
+        benchmark(engine, args.lookups)
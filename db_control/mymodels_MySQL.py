@@ -1,9 +1,10 @@
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Date, func # DateTime, Date, func をインポート
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import String, Integer, BigInteger, ForeignKey, DateTime, Date, Index, func # DateTime, Date, func をインポート
+from sqlalchemy import DDL, FetchedValue, event
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 import uuid
 from sqlalchemy.dialects.mysql import CHAR as MYSQL_CHAR, INTEGER # 必要であれば使う
-from sqlalchemy.types import UUID as SQLAlchemyUUID # MySQLネイティブUUIDサポートを期待
-from datetime import datetime # datetime をインポート
+from db_control.uuid_types import uuid_column_type, new_internal_id # CHAR(36) / BINARY(16) の切り替えと採番
+from datetime import datetime, date # datetime をインポート
 
 class Base(DeclarativeBase):
     pass
@@ -11,17 +12,35 @@ class Base(DeclarativeBase):
 class Customers(Base):
     __tablename__ = 'customers'
 
-    # MySQLはCHAR(36)やBINARY(16)でUUIDを扱えるので、標準のSQLAlchemyUUIDを使用
-    # (as_uuid=True) でPython側ではuuid.UUIDオブジェクトとして扱われる
+    # MySQL では CHAR(36) (既定) か BINARY(16) (UUID_STORAGE=binary) で保存する
+    # どちらでも Python 側では uuid.UUID オブジェクトとして扱われる
     internal_id: Mapped[uuid.UUID] = mapped_column(
-        SQLAlchemyUUID(as_uuid=True).with_variant(MYSQL_CHAR(36), "mysql"),
-        primary_key=True, default=uuid.uuid4
+        uuid_column_type(),
+        primary_key=True, default=new_internal_id
     )
     # customer_id は従来のIDとして、ユニークかつ非NULLを推奨
     customer_id: Mapped[str] = mapped_column(String(10), unique=True, nullable=False)
     customer_name: Mapped[str] = mapped_column(String(100), nullable=False) # 名前も非NULL推奨
     age: Mapped[int] = mapped_column(Integer, nullable=True) # 年齢はNULL許容の場合も
     gender: Mapped[str] = mapped_column(String(10), nullable=True) # 性別もNULL許容の場合も
+    # 楽観的排他制御用のバージョン。更新のたびに +1 され、レスポンスの ETag / リクエストの If-Match で使う
+    # (ORM 経由の更新は version_id_col で自動的に検査・加算される。crud.mypatch は UPDATE 文で直接加算する)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+
+    # GET /customers/search 用の索引。末尾の internal_id はキーセットページネーションの並び順 (索引順に読めばソート不要)
+    __table_args__ = (
+        Index("ix_customers_name", "customer_name", "internal_id"),             # 名前の前方一致
+        Index("ix_customers_age", "age", "internal_id"),                        # 年齢の範囲
+        Index("ix_customers_gender_age", "gender", "age", "internal_id"),       # 性別 + 年齢の範囲
+        # 名前の部分一致 (日本語の名前は空白で区切れないので ngram パーサーを使う)。MySQL のときだけ作る
+        Index("ix_customers_name_fulltext", "customer_name",
+              mysql_prefix="FULLTEXT", mysql_with_parser="ngram").ddl_if(dialect="mysql"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    # 購入履歴。一覧で使うときは crud._purchase_history_query のように selectinload でまとめて読む (N+1 を避ける)
+    # passive_deletes: 顧客の削除時に購入を読み込まず、外部キー制約に任せる
+    purchases: Mapped[list["Purchases"]] = relationship(back_populates="customer", passive_deletes=True)
 
     def __repr__(self):
         return (f"<Customer(internal_id='{self.internal_id}', "
@@ -33,20 +52,48 @@ class Items(Base):
     item_id: Mapped[str] = mapped_column(String(50), primary_key=True) # 文字長を適切に
     item_name: Mapped[str] = mapped_column(String(100), nullable=False, unique=True) # 商品名は非NULLかつユニーク推奨
     price: Mapped[int] = mapped_column(Integer, nullable=False) # 価格は非NULL推奨
+    # 商品カタログ (db_control/item_catalog.py) の差分更新の目印。
+    # 生の SQL での UPDATE でも現在時刻になるよう DB 側で更新する (下の ITEMS_UPDATED_AT_DDL。ORM は更新後の値を読み直す)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=func.now(), server_onupdate=FetchedValue())
+
+    __table_args__ = (Index("ix_items_updated_at", "updated_at"),)
+
+    purchase_details: Mapped[list["PurchaseDetails"]] = relationship(back_populates="item", passive_deletes=True)
 
     def __repr__(self):
         return f"<Item(item_id='{self.item_id}', name='{self.item_name}', price={self.price})>"
 
+# items.updated_at を UPDATE のたびに DB 側で現在時刻にする DDL (create_all と add_item_updated_at.py で同じものを使う)
+# MySQL はカラムの ON UPDATE CURRENT_TIMESTAMP、SQLite は ON UPDATE がないのでトリガーで更新する
+# (updated_at を明示的に変えた UPDATE はそのまま。再帰トリガーは既定で無効なのでトリガー内の UPDATE では発火しない)
+ITEMS_UPDATED_AT_DDL = {
+    "mysql": "ALTER TABLE items MODIFY updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP",
+    "sqlite": (
+        "CREATE TRIGGER IF NOT EXISTS items_updated_at AFTER UPDATE ON items "
+        "FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at "
+        "BEGIN UPDATE items SET updated_at = CURRENT_TIMESTAMP WHERE item_id = NEW.item_id; END"
+    ),
+}
+for _dialect, _statement in ITEMS_UPDATED_AT_DDL.items():
+    event.listen(Items.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+
 class Purchases(Base):
     __tablename__ = 'purchases'
     # purchase_id は自動インクリメントの整数主キーが良い場合が多い
     purchase_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     # 外部キーは customers テーブルの internal_id を参照するのが新しい設計では自然
     # ここでは元の customer_id を参照する形を残すが、internal_id 参照を検討
-    customer_internal_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("customers.internal_id"), nullable=False) # internal_id を参照
+    customer_internal_id: Mapped[uuid.UUID] = mapped_column(uuid_column_type(), ForeignKey("customers.internal_id"), nullable=False) # internal_id を参照 (型は参照先と揃える)
     # purchase_date は DateTime型を推奨
     purchase_date: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now()) # デフォルトで現在時刻
 
+    customer: Mapped["Customers"] = relationship(back_populates="purchases")
+    details: Mapped[list["PurchaseDetails"]] = relationship(back_populates="purchase", passive_deletes=True)
+
+    # 顧客ごとの購入履歴 (GET /customers/{internal_id}/purchases) を新しい順に索引順で読むための索引
+    __table_args__ = (Index("ix_purchases_customer_date", "customer_internal_id", "purchase_date", "purchase_id"),)
+
     def __repr__(self):
         return (f"<Purchase(purchase_id={self.purchase_id}, "
                 f"customer_internal_id='{self.customer_internal_id}', date='{self.purchase_date}')>")
@@ -58,7 +105,68 @@ class PurchaseDetails(Base):
     purchase_id: Mapped[int] = mapped_column(ForeignKey("purchases.purchase_id"), primary_key=True)
     item_id: Mapped[str] = mapped_column(ForeignKey("items.item_id"), primary_key=True)
     quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    # 購入時に請求した単価。商品の価格が後から変わっても購入履歴・売上集計の金額は変わらない
+    unit_price: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    purchase: Mapped["Purchases"] = relationship(back_populates="details")
+    item: Mapped["Items"] = relationship(back_populates="purchase_details")
 
     def __repr__(self):
         return (f"<PurchaseDetail(purchase_id={self.purchase_id}, "
-                f"item_id='{self.item_id}', quantity={self.quantity})>")
\ No newline at end of file
+                f"item_id='{self.item_id}', quantity={self.quantity}, unit_price={self.unit_price})>")
+
+# --- 集計 (ロールアップ) テーブル ---
+# 購入登録 (crud.myinsert_purchase) のたびに同じトランザクション内で加算更新される。
+# 全件から作り直す場合は db_control/rebuild_rollups.py を実行する。
+
+class DailySales(Base):
+    __tablename__ = 'daily_sales'
+    # 日別の売上合計
+    sales_date: Mapped[date] = mapped_column(Date, primary_key=True)
+    purchase_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    quantity: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    revenue: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0) # 購入時の単価 (purchase_details.unit_price) * quantity の合計
+
+    def __repr__(self):
+        return f"<DailySales(sales_date='{self.sales_date}', revenue={self.revenue})>"
+
+class DailyItemSales(Base):
+    __tablename__ = 'daily_item_sales'
+    # 日別・商品別の売上 (期間を指定した商品別売上はこのテーブルを期間で絞って合算する)
+    sales_date: Mapped[date] = mapped_column(Date, primary_key=True)
+    item_id: Mapped[str] = mapped_column(ForeignKey("items.item_id"), primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    revenue: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<DailyItemSales(sales_date='{self.sales_date}', "
+                f"item_id='{self.item_id}', revenue={self.revenue})>")
+
+class CustomerSales(Base):
+    __tablename__ = 'customer_sales'
+    # 顧客別の累計 (顧客生涯価値)
+    customer_internal_id: Mapped[uuid.UUID] = mapped_column(uuid_column_type(), ForeignKey("customers.internal_id"), primary_key=True)
+    purchase_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_revenue: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    first_purchase_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_purchase_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    # 売上上位の顧客を索引順に limit 件だけ読めるようにする
+    __table_args__ = (Index("ix_customer_sales_total_revenue", "total_revenue"),)
+
+    def __repr__(self):
+        return (f"<CustomerSales(customer_internal_id='{self.customer_internal_id}', "
+                f"total_revenue={self.total_revenue})>")
+
+# --- 変更の追跡 ---
+
+class TableVersions(Base):
+    __tablename__ = 'table_versions'
+    # テーブルごとの変更カウンタ。crud の書き込み関数がコミットの後に別の短いトランザクションで +1 する
+    # (一覧の条件付き GET の ETag / Last-Modified に使う。主キー検索 1 回で変更の有無が分かる)
+    table_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # UTC
+
+    def __repr__(self):
+        return f"<TableVersions(table_name='{self.table_name}', version={self.version})>"
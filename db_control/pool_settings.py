@@ -0,0 +1,72 @@
+# コネクションプールの設定 (環境変数)
+#
+# エンジンを作らずに読めるように connect_MySQL.py から分けている (gunicorn.conf.py のマスタープロセスでも読むため)
+#   DB_POOL_SIZE        = ワーカー 1 つあたりの常時保持する接続数 (既定 5)
+#   DB_MAX_OVERFLOW     = pool_size を超えて一時的に開ける接続数 (既定 10)
+#   DB_POOL_TIMEOUT     = 接続が空くのを待つ最大秒数。超えると TimeoutError (既定 30)
+#   DB_POOL_RECYCLE     = この秒数より古い接続は作り直す (既定 3600。MySQL の wait_timeout より短くする)
+#   DB_POOL_PRE_PING    = 取り出すたびに接続が生きているか確認する (既定 true)
+#   DB_MAX_CONNECTIONS  = DB サーバー側の接続数の上限 (max_connections)。gunicorn の起動時に全ワーカーの合計と比べ、
+#                         超えるなら起動しない (既定 151 = MySQL の既定値。DB の実際の値に合わせて設定する)
+#                         DB_MODE=async のワーカーは同期版と async 版の 2 つのプールを持つので 2 つ分で数える
+#   DB_RESERVED_CONNECTIONS = 上限のうちアプリ以外 (管理ツール・バッチなど) に残しておく数 (既定 5)
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from db_control.instrumentation import timed_pool_class
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '151'))
+DB_RESERVED_CONNECTIONS = int(os.getenv('DB_RESERVED_CONNECTIONS', '5'))
+# connect_MySQL.DB_MODE と同じ値 (エンジンを作らずに読むためここでも読む)
+DB_MODE = os.getenv('DB_MODE', 'sync').lower()
+
+
+def pool_options(url) -> dict:
+    """create_engine / create_async_engine に渡すプールの引数"""
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url) # ドライバの既定のプール
+    options = {
+        "poolclass": timed_pool_class(pool_class), # 接続の取り出し待ちの時間を /metrics と /pool/stats で公開する
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # サイズの指定は QueuePool 系だけが受け付ける (aiosqlite などの NullPool に渡すとエラーになる)
+    if issubclass(pool_class, QueuePool):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+def pools_per_worker() -> int:
+    # DB_MODE=async でも crud / connect_MySQL のインポートで同期版のエンジンが作られ、
+    # 同期版の crud を直接呼ぶ経路から接続を開きうるので、async 版のプールと合わせて 2 つ
+    return 2 if DB_MODE == "async" else 1
+
+def connections_per_worker() -> int:
+    # 1 ワーカーが同時に開きうる接続数の上限 (プールごとに pool_size + max_overflow)
+    return pools_per_worker() * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+
+def check_connection_budget(workers: int) -> tuple[bool, str]:
+    """
+    全ワーカーの接続数の上限が DB の max_connections に収まるか。
+    戻り値: (収まるか, 説明)
+    """
+    total = workers * connections_per_worker()
+    detail = (
+        f"{workers} workers x {pools_per_worker()} pools (DB_MODE={DB_MODE}) "
+        f"x (pool_size {DB_POOL_SIZE} + max_overflow {DB_MAX_OVERFLOW}) = {total} connections"
+    )
+    budget = DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS
+    if total > budget:
+        return False, f"{detail} exceeds the budget of {budget} (max_connections {DB_MAX_CONNECTIONS} - reserved {DB_RESERVED_CONNECTIONS})"
+    return True, f"{detail} within the budget of {budget}"
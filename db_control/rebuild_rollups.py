@@ -0,0 +1,14 @@
+import time
+
+from db_control.connect_MySQL import engine
+from db_control.rollups import rebuild_rollups
+
+# 売上集計テーブル (daily_sales / daily_item_sales / customer_sales) を購入履歴から作り直す
+# 通常は購入登録のたびに加算更新されるので、初回導入時やデータ修正後にだけ実行する
+if __name__ == "__main__":
+    print(f"Rebuilding rollup tables on: {engine.url}")
+    started = time.perf_counter()
+    counts = rebuild_rollups(engine)
+    for table_name, count in counts.items():
+        print(f"  {table_name}: {count} rows")
+    print(f"Rollup tables rebuilt in {time.perf_counter() - started:.1f}s")
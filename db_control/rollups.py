@@ -0,0 +1,204 @@
+# 売上集計 (ロールアップ) テーブルの更新・読み取り・再構築
+#
+# - rollup_statements: 購入 1 件分を集計テーブルに加算する UPSERT 文 (crud.myinsert_purchase が同じトランザクションで実行)
+# - *_query: 分析エンドポイント用の読み取りクエリ (集計済みの行だけを読むので履歴の件数に依存しない)
+# - rebuild_rollups: purchases / purchase_details (購入時の単価 unit_price) から pandas で一括再計算して集計テーブルを作り直す
+#
+# 再構築は集計テーブルを入れ替えるため、購入登録の少ない時間帯に実行する (db_control/rebuild_rollups.py)
+from sqlalchemy import select, delete, insert, func
+from db_control.mymodels_MySQL import (
+    Customers, Items, Purchases, PurchaseDetails, DailySales, DailyItemSales, CustomerSales,
+)
+
+
+def _upsert(dialect_name: str, model, rows: list[dict], key_columns, add_columns, min_columns=(), max_columns=()):
+    """
+    主キーが重複したら add_columns を加算し、min_columns / max_columns は小さい方・大きい方を残す UPSERT 文を作る。
+    MySQL は ON DUPLICATE KEY UPDATE、SQLite / PostgreSQL は ON CONFLICT DO UPDATE を使う。
+    """
+    table = model.__table__
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table).values(rows)
+        new = stmt.inserted
+    elif dialect_name in ("sqlite", "postgresql"):
+        if dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(rows)
+        new = stmt.excluded
+    else:
+        raise NotImplementedError(f"rollup upsert is not supported for dialect: {dialect_name}")
+
+    # SQLite の複数引数 min() / max() は LEAST / GREATEST と同じ意味になる
+    least = func.min if dialect_name == "sqlite" else func.least
+    greatest = func.max if dialect_name == "sqlite" else func.greatest
+    set_ = {column: table.c[column] + new[column] for column in add_columns}
+    set_.update({column: least(table.c[column], new[column]) for column in min_columns})
+    set_.update({column: greatest(table.c[column], new[column]) for column in max_columns})
+
+    if dialect_name == "mysql":
+        return stmt.on_duplicate_key_update(set_)
+    return stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_)
+
+
+def rollup_statements(dialect_name: str, customer_internal_id, purchase_date, lines: list[dict], total: int):
+    """
+    購入 1 件を集計テーブルに反映する UPSERT 文のリスト。
+    lines は crud._purchase_rows が返す明細 (item_id, quantity, subtotal を含む)。
+    ロック順序を揃えてデッドロックを避けるため、明細は item_id 順に並べる。
+    """
+    sales_date = purchase_date.date()
+    lines = sorted(lines, key=lambda line: line["item_id"])
+    return [
+        _upsert(
+            dialect_name, DailySales,
+            [{"sales_date": sales_date, "purchase_count": 1,
+              "quantity": sum(line["quantity"] for line in lines), "revenue": total}],
+            key_columns=["sales_date"], add_columns=["purchase_count", "quantity", "revenue"],
+        ),
+        _upsert(
+            dialect_name, DailyItemSales,
+            [{"sales_date": sales_date, "item_id": line["item_id"],
+              "quantity": line["quantity"], "revenue": line["subtotal"]} for line in lines],
+            key_columns=["sales_date", "item_id"], add_columns=["quantity", "revenue"],
+        ),
+        _upsert(
+            dialect_name, CustomerSales,
+            [{"customer_internal_id": customer_internal_id, "purchase_count": 1, "total_revenue": total,
+              "first_purchase_date": purchase_date, "last_purchase_date": purchase_date}],
+            key_columns=["customer_internal_id"], add_columns=["purchase_count", "total_revenue"],
+            min_columns=["first_purchase_date"], max_columns=["last_purchase_date"],
+        ),
+    ]
+
+
+def _date_range(query, column, start, end):
+    if start is not None:
+        query = query.where(column >= start)
+    if end is not None:
+        query = query.where(column <= end)
+    return query
+
+def daily_sales_query(start=None, end=None):
+    query = select(
+        DailySales.sales_date, DailySales.purchase_count, DailySales.quantity, DailySales.revenue,
+    ).order_by(DailySales.sales_date)
+    return _date_range(query, DailySales.sales_date, start, end)
+
+def item_sales_query(start=None, end=None, limit: int = 100):
+    query = (
+        select(
+            DailyItemSales.item_id,
+            Items.item_name,
+            func.sum(DailyItemSales.quantity).label("quantity"),
+            func.sum(DailyItemSales.revenue).label("revenue"),
+        )
+        .join(Items, Items.item_id == DailyItemSales.item_id)
+        .group_by(DailyItemSales.item_id, Items.item_name)
+        .order_by(func.sum(DailyItemSales.revenue).desc())
+        .limit(limit)
+    )
+    return _date_range(query, DailyItemSales.sales_date, start, end)
+
+def customer_sales_query(limit: int = 100):
+    return (
+        select(
+            CustomerSales.customer_internal_id,
+            Customers.customer_id,
+            Customers.customer_name,
+            CustomerSales.purchase_count,
+            CustomerSales.total_revenue,
+            CustomerSales.first_purchase_date,
+            CustomerSales.last_purchase_date,
+        )
+        .join(Customers, Customers.internal_id == CustomerSales.customer_internal_id)
+        .order_by(CustomerSales.total_revenue.desc())
+        .limit(limit)
+    )
+
+
+def rebuild_rollups(current_engine, chunk_size: int = 100_000, write_batch_size: int = 10_000) -> dict:
+    """
+    購入履歴全体から集計テーブルを再計算して入れ替える。
+    明細は chunk_size 行ずつ読み、チャンクごとに pandas で集計した部分和を最後に足し合わせる
+    (集計結果の大きさは 日数×商品数 / 顧客数 までなので、履歴全体はメモリに載せない)。
+    """
+    import pandas as pd # 再構築のときだけ必要なので遅延インポート
+
+    # --- 明細: 日別・商品別 / 顧客別の売上 (購入時の単価で計算し、商品の現在の価格は使わない) ---
+    detail_query = (
+        select(
+            Purchases.purchase_date,
+            Purchases.customer_internal_id,
+            PurchaseDetails.item_id,
+            PurchaseDetails.quantity,
+            PurchaseDetails.unit_price,
+        )
+        .join(PurchaseDetails, PurchaseDetails.purchase_id == Purchases.purchase_id)
+    )
+    item_parts, customer_revenue_parts = [], []
+    with current_engine.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(detail_query, connection, chunksize=chunk_size):
+            chunk["revenue"] = chunk["unit_price"].to_numpy() * chunk["quantity"].to_numpy()
+            chunk["sales_date"] = pd.to_datetime(chunk["purchase_date"]).dt.date
+            item_parts.append(chunk.groupby(["sales_date", "item_id"], sort=False)[["quantity", "revenue"]].sum())
+            customer_revenue_parts.append(chunk.groupby("customer_internal_id", sort=False)["revenue"].sum())
+
+    # --- ヘッダ: 日別 / 顧客別の購入回数と初回・最終購入日時 ---
+    header_query = select(Purchases.purchase_id, Purchases.customer_internal_id, Purchases.purchase_date)
+    daily_count_parts, customer_parts = [], []
+    with current_engine.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(header_query, connection, chunksize=chunk_size):
+            chunk["sales_date"] = pd.to_datetime(chunk["purchase_date"]).dt.date
+            daily_count_parts.append(chunk.groupby("sales_date", sort=False)["purchase_id"].count())
+            customer_parts.append(
+                chunk.groupby("customer_internal_id", sort=False)["purchase_date"].agg(["count", "min", "max"])
+            )
+
+    if item_parts:
+        daily_item = pd.concat(item_parts).groupby(level=[0, 1]).sum().reset_index()
+    else:
+        daily_item = pd.DataFrame(columns=["sales_date", "item_id", "quantity", "revenue"])
+
+    if daily_count_parts:
+        daily = daily_item.groupby("sales_date")[["quantity", "revenue"]].sum()
+        daily["purchase_count"] = pd.concat(daily_count_parts).groupby(level=0).sum()
+        daily = daily.fillna(0).astype("int64").reset_index()
+    else:
+        daily = pd.DataFrame(columns=["sales_date", "purchase_count", "quantity", "revenue"])
+
+    if customer_parts:
+        customers = pd.concat(customer_parts).groupby(level=0).agg({"count": "sum", "min": "min", "max": "max"})
+        customers["total_revenue"] = pd.concat(customer_revenue_parts).groupby(level=0).sum() if customer_revenue_parts else 0
+        customers = customers.fillna({"total_revenue": 0}).astype({"total_revenue": "int64"}).reset_index().rename(columns={
+            "count": "purchase_count", "min": "first_purchase_date", "max": "last_purchase_date",
+        })
+    else:
+        customers = pd.DataFrame(columns=[
+            "customer_internal_id", "purchase_count", "total_revenue", "first_purchase_date", "last_purchase_date",
+        ])
+
+    # --- 集計テーブルを入れ替え (1 トランザクション) ---
+    tables = [
+        (DailySales, daily[["sales_date", "purchase_count", "quantity", "revenue"]]),
+        (DailyItemSales, daily_item[["sales_date", "item_id", "quantity", "revenue"]]),
+        (CustomerSales, customers[[
+            "customer_internal_id", "purchase_count", "total_revenue", "first_purchase_date", "last_purchase_date",
+        ]]),
+    ]
+    counts = {}
+    with current_engine.begin() as connection:
+        for model, frame in tables:
+            connection.execute(delete(model))
+            # numpy の数値型・Timestamp を DB ドライバが扱える Python の型にする
+            records = frame.astype(object).to_dict("records")
+            for record in records:
+                for key in ("first_purchase_date", "last_purchase_date"):
+                    if key in record:
+                        record[key] = record[key].to_pydatetime()
+            for start in range(0, len(records), write_batch_size):
+                connection.execute(insert(model), records[start:start + write_batch_size])
+            counts[model.__tablename__] = len(records)
+    return counts
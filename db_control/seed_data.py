@@ -0,0 +1,325 @@
+# 容量試験用の合成データの生成と一括投入
+#
+# customers / items / purchases / purchase_details を乱数で生成して投入する。
+# --seed が同じなら何度実行しても同じデータになる (テーブルごとに別の乱数列なので、例えば --items を変えても顧客は変わらない)。
+# 行は chunk 単位で生成してはすぐ投入するので、数千万行でもメモリ使用量は chunk の大きさで決まる。
+#
+# 分布
+#   - 顧客: 年齢は 18-90 歳の三角分布 (最頻値 35)、性別は男性/女性がほぼ半々
+#   - 商品: 価格は対数正規分布 (中央値 ITEM_PRICE_MEDIAN 円、10 円単位)。売れ筋はジップ則 (順位 r の商品の選ばれやすさ ∝ 1/r^ITEM_POPULARITY_SKEW)
+#   - 購入: 顧客ごとの購入回数の偏り (一部の顧客が大半を買う) は CUSTOMER_ACTIVITY_SKEW、日時は --days 日間に一様
+#   - 明細: 1 購入あたりの行数は平均 --lines-per-purchase の幾何分布 (1 行以上 MAX_LINES_PER_PURCHASE 行以下)、数量は 1 個が最多、単価は商品の価格
+#
+# 投入の経路 (--loader)
+#   executemany : --batch-size 行ずつ INSERT の executemany (pymysql は multi-row INSERT に書き換える)
+#   infile      : MySQL 専用。chunk を CSV に書き出して LOAD DATA LOCAL INFILE (サーバーの local_infile=ON が必要)
+#   auto (既定) : MySQL で local_infile が有効なら infile、それ以外は executemany
+# どちらの経路でも、テーブルを作り直したあと主キー以外の索引を外して投入し、最後にまとめて作り直す
+# (1 行ごとの索引の更新をなくす)。投入中は MySQL では外部キー・一意性の検査を、SQLite では fsync を止める。
+# テーブルごとの rows/s は投入 (DB 側) にかかった時間から計算する (データの生成時間は含まない)。
+#
+# 既存のテーブルは削除されるので --reset が必要。
+# 実行例:
+#   python -m db_control.seed_data --reset --customers 1000000 --items 5000
+#   DATABASE_URL=sqlite:///capacity.db python -m db_control.seed_data --reset --customers 100000
+import argparse
+import csv
+import hashlib
+import itertools
+import math
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from db_control.connect_MySQL import engine
+from db_control.mymodels_MySQL import Base
+from db_control.uuid_types import UUID_STORAGE, UUID_VERSION
+
+# 投入するテーブルと、値を生成するカラム (それ以外のカラムは既定値になる)
+SEED_COLUMNS = {
+    "customers": ("internal_id", "customer_id", "customer_name", "age", "gender"),
+    "items": ("item_id", "item_name", "price"),
+    "purchases": ("purchase_id", "customer_internal_id", "purchase_date"),
+    "purchase_details": ("purchase_id", "item_id", "quantity", "unit_price"),
+}
+# UUID を保存するカラム (infile では文字列または 16 進で書き出す)
+UUID_COLUMNS = {"internal_id", "customer_internal_id"}
+
+FAMILY_NAMES = ("佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+                "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "斎藤", "清水")
+GIVEN_NAMES = ("太郎", "花子", "翔太", "陽菜", "大輝", "結衣", "蓮", "美咲", "悠真", "葵",
+               "健太", "さくら", "拓海", "凛", "颯", "莉子", "陸", "芽依", "湊", "結菜")
+GENDERS = ("男性", "女性", "その他")
+GENDER_WEIGHTS = (49, 49, 2)
+
+ITEM_PRICE_MEDIAN = 3000
+ITEM_POPULARITY_SKEW = 1.1
+CUSTOMER_ACTIVITY_SKEW = 2.0 # 1 なら一様。大きいほど採番の早い顧客に購入が偏る
+MAX_LINES_PER_PURCHASE = 20
+PURCHASES_START = datetime(2023, 1, 1)
+UUID7_EPOCH_MS = int(PURCHASES_START.timestamp() * 1000)
+
+# infile で 1 回の LOAD DATA に入れる行数
+INFILE_CHUNK_ROWS = 1_000_000
+
+
+class SeedConfig:
+    def __init__(self, customers: int, items: int, purchases_per_customer: float, lines_per_purchase: float,
+                 days: int, seed: int):
+        self.customers = customers
+        self.items = items
+        self.purchases_per_customer = purchases_per_customer
+        self.lines_per_purchase = lines_per_purchase
+        self.days = days
+        self.seed = seed
+
+    def rng(self, table: str) -> random.Random:
+        return random.Random(f"{self.seed}:{table}")
+
+
+# --- データの生成 ---
+
+def customer_internal_id(seed: int, index: int) -> uuid.UUID:
+    """index 番目の顧客の internal_id (購入の生成時に顧客の一覧を持たなくても同じ値を計算できる)"""
+    value = int.from_bytes(hashlib.blake2b(f"{seed}:{index}".encode(), digest_size=16).digest(), "big")
+    if UUID_VERSION == 7:
+        # 先頭 48 ビットを採番順の時刻にする (本番の UUIDv7 と同じく主キー順に追記される並びになる)
+        value = (value & ((1 << 80) - 1)) | ((UUID7_EPOCH_MS + index) << 80)
+        version = 7
+    else:
+        version = 4
+    value = (value & ~(0xF << 76)) | (version << 76)     # version
+    value = (value & ~(0b11 << 62)) | (0b10 << 62)       # variant
+    return uuid.UUID(int=value)
+
+def item_id(index: int) -> str:
+    return f"ITEM{index:06d}"
+
+def generate_customers(config: SeedConfig):
+    rng = config.rng("customers")
+    for index in range(config.customers):
+        yield (
+            customer_internal_id(config.seed, index),
+            f"C{index:09d}",
+            f"{rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)}",
+            int(rng.triangular(18, 90, 35)),
+            rng.choices(GENDERS, GENDER_WEIGHTS)[0],
+        )
+
+def generate_items(config: SeedConfig):
+    rng = config.rng("items")
+    for index in range(config.items):
+        price = max(100, round(rng.lognormvariate(math.log(ITEM_PRICE_MEDIAN), 0.9), -1))
+        yield item_id(index), f"商品{index:06d}", int(price)
+
+def generate_purchases(config: SeedConfig):
+    """(購入の行, その明細の行のリスト) を purchase_id 順に返す"""
+    rng = config.rng("purchases")
+    item_ids = [item_id(index) for index in range(config.items)]
+    prices = {item: price for item, _, price in generate_items(config)} # 商品と同じ乱数列なので投入した価格と一致する
+    item_weights = list(itertools.accumulate(1 / (rank + 1) ** ITEM_POPULARITY_SKEW for rank in range(config.items)))
+    max_lines = min(MAX_LINES_PER_PURCHASE, config.items)
+    extra_lines = 1 / max(config.lines_per_purchase - 1, 1e-9) # 2 行目以降の行数の幾何分布のパラメータ
+    span_seconds = config.days * 86400
+    for purchase_id in range(1, round(config.customers * config.purchases_per_customer) + 1):
+        customer_index = int(config.customers * rng.random() ** CUSTOMER_ACTIVITY_SKEW)
+        purchase_date = PURCHASES_START + timedelta(seconds=rng.randrange(span_seconds))
+        lines = min(1 + int(rng.expovariate(extra_lines)), max_lines)
+        picked = set()
+        while len(picked) < lines:
+            picked.update(rng.choices(item_ids, cum_weights=item_weights, k=lines - len(picked)))
+        yield (
+            (purchase_id, customer_internal_id(config.seed, customer_index), purchase_date),
+            [(purchase_id, picked_id, 1 + int(rng.expovariate(1.5)), prices[picked_id]) for picked_id in sorted(picked)],
+        )
+
+def _chunks(rows, size: int):
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+# --- 投入 ---
+
+def _bulk_session(connection):
+    # 投入に使う接続だけの設定。生成したデータは制約を満たしているので検査を省く
+    if connection.dialect.name == "mysql":
+        connection.exec_driver_sql("SET foreign_key_checks = 0, unique_checks = 0")
+    elif connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("PRAGMA synchronous = OFF")
+
+class ExecutemanyLoader:
+    name = "executemany"
+
+    def __init__(self, current_engine, batch_size: int):
+        self.engine = current_engine
+        self.chunk_size = batch_size
+
+    def load(self, table, rows):
+        columns = SEED_COLUMNS[table.name]
+        with self.engine.begin() as connection:
+            _bulk_session(connection)
+            connection.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+class InfileLoader:
+    """MySQL の LOAD DATA LOCAL INFILE。chunk ごとに一時ファイルの CSV を書いて読み込ませる"""
+    name = "infile"
+
+    def __init__(self, current_engine, workdir: str, chunk_size: int = INFILE_CHUNK_ROWS):
+        # pymysql は local_infile=True を指定した接続でだけ LOCAL INFILE を送れるので、投入用に別のエンジンを作る
+        self.engine = create_engine(
+            current_engine.url, poolclass=NullPool,
+            connect_args={"ssl_verify_cert": True, "local_infile": True},
+        )
+        self.path = os.path.join(workdir, "seed.csv")
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def available(current_engine) -> bool:
+        if current_engine.dialect.name != "mysql":
+            return False
+        with current_engine.connect() as connection:
+            return bool(connection.exec_driver_sql("SELECT @@GLOBAL.local_infile").scalar())
+
+    def _statement(self, table) -> str:
+        columns = SEED_COLUMNS[table.name]
+        binary = [column for column in columns if column in UUID_COLUMNS and UUID_STORAGE == "binary"]
+        targets = ", ".join(f"@{column}" if column in binary else column for column in columns)
+        statement = (
+            f"LOAD DATA LOCAL INFILE '{self.path}' INTO TABLE {table.name} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' ({targets})"
+        )
+        if binary:
+            statement += " SET " + ", ".join(f"{column} = UNHEX(@{column})" for column in binary)
+        return statement
+
+    def load(self, table, rows):
+        uuid_positions = [i for i, column in enumerate(SEED_COLUMNS[table.name]) if column in UUID_COLUMNS]
+        with open(self.path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            for row in rows:
+                if uuid_positions:
+                    row = list(row)
+                    for i in uuid_positions:
+                        row[i] = row[i].hex if UUID_STORAGE == "binary" else str(row[i])
+                writer.writerow(row)
+        with self.engine.begin() as connection:
+            _bulk_session(connection)
+            connection.exec_driver_sql(self._statement(table))
+        os.remove(self.path)
+
+
+def drop_secondary_indexes(current_engine) -> list:
+    """主キー以外の索引 (mymodels_MySQL.py で定義したもの) を外し、外した索引を返す"""
+    inspector = inspect(current_engine)
+    dropped = []
+    with current_engine.begin() as connection:
+        _bulk_session(connection) # MySQL で外部キーが使っている索引も外せるようにする
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing:
+                    connection.execute(DropIndex(index))
+                    dropped.append(index)
+    return dropped
+
+def create_indexes(current_engine, indexes) -> dict:
+    """索引を作り直し、索引ごとの所要秒数を返す"""
+    seconds = {}
+    for index in indexes:
+        started = time.perf_counter()
+        with current_engine.begin() as connection:
+            _bulk_session(connection)
+            connection.execute(CreateIndex(index))
+        seconds[f"{index.table.name}.{index.name}"] = time.perf_counter() - started
+    return seconds
+
+def seed(loader, config: SeedConfig) -> dict:
+    """データを生成して loader で投入し、テーブルごとの {"rows": 行数, "seconds": 投入にかかった秒数} を返す"""
+    stats = {table_name: {"rows": 0, "seconds": 0.0} for table_name in SEED_COLUMNS}
+
+    def load(table_name: str, rows):
+        started = time.perf_counter()
+        loader.load(Base.metadata.tables[table_name], rows)
+        stats[table_name]["seconds"] += time.perf_counter() - started
+        stats[table_name]["rows"] += len(rows)
+
+    for chunk in _chunks(generate_customers(config), loader.chunk_size):
+        load("customers", chunk)
+    for chunk in _chunks(generate_items(config), loader.chunk_size):
+        load("items", chunk)
+    for chunk in _chunks(generate_purchases(config), loader.chunk_size):
+        load("purchases", [purchase for purchase, _ in chunk])
+        load("purchase_details", [detail for _, details in chunk for detail in details])
+    return stats
+
+
+def _rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:>10.0f} rows/s" if seconds else f"{'-':>10s} rows/s"
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic data and bulk load it")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--purchases-per-customer", type=float, default=5.0, help="average purchases per customer")
+    parser.add_argument("--lines-per-purchase", type=float, default=2.5, help="average detail lines per purchase")
+    parser.add_argument("--days", type=int, default=730, help="purchase dates are spread over this many days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--loader", choices=("auto", "executemany", "infile"), default="auto")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per executemany")
+    parser.add_argument("--rollups", action="store_true", help="rebuild the rollup tables after loading (needs pandas)")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables (required)")
+    args = parser.parse_args()
+
+    if not args.reset:
+        parser.error(f"--reset is required: all tables on {engine.url} will be dropped and recreated")
+    if args.items < 1:
+        parser.error("--items must be at least 1")
+    config = SeedConfig(args.customers, args.items, args.purchases_per_customer, args.lines_per_purchase,
+                        args.days, args.seed)
+
+    print(f"Seeding: {engine.url}")
+    started = time.perf_counter()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    indexes = drop_secondary_indexes(engine)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        use_infile = args.loader == "infile" or (args.loader == "auto" and InfileLoader.available(engine))
+        if use_infile:
+            loader = InfileLoader(engine, workdir)
+        else:
+            loader = ExecutemanyLoader(engine, args.batch_size)
+        print(f"  loader: {loader.name}")
+        stats = seed(loader, config)
+    for table_name, table_stats in stats.items():
+        print(f"  {table_name:18s} {table_stats['rows']:>11d} rows {table_stats['seconds']:8.1f}s "
+              f"{_rate(table_stats['rows'], table_stats['seconds'])}")
+
+    for name, seconds in create_indexes(engine, indexes).items():
+        print(f"  index {name}: {seconds:.1f}s")
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE")) # 索引を作り直したので統計情報を取り直す
+    if args.rollups:
+        from db_control.rollups import rebuild_rollups
+
+        rollup_started = time.perf_counter()
+        rebuild_rollups(engine)
+        print(f"  rollups rebuilt in {time.perf_counter() - rollup_started:.1f}s")
+
+    total_rows = sum(table_stats["rows"] for table_stats in stats.values())
+    elapsed = time.perf_counter() - started
+    print(f"Seeded {total_rows} rows in {elapsed:.1f}s ({_rate(total_rows, elapsed).strip()} including generation and indexes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# internal_id (UUID) の保存形式と採番方法
+#
+# 環境変数で切り替える (既存テーブルとの互換のため既定は従来どおり)
+#   UUID_STORAGE = char (既定、MySQL では CHAR(36)) / binary (MySQL では BINARY(16))
+#   UUID_VERSION = 4 (既定、ランダム) / 7 (先頭が時刻の UUID。主キー順に追記されるので InnoDB のページ分割が減る)
+# 既存の CHAR(36) テーブルを binary に移行するときは db_control/migrate_uuid_binary_MySQL.py を使う
+import os
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy.types import TypeDecorator, Uuid
+from sqlalchemy.dialects.mysql import BINARY as MYSQL_BINARY, CHAR as MYSQL_CHAR
+
+load_dotenv()
+
+UUID_STORAGE = os.getenv('UUID_STORAGE', 'char').lower()
+UUID_VERSION = int(os.getenv('UUID_VERSION', '4'))
+
+
+class BinaryUUID(TypeDecorator):
+    """
+    MySQL では BINARY(16) に詰めて保存し、Python 側では uuid.UUID として扱う型。
+    CHAR(36) と比べて主キー・外部キー・セカンダリインデックスの 1 件あたりのサイズが半分以下になる。
+    MySQL 以外では汎用の Uuid 型として振る舞う。
+    """
+    impl = Uuid
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(MYSQL_BINARY(16))
+        return dialect.type_descriptor(Uuid(as_uuid=True))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        if dialect.name == "mysql":
+            return value.bytes
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == "mysql":
+            return uuid.UUID(bytes=bytes(value))
+        return value
+
+
+def uuid_column_type():
+    """internal_id と、それを参照する外部キー列で使う型 (参照元と参照先で必ず同じ型にする)"""
+    if UUID_STORAGE == "binary":
+        return BinaryUUID()
+    # MySQLはCHAR(36)やBINARY(16)でUUIDを扱えるので、標準のSQLAlchemyUUIDを使用
+    # (as_uuid=True) でPython側ではuuid.UUIDオブジェクトとして扱われる
+    return Uuid(as_uuid=True).with_variant(MYSQL_CHAR(36), "mysql")
+
+
+def uuid7() -> uuid.UUID:
+    """RFC 9562 の UUID version 7 (先頭 48 ビットが Unix 時刻のミリ秒、残りは乱数)"""
+    unix_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (unix_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76                            # version
+    value |= ((rand >> 64) & 0x0FFF) << 64        # rand_a (12 bit)
+    value |= 0b10 << 62                           # variant
+    value |= rand & 0x3FFF_FFFF_FFFF_FFFF         # rand_b (62 bit)
+    return uuid.UUID(int=value)
+
+
+def new_internal_id() -> uuid.UUID:
+    """新しい internal_id を採番する (UUID_VERSION に従う)"""
+    if UUID_VERSION == 7:
+        return uuid7()
+    return uuid.uuid4()
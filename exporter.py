@@ -0,0 +1,187 @@
+# テーブルのエクスポート (GET /export/{table} と CLI)
+#
+# crud.myexport_stream がサーバーサイドカーソルから chunk_size 件ずつ読んだ行を、チャンクごとにエンコードして書き出す。
+# メモリに載るのは 1 チャンク分だけなので、テーブルの大きさによらずピークメモリは一定になる。
+#   csv     : ヘッダ行 + チャンクごとの CSV
+#   arrow   : Arrow IPC ストリーム形式。1 チャンク = 1 レコードバッチ
+#   parquet : 1 チャンク = 1 行グループ (フッタは最後に書く)
+# Arrow / Parquet はチャンクを列ごとに転置して pyarrow の配列を直接作る (行ごとの dict や DataFrame を作らない)
+# pyarrow はインポートが遅いので、arrow / parquet を使うときに関数内でインポートする
+#
+# CLI の実行例:
+#   python exporter.py customers --format parquet --output customers.parquet
+#   python exporter.py purchases --format csv > purchases.csv
+import argparse
+import csv
+import io
+import sys
+import time
+import uuid
+
+from sqlalchemy import types as sa_types
+
+# 形式 -> (Content-Type, ファイルの拡張子)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"), # Starlette が charset=utf-8 を付ける
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class CSVExportWriter:
+    def __init__(self, columns):
+        self.names = [name for name, _ in columns]
+
+    def _encode(self, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def begin(self) -> bytes:
+        return self._encode([self.names])
+
+    def write(self, rows) -> bytes:
+        return self._encode(rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ChunkSink:
+    """pyarrow の書き込み先 (ファイルの代わり)。書かれたバイト列を溜めておき、チャンクごとに取り出す"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _arrow_type(pa, sa_type):
+    if isinstance(sa_type, sa_types.TypeDecorator): # uuid_types.BinaryUUID など
+        sa_type = sa_type.impl
+    if isinstance(sa_type, sa_types.Integer):
+        return pa.int64()
+    if isinstance(sa_type, sa_types.DateTime):
+        return pa.timestamp("us")
+    if isinstance(sa_type, sa_types.Date):
+        return pa.date32()
+    if isinstance(sa_type, sa_types.Numeric):
+        return pa.float64()
+    return pa.string() # 文字列・UUID (文字列にして書く)
+
+
+class _ArrowExportWriter:
+    """Arrow / Parquet 共通: チャンクを列ごとの配列にしてレコードバッチを作る"""
+
+    def __init__(self, columns):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = pa.schema([(name, _arrow_type(pa, sa_type)) for name, sa_type in columns])
+        self.sink = _ChunkSink()
+        self.writer = None
+
+    def _batch(self, rows):
+        pa = self.pa
+        arrays = []
+        for field, values in zip(self.schema, zip(*rows)):
+            if field.type == pa.string():
+                values = [str(value) if isinstance(value, uuid.UUID) else value for value in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def begin(self) -> bytes:
+        return self.sink.take()
+
+    def write(self, rows) -> bytes:
+        if rows:
+            self.writer.write_batch(self._batch(rows))
+        return self.sink.take()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+
+class ArrowExportWriter(_ArrowExportWriter):
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.writer = self.pa.ipc.new_stream(self.sink, self.schema)
+
+
+class ParquetExportWriter(_ArrowExportWriter):
+    def __init__(self, columns):
+        super().__init__(columns)
+        import pyarrow.parquet as pq
+
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="snappy")
+
+    def write(self, rows) -> bytes:
+        if rows:
+            self.writer.write_batch(self._batch(rows), row_group_size=len(rows))
+        return self.sink.take()
+
+
+_WRITERS = {"csv": CSVExportWriter, "arrow": ArrowExportWriter, "parquet": ParquetExportWriter}
+
+def create_export_writer(format: str, columns):
+    """columns は crud.export_columns(table) の (カラム名, SQLAlchemy の型) のリスト"""
+    return _WRITERS[format](columns)
+
+
+def export_to_file(table: str, format: str, output, chunk_size: int = 10000) -> int:
+    """同期版の crud でテーブルを output (バイナリのファイル) に書き出し、行数を返す"""
+    from db_control import crud
+
+    writer = create_export_writer(format, crud.export_columns(table))
+    rows = 0
+    output.write(writer.begin())
+    for chunk in crud.myexport_stream(table, chunk_size=chunk_size):
+        output.write(writer.write(chunk))
+        rows += len(chunk)
+    output.write(writer.finish())
+    return rows
+
+
+def main():
+    from db_control.crud import EXPORT_QUERIES
+
+    parser = argparse.ArgumentParser(description="Export a table as CSV, Arrow IPC stream or Parquet")
+    parser.add_argument("table", choices=sorted(EXPORT_QUERIES))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", help="output file (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows fetched and encoded at a time")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.output:
+        with open(args.output, "wb") as output:
+            rows = export_to_file(args.table, args.format, output, args.chunk_size)
+    else:
+        rows = export_to_file(args.table, args.format, sys.stdout.buffer, args.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"exported {rows} rows from {args.table} as {args.format} in {elapsed:.2f}s "
+          f"({rows / elapsed if elapsed else 0:.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# gunicorn の設定 (カレントディレクトリの gunicorn.conf.py は自動で読み込まれる)
+#
+# 起動例 (Azure App Service のスタートアップコマンドなど):
+#   gunicorn app:app
+#
+# 設定 (環境変数)
+#   GUNICORN_BIND    = 待ち受けるアドレス (既定 0.0.0.0:8000。App Service では PORT を使う)
+#   WEB_CONCURRENCY  = ワーカー数 (既定 1 = gunicorn の既定と同じ。増やすときは DB の接続数の上限も確認する)
+#   GUNICORN_TIMEOUT = 応答のないワーカーを再起動するまでの秒数 (既定 120)
+#   DB_POOL_* / DB_MAX_CONNECTIONS = db_control/pool_settings.py を参照
+import os
+
+from db_control.pool_settings import check_connection_budget
+
+bind = os.getenv("GUNICORN_BIND") or f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# このファイルは自動で読み込まれるので、指定がなければ gunicorn 単体と同じ 1 ワーカーにしておく
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# アプリ (= エンジン) はワーカーごとに fork 後にインポートする。
+# preload_app=True にした場合も、connect_MySQL の os.register_at_fork で子プロセスのプールは空から始まる
+preload_app = False
+
+
+def on_starting(server):
+    # 全ワーカーのプールの上限の合計が DB の max_connections を超えるなら起動しない
+    # (負荷が上がったときに "Too many connections" でまとめて失敗するのを防ぐ)
+    ok, detail = check_connection_budget(server.cfg.workers)
+    if not ok:
+        server.log.error(f"DB connection budget exceeded: {detail}")
+        raise SystemExit(f"DB connection budget exceeded: {detail}. Lower WEB_CONCURRENCY, DB_POOL_SIZE or DB_MAX_OVERFLOW, or set DB_MAX_CONNECTIONS to the server's max_connections.")
+    server.log.info(f"DB connection budget: {detail}")
+
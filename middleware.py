@@ -0,0 +1,70 @@
+# リクエストごとの計測を行う ASGI ミドルウェア
+# ルート (パスのテンプレート) ごとに処理時間・SQL 件数・DB 時間・プール待ち時間のヒストグラムを記録し、
+# レスポンスには Server-Timing ヘッダで DB 時間とクエリ数を付ける (ブラウザの開発者ツールで確認できる)
+import time
+
+from starlette.datastructures import MutableHeaders
+
+from db_control import instrumentation
+from db_control.instrumentation import (
+    Counter, Histogram, register, LATENCY_BUCKETS, STATEMENT_BUCKETS, COUNT_BUCKETS,
+)
+
+http_requests_total = register(Counter(
+    "http_requests_total", "HTTP requests", ("method", "route", "status")))
+http_request_seconds = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS, ("method", "route")))
+db_queries_per_request = register(Histogram(
+    "db_queries_per_request", "SQL statements executed per request", COUNT_BUCKETS, ("method", "route")))
+db_time_per_request = register(Histogram(
+    "db_time_per_request_seconds", "Total SQL time per request", LATENCY_BUCKETS, ("method", "route")))
+db_slowest_statement = register(Histogram(
+    "db_slowest_statement_seconds", "Slowest SQL statement per request", STATEMENT_BUCKETS, ("method", "route")))
+db_pool_wait_per_request = register(Histogram(
+    "db_pool_wait_per_request_seconds", "Connection pool wait per request", STATEMENT_BUCKETS, ("method", "route")))
+
+
+def _route_label(scope) -> str:
+    # ルーティング後に FastAPI が scope["route"] を設定する。パスそのものではなくテンプレートを使い、
+    # /customers/{internal_id} のような動的なパスでラベルが増え続けないようにする
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = instrumentation.start_request_stats()
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.db_time * 1000:.1f};desc="{stats.query_count} queries"',
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            instrumentation.end_request_stats(token)
+            elapsed = time.perf_counter() - started
+            method = scope["method"]
+            route = _route_label(scope)
+            http_requests_total.inc(method, route, status_code)
+            http_request_seconds.observe(elapsed, method, route)
+            db_queries_per_request.observe(stats.query_count, method, route)
+            db_time_per_request.observe(stats.db_time, method, route)
+            db_slowest_statement.observe(stats.slowest_time, method, route)
+            db_pool_wait_per_request.observe(stats.pool_wait, method, route)
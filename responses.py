@@ -0,0 +1,26 @@
+# JSON レスポンスの高速パス
+# response_model の Pydantic 検証・jsonable_encoder を通さずに、dict / list をそのまま JSON のバイト列にする。
+# orjson があればそれを使い (UUID・datetime もそのまま扱える)、なければ標準の json で同じ形に書き出す。
+# エンドポイント側は response_model を残したまま FastJSONResponse を返すので、OpenAPI のスキーマは変わらない。
+import json
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError: # requirements.txt に含めているが、入っていない環境でも (遅いだけで) 動くようにしておく
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """中身の検証はしないので、スキーマどおりの dict / list を渡すこと"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
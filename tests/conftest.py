@@ -0,0 +1,28 @@
+# テストはローカルの SQLite で動かす。db_control はインポート時にエンジンを作るので、
+# インポートより前に接続先を一時ファイルの SQLite に向けておく (.env の MySQL には接続しない)
+import os
+import sys
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="app-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ["DB_MODE"] = "sync"
+os.environ["CUSTOMER_CACHE_BACKEND"] = "none"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pytest
+
+from db_control.connect_MySQL import engine
+from db_control import mymodels_MySQL as mymodels
+
+
+@pytest.fixture(scope="module")
+def db():
+    """テーブルを作り直した空のデータベース (モジュールごと)"""
+    mymodels.Base.metadata.drop_all(engine)
+    mymodels.Base.metadata.create_all(engine)
+    yield engine
@@ -0,0 +1,76 @@
+# GET /allcustomers のキーセットページネーション (limit / after / X-Next-Cursor) とストリーミング
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import app
+from db_control.mymodels_MySQL import Customers
+
+# 名前・年齢・性別がすべて同じ行を混ぜる (並び順は internal_id だけで決まる)
+ROWS = [
+    {"internal_id": uuid.UUID(int=i + 1, version=4), "customer_id": f"P{i:04d}",
+     "customer_name": "同名" if i % 3 else f"顧客{i}", "age": 30 if i % 3 else i, "gender": "female"}
+    for i in range(23)
+]
+EXPECTED = sorted(str(row["internal_id"]) for row in ROWS)
+
+
+@pytest.fixture(scope="module")
+def client(db):
+    with Session(db) as session:
+        session.execute(insert(Customers), ROWS)
+        session.commit()
+    return TestClient(app.app)
+
+
+@pytest.mark.parametrize("limit", [1, 5, 23, 100])
+def test_pages_cover_every_row_once(client, limit):
+    seen, after, pages = [], None, 0
+    while True:
+        params = {"limit": limit} | ({"after": after} if after else {})
+        response = client.get("/allcustomers", params=params)
+        assert response.status_code == 200
+        page = [customer["internal_id"] for customer in response.json()]
+        assert len(page) <= limit
+        seen += page
+        pages += 1
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+        assert after == page[-1]
+    assert seen == EXPECTED # 重複も抜けもなく internal_id 順
+    assert pages == len(EXPECTED) // limit + 1 # 件数が limit の倍数なら最後は空のページ
+
+
+def test_without_limit_returns_everything_without_a_cursor(client):
+    response = client.get("/allcustomers")
+    assert [customer["internal_id"] for customer in response.json()] == EXPECTED
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.parametrize("params", [{}, {"after": EXPECTED[9]}, {"after": EXPECTED[9], "limit": 4}])
+@pytest.mark.parametrize("stream", ["ndjson", "json"])
+def test_stream_returns_the_same_rows(client, stream, params):
+    response = client.get("/allcustomers", params={"stream": stream} | params)
+    assert response.status_code == 200
+    if stream == "ndjson":
+        assert response.headers["content-type"] == "application/x-ndjson"
+        customers = [json.loads(line) for line in response.text.splitlines() if line]
+    else:
+        customers = response.json()
+    expected = client.get("/allcustomers", params=params).json()
+    assert customers == expected
+    start = 10 if "after" in params else 0
+    assert [customer["internal_id"] for customer in customers] == EXPECTED[start:start + params.get("limit", len(EXPECTED))]
+
+
+@pytest.mark.parametrize("after", ["not-a-cursor", "123", EXPECTED[0][:-1]])
+def test_invalid_cursor_is_rejected(client, after):
+    for params in ({"after": after}, {"after": after, "limit": 5}, {"after": after, "stream": "ndjson"}):
+        response = client.get("/allcustomers", params=params)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,122 @@
+# POST /customers/bulk の行ごとの結果 (JSON 配列 / NDJSON / CSV / multipart)
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import app
+from db_control.mymodels_MySQL import Customers
+
+EXISTING = "E0000"
+
+
+@pytest.fixture(scope="module")
+def client(db):
+    with Session(db) as session:
+        session.execute(insert(Customers), [
+            {"customer_id": EXISTING, "customer_name": "登録済み", "age": 50, "gender": "male"}])
+        session.commit()
+    return TestClient(app.app) # lifespan (商品カタログの読み込みなど) は不要なので with で開かない
+
+
+def _rows(prefix: str) -> list[dict]:
+    # 有効・不正・リクエスト内の重複・登録済みとの重複を混ぜる
+    return [
+        {"customer_id": f"{prefix}1", "customer_name": "一人目", "age": 20, "gender": "female"},
+        {"customer_id": f"{prefix}2", "customer_name": "年齢が不正", "age": "abc", "gender": "male"},
+        {"customer_id": f"{prefix}1", "customer_name": "重複", "age": 30, "gender": "male"},
+        {"customer_id": EXISTING, "customer_name": "登録済みと重複", "age": 40, "gender": "female"},
+        {"customer_id": f"{prefix}3", "customer_name": "三人目", "age": 60, "gender": "male"},
+    ]
+
+
+def _csv(rows: list[dict]) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+
+def _post(client, format: str, rows: list[dict], **params):
+    if format == "json":
+        return client.post("/customers/bulk", params=params, content=json.dumps(rows, ensure_ascii=False).encode(),
+                           headers={"Content-Type": "application/json"})
+    if format == "ndjson":
+        body = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows).encode()
+        return client.post("/customers/bulk", params=params, content=body, headers={"Content-Type": "application/x-ndjson"})
+    if format == "csv":
+        return client.post("/customers/bulk", params=params, content=_csv(rows), headers={"Content-Type": "text/csv"})
+    return client.post("/customers/bulk", params=params, files={"file": ("customers.csv", _csv(rows), "text/csv")})
+
+
+@pytest.mark.parametrize("format, prefix", [("json", "J"), ("ndjson", "N"), ("csv", "C"), ("multipart", "M")])
+@pytest.mark.parametrize("batch_size", [1, 1000])
+def test_row_results(client, db, format, prefix, batch_size):
+    prefix = f"{prefix}{batch_size}-"
+    response = _post(client, format, _rows(prefix), batch_size=batch_size, return_created="true")
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (2, 3)
+    results = {result["index"]: result for result in body["results"]}
+    assert [results[i]["status"] for i in range(5)] == ["created", "invalid", "error", "error", "created"]
+    assert results[1]["error"].startswith("age")
+    # 同じバッチ内の重複は INSERT 前に弾き、先のバッチで登録済みなら一意制約違反と同じ扱い
+    assert results[2]["error"] == ("duplicate customer_id in request" if batch_size > 2 else "customer_id already exists")
+    assert results[3]["customer_id"] == EXISTING
+    with Session(db) as session:
+        stored = set(session.scalars(select(Customers.customer_id).where(Customers.customer_id.like(f"{prefix}%"))))
+    assert stored == {f"{prefix}1", f"{prefix}3"}
+
+
+def test_ndjson_broken_line_is_one_invalid_row(client):
+    body = b'{"customer_id": "L1", "customer_name": "a", "age": 1, "gender": "x"}\n{"customer_id": \n' \
+           b'{"customer_id": "L2", "customer_name": "b", "age": 2, "gender": "x"}\n'
+    body = client.post("/customers/bulk", content=body, headers={"Content-Type": "application/x-ndjson"}).json()
+    assert (body["created"], body["failed"]) == (2, 1)
+    assert [(result["index"], result["status"]) for result in body["results"]] == [(1, "invalid")]
+
+
+@pytest.mark.parametrize("body", [b"", b'{"customer_id": "X"}', b"[{", b"not json"])
+def test_json_that_is_not_an_array_is_rejected(client, body):
+    response = client.post("/customers/bulk", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_json_broken_after_some_elements_reports_the_rest_as_invalid(client):
+    rows = [{"customer_id": f"T{i}", "customer_name": "途中", "age": 1, "gender": "x"} for i in range(2)]
+    body = json.dumps(rows).encode()[:-1] + b', {"customer_id": '
+    body = client.post("/customers/bulk", content=body, headers={"Content-Type": "application/json"}).json()
+    assert (body["created"], body["failed"]) == (2, 1)
+    assert body["results"][0]["index"] == 2 and body["results"][0]["status"] == "invalid"
+    assert "not processed" in body["results"][0]["error"]
+
+
+def _elements(body: bytes, chunk_size: int) -> list:
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def collect():
+        return [obj async for obj in app._json_array_elements(chunks())]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+def test_json_array_is_parsed_across_chunk_boundaries(chunk_size):
+    # 数値・マルチバイト文字・エスケープ・入れ子がチャンクの境目で切れても、一度に読んだ場合と同じ結果になる
+    data = [{"customer_id": '名前"あ\\', "age": 12345, "nested": [1, {"a": None}]}, 678, "文字列", [], {}]
+    body = ("\ufeff " + json.dumps(data, ensure_ascii=False, indent=1) + " \n").encode()
+    assert _elements(body, chunk_size) == data
+
+
+@pytest.mark.parametrize("body", [b"[1 2]", b"[1,]", b"[1] x", b"[1", b'["\xff"]'])
+def test_broken_json_array_raises_after_the_valid_elements(body):
+    with pytest.raises(ValueError):
+        _elements(body, 1)
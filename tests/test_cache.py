@@ -0,0 +1,123 @@
+# 主キー単位の読み取りキャッシュ (db_control.cache) と crud の書き込み時の無効化
+import time
+import uuid
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from db_control import crud
+from db_control.cache import LocalTTLCache, cache_key
+from db_control.mymodels_MySQL import Customers
+
+CUSTOMER = uuid.UUID(int=21)
+
+
+def _row(version: int, name: str = "キャッシュ") -> dict:
+    return {"internal_id": str(CUSTOMER), "customer_name": name, "version": version}
+
+
+def test_set_after_delete_is_ignored_until_the_ttl_expires():
+    cache = LocalTTLCache(ttl_seconds=0.2)
+    cache.set("k", _row(1))
+    cache.delete("k")
+    cache.set("k", _row(1)) # 削除前に読んだ行
+    assert cache.get("k") is None
+    cache.set("k", _row(2))
+    assert cache.get("k") is None
+    time.sleep(0.25)
+    cache.set("k", _row(2))
+    assert cache.get("k") == _row(2)
+
+
+def test_delete_with_a_version_only_ignores_older_values():
+    cache = LocalTTLCache(ttl_seconds=60)
+    cache.set("k", _row(1))
+    cache.delete("k", 2)
+    assert cache.get("k") is None
+    cache.set("k", _row(1)) # 更新前に読んだ行
+    assert cache.get("k") is None
+    cache.set("k", _row(2)) # 更新後に読んだ行
+    assert cache.get("k") == _row(2)
+
+
+def test_older_version_does_not_overwrite_a_newer_one():
+    cache = LocalTTLCache(ttl_seconds=60)
+    cache.set("k", _row(3, "新"))
+    cache.set("k", _row(2, "旧"))
+    assert cache.get("k") == _row(3, "新")
+    cache.set("k", _row(3, "同じ version"))
+    assert cache.get("k") == _row(3, "同じ version")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LocalTTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", _row(1))
+    cache.set("b", _row(1))
+    cache.get("a") # a を最近使ったものにする
+    cache.set("c", _row(1))
+    assert cache.get("b") is None
+    assert cache.get("a") == _row(1) and cache.get("c") == _row(1)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["size"] == 2
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    with Session(db) as session:
+        session.execute(insert(Customers), [
+            {"internal_id": CUSTOMER, "customer_id": "K0001", "customer_name": "キャッシュ", "age": 20, "gender": "female"}])
+        session.commit()
+    cache = LocalTTLCache(ttl_seconds=60)
+    monkeypatch.setattr(crud, "customer_cache", cache)
+    yield cache
+    with Session(db) as session:
+        session.query(Customers).filter_by(internal_id=CUSTOMER).delete()
+        session.commit()
+
+
+@pytest.mark.parametrize("update_returning, expected_versions", [
+    (True, None),   # 更新後の version を RETURNING で読む
+    (True, [1]),
+    (False, [1]),   # RETURNING がない DB (MySQL) でも If-Match の version が 1 つなら +1 と分かる
+])
+def test_patch_without_returning_lets_the_next_read_repopulate(cache, monkeypatch, update_returning, expected_versions):
+    monkeypatch.setattr(crud.engine.dialect, "update_returning", update_returning)
+    key = cache_key(Customers, CUSTOMER)
+    stale = crud.myselect_dict_by_internal_id(Customers, CUSTOMER)
+    assert cache.get(key) == stale
+
+    assert crud.mypatch(Customers, CUSTOMER, {"age": 21}, expected_versions, returning=False) is True
+    assert cache.get(key) is None
+    cache.set(key, stale) # 更新前に読んだ行は入らない
+    assert cache.get(key) is None
+
+    current = crud.myselect_dict_by_internal_id(Customers, CUSTOMER)
+    assert (current["age"], current["version"]) == (21, stale["version"] + 1)
+    assert cache.get(key) == current # TTL を待たずに埋め直される
+
+
+def test_patch_without_returning_or_a_known_version_blocks_until_the_ttl(cache, monkeypatch):
+    monkeypatch.setattr(crud.engine.dialect, "update_returning", False)
+    key = cache_key(Customers, CUSTOMER)
+    crud.myselect_dict_by_internal_id(Customers, CUSTOMER)
+    assert crud.mypatch(Customers, CUSTOMER, {"age": 22}, returning=False) is True
+    assert crud.myselect_dict_by_internal_id(Customers, CUSTOMER)["age"] == 22
+    assert cache.get(key) is None
+
+
+def test_patch_with_returning_stores_the_new_row(cache):
+    key = cache_key(Customers, CUSTOMER)
+    stale = crud.myselect_dict_by_internal_id(Customers, CUSTOMER)
+    updated = crud.mypatch(Customers, CUSTOMER, {"customer_name": "更新後"})
+    assert cache.get(key) == updated and updated["customer_name"] == "更新後"
+    cache.set(key, stale)
+    assert cache.get(key) == updated
+
+
+def test_delete_blocks_the_deleted_row(cache):
+    key = cache_key(Customers, CUSTOMER)
+    stale = crud.myselect_dict_by_internal_id(Customers, CUSTOMER)
+    assert crud.mydelete_orm(Customers, CUSTOMER) is True
+    cache.set(key, stale) # 削除前に読んだ行
+    assert cache.get(key) is None
+    assert crud.myselect_dict_by_internal_id(Customers, CUSTOMER) is None
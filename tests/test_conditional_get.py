@@ -0,0 +1,80 @@
+# 条件付き GET (ETag / If-None-Match) の 304 と、書き込みでの ETag の更新
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from db_control import crud
+
+
+@pytest.fixture(scope="module")
+def client(db):
+    return TestClient(app.app)
+
+
+def _create(client, customer_id: str) -> dict:
+    response = client.post("/customers", json={"customer_id": customer_id, "customer_name": "条件付き", "age": 20, "gender": "female"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_all_customers_not_modified(client):
+    _create(client, "G0001")
+    response = client.get("/allcustomers")
+    etag = response.headers["ETag"]
+    assert etag.startswith('"customers-')
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}'):
+        response = client.get("/allcustomers", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+    assert client.get("/allcustomers", headers={"If-None-Match": '"customers-0"'}).status_code == 200
+
+
+def test_write_changes_the_all_customers_etag(client):
+    etag = client.get("/allcustomers").headers["ETag"]
+    created = _create(client, "G0002")
+    response = client.get("/allcustomers", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert created["internal_id"] in {customer["internal_id"] for customer in response.json()}
+
+    etag = response.headers["ETag"]
+    assert client.patch(f"/customers/{created['internal_id']}", json={"age": 21}).status_code == 200
+    assert client.get("/allcustomers", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_customer_not_modified_until_the_row_changes(client):
+    created = _create(client, "G0003")
+    url = f"/customers/{created['internal_id']}"
+    etag = client.get(url).headers["ETag"]
+    assert etag == '"1"'
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    assert client.patch(url, json={"customer_name": "変更後"}).status_code == 200
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+    assert response.json()["customer_name"] == "変更後"
+
+
+def test_failed_table_version_bump_does_not_fail_the_write(client, monkeypatch, capsys):
+    etag = client.get("/allcustomers").headers["ETag"]
+
+    def broken_bump(dialect_name, mymodel):
+        raise RuntimeError("table_versions is unavailable")
+    monkeypatch.setattr(crud, "_table_version_bump", broken_bump)
+
+    created = _create(client, "G0004") # 登録はコミット済みなので成功する
+    assert "Error in _bump_table_version" in capsys.readouterr().out
+    assert client.get(f"/customers/{created['internal_id']}").status_code == 200
+    # バージョンは進まない (次の書き込みで ETag が変わる)
+    assert client.get("/allcustomers").headers["ETag"] == etag
+
+    monkeypatch.undo()
+    _create(client, "G0005")
+    assert client.get("/allcustomers").headers["ETag"] != etag
@@ -0,0 +1,51 @@
+# 顧客の書き込みのエラーの判別 (一意制約違反は 409、明示的な null は 422)
+import uuid
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import CustomerPatch
+from db_control import crud
+from db_control.mymodels_MySQL import Customers
+
+FIRST = uuid.UUID(int=11)
+SECOND = uuid.UUID(int=12)
+
+
+@pytest.fixture(scope="module")
+def customers(db):
+    with Session(db) as session:
+        session.execute(insert(Customers), [
+            {"internal_id": FIRST, "customer_id": "W0001", "customer_name": "一人目", "age": 20, "gender": "female"},
+            {"internal_id": SECOND, "customer_id": "W0002", "customer_name": "二人目", "age": 30, "gender": "male"},
+        ])
+        session.commit()
+
+
+@pytest.mark.parametrize("field", ["customer_id", "customer_name"])
+def test_patch_rejects_explicit_null(field):
+    with pytest.raises(ValidationError):
+        CustomerPatch.model_validate({field: None})
+
+
+def test_patch_omitted_fields_are_unset():
+    patch = CustomerPatch.model_validate({"age": None})
+    assert patch.model_dump(exclude_unset=True) == {"age": None}
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_patch_duplicate_customer_id(customers, returning):
+    with pytest.raises(crud.DuplicateCustomerIdError):
+        crud.mypatch(Customers, FIRST, {"customer_id": "W0002"}, returning=returning)
+    assert crud.myselect_dict_by_internal_id(Customers, FIRST)["customer_id"] == "W0001"
+
+
+def test_patch_missing_customer(customers):
+    assert crud.mypatch(Customers, uuid.UUID(int=99), {"age": 1}) is None
+
+
+def test_insert_duplicate_customer_id(customers):
+    with pytest.raises(crud.DuplicateCustomerIdError):
+        crud.myinsert_orm(Customers, {"customer_id": "W0001", "customer_name": "重複", "age": 40, "gender": "male"})
@@ -0,0 +1,48 @@
+# DELETE /customers/{internal_id}: 購入履歴のある顧客は 404 ではなく 409
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import app
+from db_control import crud, crud_async
+from db_control.mymodels_MySQL import Customers, Items
+
+BUYER = uuid.UUID(int=1, version=4)
+NO_PURCHASES = uuid.UUID(int=2, version=4)
+UNKNOWN = uuid.UUID(int=3, version=4)
+
+
+@pytest.fixture(scope="module")
+def client(db):
+    with Session(db) as session:
+        session.execute(insert(Items), [{"item_id": "A01", "item_name": "りんご", "price": 120}])
+        session.execute(insert(Customers), [
+            {"internal_id": BUYER, "customer_id": "D0001", "customer_name": "購入者", "age": 30, "gender": "female"},
+            {"internal_id": NO_PURCHASES, "customer_id": "D0002", "customer_name": "未購入", "age": 40, "gender": "male"},
+        ])
+        session.commit()
+    crud.myinsert_purchase(BUYER, [{"item_id": "A01", "quantity": 1}])
+    return TestClient(app.app)
+
+
+def test_customer_with_purchases_is_a_conflict(client):
+    response = client.delete(f"/customers/{BUYER}")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Customer has purchases"
+    assert client.get(f"/customers/{BUYER}").status_code == 200 # ロールバックされて残っている
+
+
+def test_async_crud_raises_the_same_error(client):
+    with pytest.raises(crud.CustomerHasPurchasesError):
+        asyncio.run(crud_async.mydelete_orm(Customers, BUYER))
+    assert crud.myselect_dict_by_internal_id(Customers, BUYER) is not None
+
+
+def test_missing_customer_is_still_not_found(client):
+    assert client.delete(f"/customers/{UNKNOWN}").status_code == 404
+    assert client.delete(f"/customers/{NO_PURCHASES}").status_code == 204
+    assert client.delete(f"/customers/{NO_PURCHASES}").status_code == 404
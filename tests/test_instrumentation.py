@@ -0,0 +1,27 @@
+# SQL ごとの計測 (db_control.instrumentation.instrument_engine)
+import pytest
+from sqlalchemy import exc, text
+
+from db_control.instrumentation import db_statement_seconds, end_request_stats, start_request_stats
+
+
+def _observed() -> int:
+    return db_statement_seconds.snapshot().get((), ([], 0.0, 0))[2]
+
+
+def test_failed_statement_leaves_nothing_on_the_connection(db):
+    with db.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+            connection.rollback()
+        assert "query_start_time" not in connection.info
+
+        stats, token = start_request_stats()
+        try:
+            before = _observed()
+            assert connection.execute(text("SELECT 1")).scalar() == 1
+        finally:
+            end_request_stats(token)
+    assert _observed() == before + 1
+    assert stats.query_count == 1 and 0 <= stats.db_time < 5
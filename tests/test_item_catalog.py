@@ -0,0 +1,116 @@
+# 商品カタログのスナップショットの更新 (db_control.item_catalog.ItemCatalog.refresh)
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from db_control import crud
+from db_control.item_catalog import ItemCatalog
+from db_control.mymodels_MySQL import Items
+
+T0 = datetime(2024, 3, 1, 12, 0, 0)
+
+
+class FakeItems:
+    """load(since) の代わり。items の行を持ち、呼ばれた since を記録する"""
+
+    def __init__(self, rows):
+        self.rows = {row[0]: row for row in rows} # item_id -> (item_id, item_name, price, updated_at)
+        self.calls = []
+        self.count_offset = 0 # 差分の件数をずらして、削除を見落とした状態を作る
+
+    async def __call__(self, since):
+        self.calls.append(since)
+        rows = [row for row in self.rows.values() if since is None or row[3] >= since]
+        return len(self.rows) + (self.count_offset if since is not None else 0), rows
+
+
+def _refresh(catalog, load) -> str:
+    return asyncio.run(catalog.refresh(load))
+
+
+def test_incremental_refresh_reads_from_the_watermark_minus_the_overlap():
+    load = FakeItems([("A", "りんご", 100, T0), ("B", "みかん", 80, T0 - timedelta(hours=1))])
+    catalog = ItemCatalog(overlap_seconds=60)
+    assert _refresh(catalog, load) == "full"
+    assert load.calls == [None]
+    assert catalog.snapshot.watermark == T0
+    version = catalog.snapshot.version
+
+    # ウォーターマークより少し前に更新された行 (遅れてコミットされた行) も読み直しの範囲に入る
+    load.rows["B"] = ("B", "みかん", 90, T0 - timedelta(seconds=30))
+    assert _refresh(catalog, load) == "incremental"
+    assert load.calls[-1] == T0 - timedelta(seconds=60)
+    assert catalog.get("B").price == 90
+    assert catalog.snapshot.version == version + 1
+
+    # 変更がなければスナップショットの version は変わらない
+    assert _refresh(catalog, load) == "incremental"
+    assert catalog.snapshot.version == version + 1
+
+
+def test_count_mismatch_falls_back_to_a_full_refresh():
+    load = FakeItems([("A", "りんご", 100, T0), ("B", "みかん", 80, T0)])
+    catalog = ItemCatalog()
+    _refresh(catalog, load)
+
+    del load.rows["B"] # 削除は差分に現れないので、件数で気づいて全件を読み直す
+    assert _refresh(catalog, load) == "full"
+    assert load.calls[-2:] == [T0 - timedelta(seconds=60), None]
+    assert catalog.get("B") is None
+
+    load.count_offset = 1 # 差分の件数が合わない
+    assert _refresh(catalog, load) == "full"
+    assert load.calls[-1] is None
+
+
+def test_request_full_refresh():
+    load = FakeItems([("A", "りんご", 100, T0)])
+    catalog = ItemCatalog()
+    _refresh(catalog, load)
+    assert catalog.since() is not None
+    catalog.request_full_refresh()
+    assert catalog.since() is None
+    assert _refresh(catalog, load) == "full"
+    assert load.calls == [None, None]
+    assert catalog.since() is not None
+
+
+def test_full_refresh_interval():
+    load = FakeItems([("A", "りんご", 100, T0)])
+    catalog = ItemCatalog(full_refresh_seconds=0)
+    assert [_refresh(catalog, load) for _ in range(2)] == ["full", "full"]
+
+
+@pytest.fixture
+def items(db):
+    with Session(db) as session:
+        session.execute(insert(Items), [
+            {"item_id": "P01", "item_name": "りんご", "price": 120, "updated_at": T0},
+            {"item_id": "P02", "item_name": "みかん", "price": 80, "updated_at": T0},
+        ])
+        session.commit()
+    yield
+    with db.begin() as connection:
+        connection.execute(text("DELETE FROM items WHERE item_id IN ('P01', 'P02')"))
+
+
+async def _load(since):
+    return crud.myselect_item_changes(since)
+
+
+def test_price_update_appears_in_the_next_snapshot(db, items):
+    catalog = ItemCatalog()
+    assert _refresh(catalog, _load) == "full"
+    assert catalog.get("P01").price == 120
+    assert catalog.snapshot.watermark == T0
+
+    # ORM を通さない UPDATE でも updated_at が更新され (SQLite はトリガー)、次の差分に入る
+    with db.begin() as connection:
+        connection.execute(text("UPDATE items SET price = 150 WHERE item_id = 'P01'"))
+    assert _refresh(catalog, _load) == "incremental"
+    assert catalog.get("P01").price == 150
+    assert catalog.get("P02").price == 80
+    assert catalog.snapshot.watermark > T0 # UPDATE した行の updated_at (現在時刻) まで進む
@@ -0,0 +1,35 @@
+# gunicorn の起動時の接続数の検査 (db_control.pool_settings.check_connection_budget)
+import pytest
+
+from db_control import pool_settings
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setattr(pool_settings, "DB_POOL_SIZE", 5)
+    monkeypatch.setattr(pool_settings, "DB_MAX_OVERFLOW", 10)
+    monkeypatch.setattr(pool_settings, "DB_MAX_CONNECTIONS", 100)
+    monkeypatch.setattr(pool_settings, "DB_RESERVED_CONNECTIONS", 10)
+
+    def set_mode(mode: str):
+        monkeypatch.setattr(pool_settings, "DB_MODE", mode)
+    return set_mode
+
+
+@pytest.mark.parametrize("mode, per_worker", [("sync", 15), ("async", 30)])
+def test_async_workers_count_both_pools(settings, mode, per_worker):
+    settings(mode)
+    assert pool_settings.connections_per_worker() == per_worker
+
+
+@pytest.mark.parametrize("mode, workers, ok", [
+    ("sync", 6, True),    # 6 x 15 = 90 (上限 100 - 予約 10 = 90 まで)
+    ("sync", 7, False),
+    ("async", 3, True),   # 3 x 2 x 15 = 90
+    ("async", 4, False),  # 同期版のプールを数えなければ 60 で収まってしまう
+])
+def test_connection_budget(settings, mode, workers, ok):
+    settings(mode)
+    result, detail = pool_settings.check_connection_budget(workers)
+    assert result is ok
+    assert f"= {workers * pool_settings.connections_per_worker()} connections" in detail
@@ -0,0 +1,149 @@
+# GET /customers/{internal_id}/purchases (crud.myselect_purchase_history)
+import uuid
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+from db_control import crud
+from db_control.mymodels_MySQL import Customers, Items
+
+BUYER = uuid.UUID(int=1)
+NO_PURCHASES = uuid.UUID(int=2)
+UNKNOWN = uuid.UUID(int=3)
+ITEMS = {"A01": ("りんご", 120), "B02": ("みかん", 80), "C03": ("ぶどう", 450)}
+
+# 同じ日時の購入を複数含める (並び順は purchase_date, purchase_id の降順)
+PURCHASES = [
+    (datetime(2024, 1, 10, 9, 0), [{"item_id": "B02", "quantity": 2}, {"item_id": "A01", "quantity": 1}]),
+    (datetime(2024, 1, 10, 9, 0), [{"item_id": "C03", "quantity": 1}]),
+    (datetime(2024, 1, 10, 9, 0), [{"item_id": "A01", "quantity": 3}]),
+    (datetime(2024, 1, 11, 18, 30), [{"item_id": "A01", "quantity": 1}, {"item_id": "A01", "quantity": 1}]),
+    (datetime(2024, 1, 11, 18, 30), [{"item_id": "B02", "quantity": 5}, {"item_id": "C03", "quantity": 2}]),
+    (datetime(2024, 1, 12, 23, 59), [{"item_id": "C03", "quantity": 1}]),
+    (datetime(2024, 1, 9, 0, 0), [{"item_id": "B02", "quantity": 1}]),
+]
+
+
+@pytest.fixture(scope="module")
+def purchases(db):
+    with Session(db) as session:
+        session.execute(insert(Items), [
+            {"item_id": item_id, "item_name": name, "price": price} for item_id, (name, price) in ITEMS.items()])
+        session.execute(insert(Customers), [
+            {"internal_id": BUYER, "customer_id": "P0001", "customer_name": "購入者", "age": 30, "gender": "female"},
+            {"internal_id": NO_PURCHASES, "customer_id": "P0002", "customer_name": "未購入", "age": 40, "gender": "male"},
+        ])
+        session.commit()
+    created = [crud.myinsert_purchase(BUYER, lines, purchase_date) for purchase_date, lines in PURCHASES]
+    # 新しい順 (purchase_date, purchase_id の降順)
+    return sorted(created, key=lambda purchase: (purchase["purchase_date"], purchase["purchase_id"]), reverse=True)
+
+
+@pytest.fixture
+def statements(db):
+    executed = []
+    listener = lambda conn, cursor, statement, parameters, context, executemany: executed.append(statement)
+    event.listen(db, "before_cursor_execute", listener)
+    yield executed
+    event.remove(db, "before_cursor_execute", listener)
+
+
+def _all_pages(limit: int, **kwargs) -> list[list[dict]]:
+    pages = []
+    after = None
+    while True:
+        page, after = crud.myselect_purchase_history(BUYER, limit=limit, after=after, **kwargs)
+        pages.append(page)
+        if after is None:
+            return pages
+        assert len(pages) <= len(PURCHASES) + 1, "cursor does not advance"
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 20])
+def test_pages_across_equal_purchase_dates(purchases, limit):
+    pages = _all_pages(limit)
+    ids = [purchase["purchase_id"] for page in pages for purchase in page]
+    assert ids == [purchase["purchase_id"] for purchase in purchases] # 重複・抜けなし、新しい順
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_equal_dates_are_ordered_by_purchase_id(purchases):
+    page, _ = crud.myselect_purchase_history(BUYER, start=date(2024, 1, 10), end=date(2024, 1, 10), limit=20)
+    assert {purchase["purchase_date"] for purchase in page} == {datetime(2024, 1, 10, 9, 0)}
+    ids = [purchase["purchase_id"] for purchase in page]
+    assert ids == sorted(ids, reverse=True) and len(ids) == 3
+
+
+def test_next_cursor(purchases):
+    page, after = crud.myselect_purchase_history(BUYER, limit=2)
+    assert after == [page[-1]["purchase_date"].isoformat(), page[-1]["purchase_id"]]
+    _, after = crud.myselect_purchase_history(BUYER, limit=len(PURCHASES) + 1)
+    assert after is None
+
+
+def test_lines_and_totals(purchases):
+    page, _ = crud.myselect_purchase_history(BUYER, limit=20)
+    by_id = {purchase["purchase_id"]: purchase for purchase in page}
+    for created in purchases:
+        purchase = by_id[created["purchase_id"]]
+        assert purchase["customer_internal_id"] == str(BUYER)
+        assert purchase["purchase_date"] == created["purchase_date"]
+        # 同じ商品の行は数量を合算した 1 行になり、明細は item_id 順
+        assert [line["item_id"] for line in purchase["items"]] == sorted(line["item_id"] for line in created["items"])
+        for line in purchase["items"]:
+            name, price = ITEMS[line["item_id"]]
+            assert line["item_name"] == name
+            assert line["price"] == price
+            assert line["subtotal"] == price * line["quantity"]
+        assert purchase["total"] == sum(line["subtotal"] for line in purchase["items"]) == created["total"]
+
+    # PURCHASES[3] (A01 を 2 行に分けて登録) は同じ日時の購入のうち先に登録した方
+    merged = min((purchase for purchase in page if purchase["purchase_date"] == datetime(2024, 1, 11, 18, 30)),
+                 key=lambda purchase: purchase["purchase_id"])
+    assert merged["items"] == [{"item_id": "A01", "item_name": "りんご", "price": 120, "quantity": 2, "subtotal": 240}]
+
+
+def test_date_range_includes_the_end_day(purchases):
+    page, _ = crud.myselect_purchase_history(BUYER, start=date(2024, 1, 11), end=date(2024, 1, 12), limit=20)
+    assert [purchase["purchase_date"] for purchase in page] == [
+        datetime(2024, 1, 12, 23, 59), datetime(2024, 1, 11, 18, 30), datetime(2024, 1, 11, 18, 30)]
+
+
+def test_unknown_customer_is_not_found(purchases):
+    with pytest.raises(crud.CustomerNotFoundError):
+        crud.myselect_purchase_history(UNKNOWN)
+
+
+def test_customer_without_purchases_is_an_empty_list(purchases):
+    assert crud.myselect_purchase_history(NO_PURCHASES) == ([], None)
+    # 条件に合う購入がないだけなら 404 ではなく空
+    assert crud.myselect_purchase_history(BUYER, start=date(2030, 1, 1)) == ([], None)
+
+
+def test_each_page_costs_two_queries(purchases, statements):
+    for limit in (1, 5):
+        statements.clear()
+        page, _ = crud.myselect_purchase_history(BUYER, limit=limit)
+        assert len(page) == limit
+        assert len(statements) == 2 # 購入の SELECT + 明細と商品の IN 検索 (ページの件数によらない)
+
+
+def test_totals_keep_the_purchase_time_price(db, purchases):
+    before, _ = crud.myselect_purchase_history(BUYER, limit=20)
+    with db.begin() as connection:
+        connection.execute(update(Items).values(price=Items.price * 10))
+    try:
+        after, _ = crud.myselect_purchase_history(BUYER, limit=20)
+    finally:
+        with db.begin() as connection:
+            connection.execute(update(Items).values(price=Items.price / 10))
+    assert after == before
+    assert [purchase["total"] for purchase in after] == [purchase["total"] for purchase in purchases]
+
+
+@pytest.mark.parametrize("after", [["2024-01-10T09:00:00"], ["2024-01-10T09:00:00", "1"], ["not a date", 1]])
+def test_invalid_cursor(purchases, after):
+    with pytest.raises(ValueError):
+        crud.myselect_purchase_history(BUYER, after=after)
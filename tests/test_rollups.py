@@ -0,0 +1,91 @@
+# 売上集計テーブル (rollups): 購入登録での加算と rebuild_rollups での作り直し
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from db_control import crud, rollups
+from db_control.item_catalog import CatalogItem
+from db_control.mymodels_MySQL import Customers, CustomerSales, DailyItemSales, DailySales, Items, PurchaseDetails
+
+BUYERS = [uuid.UUID(int=11), uuid.UUID(int=12)]
+ITEMS = {"A01": ("りんご", 120), "B02": ("みかん", 80)}
+PURCHASES = [
+    (BUYERS[0], datetime(2024, 2, 1, 10, 0), [{"item_id": "A01", "quantity": 2}, {"item_id": "B02", "quantity": 1}]),
+    (BUYERS[0], datetime(2024, 2, 1, 15, 0), [{"item_id": "B02", "quantity": 3}]),
+    (BUYERS[1], datetime(2024, 2, 2, 9, 30), [{"item_id": "A01", "quantity": 1}]),
+]
+
+
+@pytest.fixture(scope="module")
+def purchases(db):
+    with Session(db) as session:
+        session.execute(insert(Items), [
+            {"item_id": item_id, "item_name": name, "price": price} for item_id, (name, price) in ITEMS.items()])
+        session.execute(insert(Customers), [
+            {"internal_id": internal_id, "customer_id": f"R{i:04d}", "customer_name": "集計", "age": 30, "gender": "female"}
+            for i, internal_id in enumerate(BUYERS)
+        ])
+        session.commit()
+    return [crud.myinsert_purchase(buyer, lines, purchase_date) for buyer, purchase_date, lines in PURCHASES]
+
+
+def _rollups(db) -> dict:
+    with Session(db) as session:
+        return {
+            "daily": session.execute(select(
+                DailySales.sales_date, DailySales.purchase_count, DailySales.quantity, DailySales.revenue,
+            ).order_by(DailySales.sales_date)).all(),
+            "items": session.execute(select(
+                DailyItemSales.sales_date, DailyItemSales.item_id, DailyItemSales.quantity, DailyItemSales.revenue,
+            ).order_by(DailyItemSales.sales_date, DailyItemSales.item_id)).all(),
+            "customers": session.execute(select(
+                CustomerSales.customer_internal_id, CustomerSales.purchase_count, CustomerSales.total_revenue,
+                CustomerSales.first_purchase_date, CustomerSales.last_purchase_date,
+            ).order_by(CustomerSales.customer_internal_id)).all(),
+        }
+
+
+def test_details_store_the_charged_unit_price(db, purchases):
+    with Session(db) as session:
+        stored = {
+            (row.purchase_id, row.item_id): row.unit_price
+            for row in session.execute(select(PurchaseDetails.purchase_id, PurchaseDetails.item_id, PurchaseDetails.unit_price))
+        }
+    assert stored == {
+        (purchase["purchase_id"], line["item_id"]): line["price"] for purchase in purchases for line in purchase["items"]
+    }
+
+
+def test_rebuild_ignores_later_price_changes(db, purchases):
+    incremental = _rollups(db)
+    assert [row.revenue for row in incremental["daily"]] == [2 * 120 + 80 + 3 * 80, 120]
+
+    with db.begin() as connection:
+        connection.execute(update(Items).values(price=1000))
+    rollups.rebuild_rollups(db)
+    assert _rollups(db) == incremental
+
+
+def test_stale_catalog_price_is_used_everywhere(db, purchases):
+    # カタログの価格 (更新前の値) と DB の現在の価格が違うときは、カタログの価格で登録した金額にそろう
+    catalog_items = {"A01": CatalogItem("A01", "りんご", 150)}
+    purchase_date = datetime(2024, 2, 3, 12, 0)
+    created = crud.myinsert_purchase(BUYERS[1], [{"item_id": "A01", "quantity": 2}], purchase_date, catalog_items)
+    assert created["total"] == 300
+    with Session(db) as session:
+        assert session.scalar(select(PurchaseDetails.unit_price).where(
+            PurchaseDetails.purchase_id == created["purchase_id"])) == 150
+        assert session.get(Items, "A01").price != 150
+
+    def revenue():
+        with Session(db) as session:
+            return session.scalar(select(DailySales.revenue).where(DailySales.sales_date == purchase_date.date()))
+
+    assert revenue() == created["total"]
+    rollups.rebuild_rollups(db)
+    assert revenue() == created["total"]
+    page, _ = crud.myselect_purchase_history(BUYERS[1], start=purchase_date.date(), end=purchase_date.date())
+    assert (page[0]["purchase_id"], page[0]["total"]) == (created["purchase_id"], created["total"])
@@ -0,0 +1,131 @@
+# GET /customers/search のキーセットページネーション (crud._customer_search_query / _search_next_after)
+import random
+import uuid
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from db_control import crud
+from db_control.mymodels_MySQL import Customers
+
+COLUMNS = ("customer_id", "customer_name", "age", "gender", "internal_id")
+NAMES = ("佐藤", "佐藤一郎", "佐藤花子", "鈴木", "鈴木次郎", "高橋")
+GENDERS = ("male", "female", None)
+ROWS = 60
+
+
+@pytest.fixture(scope="module")
+def customers(db):
+    # 名前・年齢・性別は少ない値の繰り返しにして、並び順の先頭のカラムが同じ行 (タイ) を多く作る
+    rng = random.Random(13)
+    rows = [
+        {
+            "internal_id": uuid.UUID(int=rng.getrandbits(128)),
+            "customer_id": f"T{i:05d}",
+            "customer_name": NAMES[i % len(NAMES)],
+            "age": None if i % 11 == 0 else 20 + i % 4,
+            "gender": GENDERS[i % len(GENDERS)],
+        }
+        for i in range(ROWS)
+    ]
+    with Session(db) as session:
+        session.execute(insert(Customers), rows)
+        session.commit()
+    return rows
+
+
+def _matches(row: dict, filters: dict) -> bool:
+    if filters.get("customer_name") and not row["customer_name"].startswith(filters["customer_name"]):
+        return False
+    if filters.get("q") and filters["q"] not in row["customer_name"]:
+        return False
+    if filters.get("age_min") is not None and (row["age"] is None or row["age"] < filters["age_min"]):
+        return False
+    if filters.get("age_max") is not None and (row["age"] is None or row["age"] > filters["age_max"]):
+        return False
+    if filters.get("gender") and row["gender"] != filters["gender"]:
+        return False
+    return True
+
+
+def _expected(customers, filters: dict) -> list[tuple]:
+    # 検索条件ごとの並び順 (_search_sort_columns) で Python 側で並べた全件
+    sort_names = crud._search_sort_columns(filters)
+    rows = sorted((row for row in customers if _matches(row, filters)), key=lambda row: [row[name] for name in sort_names])
+    return [tuple(row[column] for column in COLUMNS) for row in rows]
+
+
+def _all_pages(filters: dict, limit: int) -> list[list[tuple]]:
+    pages = []
+    after = None
+    while True:
+        rows, after = crud.mysearch_customers(Customers, COLUMNS, filters, limit, after)
+        pages.append(rows)
+        if after is None:
+            return pages
+        assert len(pages) <= ROWS + 1, "cursor does not advance"
+
+
+FILTERS = [
+    {},
+    {"customer_name": "佐藤"},
+    {"customer_name": "鈴木", "gender": "male"},
+    {"age_min": 21},
+    {"age_min": 20, "age_max": 22, "gender": "female"},
+    {"q": "藤"},
+    {"gender": "female"},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS, ids=lambda filters: ",".join(filters) or "none")
+@pytest.mark.parametrize("limit", [1, 7, 10])
+def test_pages_return_every_row_once_in_order(customers, filters, limit):
+    expected = _expected(customers, filters)
+    assert expected, "filters should match some rows"
+    pages = _all_pages(filters, limit)
+
+    assert [row for page in pages for row in page] == expected # 重複・抜けなし、条件ごとの並び順
+    assert all(len(page) == limit for page in pages[:-1])
+    assert len(pages[-1]) < limit or pages[-1] == [] # 最後のページだけが 1 ページに満たない
+
+
+def test_ties_on_the_leading_sort_column_are_split_across_pages(customers):
+    # 年齢 21 の行が複数ページにまたがるように limit を小さくする (internal_id で順序が決まる)
+    filters = {"age_min": 21, "age_max": 21}
+    expected = _expected(customers, filters)
+    assert len(expected) > 3
+    pages = _all_pages(filters, 2)
+    assert [row for page in pages for row in page] == expected
+    assert len({row[COLUMNS.index("age")] for row in expected}) == 1
+
+
+def test_next_cursor_is_the_last_rows_sort_key(customers):
+    filters = {"customer_name": "佐藤"}
+    rows, after = crud.mysearch_customers(Customers, COLUMNS, filters, 3)
+    assert after == [rows[-1][COLUMNS.index("customer_name")], rows[-1][COLUMNS.index("internal_id")]]
+
+
+def test_exact_multiple_of_limit_ends_with_an_empty_page(customers):
+    filters = {"gender": "female"}
+    total = len(_expected(customers, filters))
+    pages = _all_pages(filters, total)
+    assert [len(page) for page in pages] == [total, 0]
+
+    rows, after = crud.mysearch_customers(Customers, COLUMNS, filters, total + 1)
+    assert len(rows) == total
+    assert after is None
+
+
+def test_no_matches(customers):
+    assert crud.mysearch_customers(Customers, COLUMNS, {"customer_name": "渡辺"}, 10) == ([], None)
+
+
+@pytest.mark.parametrize("filters, after", [
+    ({"customer_name": "佐藤"}, [str(uuid.UUID(int=1))]),    # 並び順のカラム数と合わない
+    ({"age_min": 20}, ["20", str(uuid.UUID(int=1))]),         # age は整数
+    ({}, ["not-a-uuid"]),
+])
+def test_cursor_that_does_not_match_the_filters_is_rejected(filters, after):
+    with pytest.raises(ValueError):
+        crud._customer_search_query(Customers, COLUMNS, "sqlite", filters, after, 10)
@@ -0,0 +1,73 @@
+# 外部 API の共有クライアント (upstream.UpstreamClient) と /fetchtest のエラーの変換
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from upstream import UpstreamClient, UpstreamError
+
+URL = "https://upstream.test/users"
+USERS = [{"id": 1, "name": "Leanne"}, {"id": 2, "name": "Ervin"}]
+
+
+def test_concurrent_gets_share_one_upstream_call():
+    calls = []
+
+    async def handler(request):
+        calls.append(str(request.url))
+        await asyncio.sleep(0.05) # 取得中に他のリクエストが届く
+        return httpx.Response(200, json=USERS)
+
+    async def main():
+        client = UpstreamClient(transport=httpx.MockTransport(handler))
+        try:
+            results = await asyncio.gather(*(client.get_json(URL) for _ in range(10)))
+            results.append(await client.get_json(URL)) # 取得後はキャッシュから返す
+            return results, client.stats()
+        finally:
+            await client.close()
+
+    results, stats = asyncio.run(main())
+    assert calls == [URL]
+    assert all(result == USERS for result in results)
+    assert stats["inflight"] == 0 and stats["cache"]["hits"] == 1
+
+
+def test_failed_fetch_is_not_cached():
+    responses = iter([httpx.Response(500), httpx.Response(200, json=USERS)])
+
+    async def main():
+        client = UpstreamClient(transport=httpx.MockTransport(lambda request: next(responses)))
+        try:
+            with pytest.raises(UpstreamError) as error:
+                await client.get_json(URL)
+            assert not error.value.timeout
+            return await client.get_json(URL)
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == USERS
+
+
+def _raise_timeout(request):
+    raise httpx.ReadTimeout("timed out", request=request)
+
+def _raise_connect_error(request):
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+@pytest.mark.parametrize("handler, status_code", [
+    (_raise_timeout, 504),
+    (_raise_connect_error, 502),
+    (lambda request: httpx.Response(503), 502),
+    (lambda request: httpx.Response(200, content=b"not json"), 502),
+    (lambda request: httpx.Response(200, json=USERS), 200),
+])
+def test_fetchtest_maps_upstream_errors(monkeypatch, handler, status_code):
+    monkeypatch.setattr(app, "upstream_client", UpstreamClient(transport=httpx.MockTransport(handler)))
+    response = TestClient(app.app).get("/fetchtest")
+    assert response.status_code == status_code
+    if status_code == 200:
+        assert response.json() == USERS
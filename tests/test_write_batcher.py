@@ -0,0 +1,138 @@
+# POST /customers の書き込みのまとめ込み (write_batcher.WriteBatcher)
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import app
+from write_batcher import WriteBatcher, WriteBatcherFull
+
+
+class RecordingFlush:
+    """受け取ったバッチを記録し、各行の値をそのまま結果として返す flush"""
+
+    def __init__(self, release: asyncio.Event | None = None):
+        self.batches = []
+        self.release = release
+
+    async def __call__(self, values_list):
+        self.batches.append(list(values_list))
+        if self.release is not None:
+            await self.release.wait()
+        return [{"status": "created", "value": values} for values in values_list]
+
+
+def test_flush_when_max_rows_is_reached():
+    async def main():
+        flush = RecordingFlush()
+        batcher = WriteBatcher("test-rows", flush, max_rows=3, max_wait_ms=10_000)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+        elapsed = time.perf_counter() - started
+        await batcher.close()
+        return flush, results, elapsed
+
+    flush, results, elapsed = asyncio.run(main())
+    assert flush.batches == [[0, 1, 2], [3, 4, 5]]
+    assert [result["value"] for result in results] == list(range(6))
+    assert elapsed < 5 # max_wait_ms (10 秒) を待たずにフラッシュする
+
+
+def test_flush_when_max_wait_expires():
+    async def main():
+        flush = RecordingFlush()
+        batcher = WriteBatcher("test-wait", flush, max_rows=100, max_wait_ms=50)
+        started = time.perf_counter()
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+        elapsed = time.perf_counter() - started
+        await batcher.close()
+        return flush, results, elapsed
+
+    flush, results, elapsed = asyncio.run(main())
+    assert flush.batches == [["a", "b"]]
+    assert [result["value"] for result in results] == ["a", "b"]
+    assert 0.04 <= elapsed < 5
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        release = asyncio.Event()
+        batcher = WriteBatcher("test-full", RecordingFlush(release), max_rows=1, max_wait_ms=0, max_queue=2)
+        pending = [asyncio.create_task(batcher.submit(0))]
+        await asyncio.sleep(0.01) # 0 はフラッシュ中
+        pending += [asyncio.create_task(batcher.submit(i)) for i in (1, 2)]
+        await asyncio.sleep(0.01) # 1, 2 がキューで待つ
+        assert batcher.queue_depth() == 2
+        with pytest.raises(WriteBatcherFull):
+            await asyncio.wait_for(batcher.submit(3), 5) # 受け付けてしまうとフラッシュを待ち続けるので時間を区切る
+        release.set()
+        results = await asyncio.gather(*pending)
+        await batcher.close()
+        return results
+
+    assert [result["value"] for result in asyncio.run(main())] == [0, 1, 2]
+
+
+def test_full_queue_returns_503(monkeypatch):
+    async def main():
+        release = asyncio.Event()
+        batcher = WriteBatcher("test-503", RecordingFlush(release), max_rows=1, max_wait_ms=0, max_queue=1)
+        monkeypatch.setattr(app, "customer_batcher", batcher)
+        pending = []
+        for i in range(2): # 1 行目はフラッシュ中、2 行目がキューで待つ
+            pending.append(asyncio.create_task(batcher.submit({"customer_id": f"Q{i}"})))
+            await asyncio.sleep(0.01)
+        assert batcher.queue_depth() == 1
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            response = await asyncio.wait_for(client.post(
+                "/customers", json={"customer_id": "Q9", "customer_name": "満杯", "age": 20, "gender": "female"}), 5)
+        release.set()
+        await asyncio.gather(*pending)
+        await batcher.close()
+        return response
+
+    response = asyncio.run(main())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_duplicate_customer_id_in_one_batch_fails_only_that_row(db):
+    rows = [
+        {"customer_id": "B0001", "customer_name": "一人目", "age": 20, "gender": "female"},
+        {"customer_id": "B0002", "customer_name": "二人目", "age": 30, "gender": "male"},
+        {"customer_id": "B0001", "customer_name": "重複", "age": 40, "gender": "male"},
+    ]
+
+    async def main():
+        flush = RecordingFlush()
+
+        async def flush_customers(values_list):
+            await flush(values_list)
+            return await app._flush_customers(values_list)
+
+        batcher = WriteBatcher("test-duplicate", flush_customers, max_rows=10, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.submit(row) for row in rows))
+        await batcher.close()
+        return flush, results
+
+    flush, results = asyncio.run(main())
+    assert len(flush.batches) == 1 # 3 行が同じバッチ
+    assert [result["status"] for result in results] == ["created", "created", "error"]
+    assert results[2]["customer_id"] == "B0001"
+
+
+def test_close_drains_pending_rows():
+    async def main():
+        flush = RecordingFlush()
+        batcher = WriteBatcher("test-close", flush, max_rows=2, max_wait_ms=50)
+        pending = [asyncio.create_task(batcher.submit(i)) for i in range(5)]
+        await asyncio.sleep(0) # 全員がキューに入る
+        await batcher.close()
+        assert all(task.done() for task in pending)
+        return flush, [task.result()["value"] for task in pending], batcher.stats()
+
+    flush, values, stats = asyncio.run(main())
+    assert values == list(range(5))
+    assert [row for batch in flush.batches for row in batch] == list(range(5))
+    assert stats["rows"] == 5 and stats["queue_depth"] == 0
@@ -0,0 +1,138 @@
+# 外部 API (upstream) を呼ぶための共有クライアント
+# /fetchtest のように外部 API の結果をそのまま返すエンドポイントから使う
+#
+# - httpx.AsyncClient を 1 つ共有し、keep-alive で接続を再利用する (リクエストごとに TCP/TLS をつなぎ直さない)
+# - タイムアウトと同時リクエスト数の上限を設け、遅い upstream でワーカーが詰まらないようにする
+# - 成功したレスポンスは TTL 付きでキャッシュする (db_control.cache.LocalTTLCache を再利用)
+# - 同じ URL への同時リクエストは 1 回の upstream 呼び出しにまとめる (single-flight)
+#
+# 設定 (環境変数)
+#   UPSTREAM_TIMEOUT          = 読み取り・書き込みのタイムアウト秒 (既定 5)
+#   UPSTREAM_CONNECT_TIMEOUT  = 接続のタイムアウト秒 (既定 2)
+#   UPSTREAM_MAX_CONNECTIONS  = 接続プールの最大接続数 (既定 20)
+#   UPSTREAM_MAX_CONCURRENCY  = upstream への同時リクエスト数の上限 (既定 20)
+#   UPSTREAM_CACHE_TTL        = キャッシュの有効秒数 (既定 60、0 で無効)
+#   UPSTREAM_CACHE_MAX_SIZE   = キャッシュの最大件数 (既定 1000)
+import asyncio
+import os
+import time
+
+import httpx
+
+from db_control.cache import LocalTTLCache, NullCache
+from db_control.instrumentation import Counter, Histogram, register, LATENCY_BUCKETS
+
+upstream_requests_total = register(Counter(
+    "upstream_requests_total", "Upstream fetches by outcome (hit, coalesced, fetched, error)", ("outcome",)))
+upstream_request_seconds = register(Histogram(
+    "upstream_request_duration_seconds", "Latency of actual upstream HTTP calls", LATENCY_BUCKETS))
+
+
+class UpstreamError(Exception):
+    """upstream の呼び出しに失敗した (app.py で 502 / 504 に変換する)"""
+
+    def __init__(self, message: str, timeout: bool = False):
+        super().__init__(message)
+        self.timeout = timeout
+
+
+class UpstreamClient:
+    def __init__(
+        self,
+        timeout: float = 5.0,
+        connect_timeout: float = 2.0,
+        max_connections: int = 20,
+        max_concurrency: int = 20,
+        cache_ttl: float = 60.0,
+        cache_max_size: int = 1000,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self.transport = transport # 既定 (None) は httpx の通常の接続。テストでは httpx.MockTransport を渡す
+        self.cache = LocalTTLCache(max_size=cache_max_size, ttl_seconds=cache_ttl) if cache_ttl > 0 else NullCache()
+        self._client = None
+        self._semaphore = None
+        self._inflight = {} # キャッシュキー -> 実行中の upstream 呼び出しのタスク
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # イベントループ上で初めて使われたときに作る (インポート時にはループがないため)
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, transport=self.transport)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    async def get_json(self, url: str, params: dict | None = None):
+        """
+        GET して JSON を返す。キャッシュにあればそれを返し、
+        同じ URL を取得中なら新たに呼ばずにその結果を待つ
+        """
+        key = str(httpx.URL(url, params=params))
+        cached = self.cache.get(key)
+        if cached is not None:
+            upstream_requests_total.inc("hit")
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            # 最初の 1 件だけが upstream を呼ぶ。呼び出し元がキャンセルされても取得は続け、待っている他のリクエストに結果を渡す
+            task = asyncio.get_running_loop().create_task(self._fetch_and_cache(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            upstream_requests_total.inc("coalesced")
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception() # 待っている側が全員キャンセルされても "exception was never retrieved" を出さない
+
+    async def _fetch_and_cache(self, url: str):
+        value = await self._fetch(url)
+        self.cache.set(url, value)
+        return value
+
+    async def _fetch(self, url: str):
+        client = self._get_client()
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+                value = response.json()
+            except httpx.TimeoutException as e:
+                upstream_requests_total.inc("error")
+                raise UpstreamError(f"Upstream timed out: {url}", timeout=True) from e
+            except (httpx.HTTPError, ValueError) as e:
+                upstream_requests_total.inc("error")
+                raise UpstreamError(f"Upstream request failed: {url}: {e}") from e
+            finally:
+                upstream_request_seconds.observe(time.perf_counter() - started)
+        upstream_requests_total.inc("fetched")
+        return value
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "cache": self.cache.stats()}
+
+
+def create_upstream_client_from_env() -> UpstreamClient:
+    return UpstreamClient(
+        timeout=float(os.getenv('UPSTREAM_TIMEOUT', '5')),
+        connect_timeout=float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '2')),
+        max_connections=int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '20')),
+        max_concurrency=int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '20')),
+        cache_ttl=float(os.getenv('UPSTREAM_CACHE_TTL', '60')),
+        cache_max_size=int(os.getenv('UPSTREAM_CACHE_MAX_SIZE', '1000')),
+    )
+
+
+# プロセス全体で共有するクライアント (app.py の lifespan で close する)
+upstream_client = create_upstream_client_from_env()
@@ -0,0 +1,155 @@
+# 書き込みのまとめ込み (グループコミット)
+# POST /customers の登録を 1 件ずつのトランザクション (1 件ごとのコミット・fsync) ではなく、
+# 同時に来た登録を 1 回の multi-row INSERT・1 回のコミットにまとめる (app.py で CUSTOMER_WRITE_BATCHING=true のときだけ使う)
+#
+# - リクエストは submit で行をキューに入れ、自分の行の結果 (登録できたか・一意制約違反か) が出るまで待つ
+# - フラッシュ役のタスクは 1 つだけ。キューから最初の行を取り出したら、max_rows 行になるか max_wait_ms 経つまで
+#   後続の行を集めて flush (crud.mybulkinsert_orm) に渡す。フラッシュ中に届いた行は次のバッチにたまるので、
+#   負荷が高いほど 1 回のコミットでまとめて登録する行数が増える
+# - キューが max_queue 行で埋まっていれば WriteBatcherFull を送出する (app.py で 503 + Retry-After にする)
+# - 呼び出し元がキャンセルされても (クライアントの切断など) すでにキューに入った行は登録される
+# ワーカーごとに独立したキューなので、まとめられるのは同じワーカーに届いたリクエストだけ。
+#
+# 設定 (環境変数)
+#   CUSTOMER_WRITE_BATCHING      = true でまとめ込みを有効にする (既定 false = 従来どおり 1 件ずつ登録)
+#   CUSTOMER_BATCH_MAX_ROWS      = 1 回の INSERT にまとめる最大行数 (既定 100)
+#   CUSTOMER_BATCH_MAX_WAIT_MS   = 最初の行が後続の行を待つ最大ミリ秒 (既定 5。単独のリクエストのレイテンシはこれだけ増える)
+#   CUSTOMER_BATCH_MAX_QUEUE     = フラッシュ待ちの最大行数 (既定 1000)
+import asyncio
+import os
+import time
+
+from db_control.instrumentation import Counter, GaugeCallback, Histogram, register, STATEMENT_BUCKETS, LATENCY_BUCKETS
+
+BATCH_ROW_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+write_batch_rows = register(Histogram(
+    "write_batch_rows", "Rows flushed per batch", BATCH_ROW_BUCKETS, ("batcher",)))
+write_batch_wait_seconds = register(Histogram(
+    "write_batch_queue_wait_seconds", "Time a row waited in the queue before its batch was flushed",
+    STATEMENT_BUCKETS, ("batcher",)))
+write_batch_flush_seconds = register(Histogram(
+    "write_batch_flush_duration_seconds", "Duration of a batch flush (one transaction)", LATENCY_BUCKETS, ("batcher",)))
+write_batch_rejected_total = register(Counter(
+    "write_batch_rejected_total", "Rows rejected because the queue was full", ("batcher",)))
+
+_batchers = []
+register(GaugeCallback(
+    "write_batch_queue_depth", "Rows waiting in the queue",
+    lambda: {(batcher.name,): batcher.queue_depth() for batcher in _batchers}, ("batcher",)))
+
+
+class WriteBatcherFull(Exception):
+    """キューが埋まっていて行を受け付けられない"""
+
+
+class WriteBatcher:
+    def __init__(self, name: str, flush, max_rows: int = 100, max_wait_ms: float = 5.0, max_queue: int = 1000):
+        """
+        flush(values のリスト) は同じ順序の結果のリストを返すコルーチン関数。
+        flush が例外を送出したら、そのバッチの全員に同じ例外を返す
+        """
+        self.name = name
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+        _batchers.append(self)
+
+    def _start(self):
+        # イベントループ上で初めて使われたときに作る (インポート時にはループがないため)
+        if self._task is None:
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, values):
+        """values をキューに入れ、その行の結果を返す"""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((values, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            write_batch_rejected_total.inc(self.name)
+            raise WriteBatcherFull(f"{self.name} write queue is full ({self.max_queue} rows)")
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_rows:
+            try:
+                batch.append(self._queue.get_nowait()) # すでに届いている行は待たずに取る
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                write_batch_wait_seconds.observe(started - enqueued, self.name)
+            write_batch_rows.observe(len(batch), self.name)
+            try:
+                results = await self.flush([values for values, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done(): # 呼び出し元がキャンセル済みなら結果は捨てる (行は登録されている)
+                        future.set_result(result)
+            finally:
+                write_batch_flush_seconds.observe(time.perf_counter() - started, self.name)
+                self.batches += 1
+                self.rows += len(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def close(self):
+        """キューに残っている行をフラッシュしてから止める (app.py の lifespan の終了時に呼ぶ)"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "batches": self.batches,
+            "rows": self.rows,
+            "average_batch_rows": round(self.rows / self.batches, 2) if self.batches else None,
+            "max_rows": self.max_rows,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+        }
+
+
+CUSTOMER_WRITE_BATCHING = os.getenv('CUSTOMER_WRITE_BATCHING', 'false').lower() == 'true'
+
+def create_customer_batcher_from_env(flush) -> WriteBatcher:
+    return WriteBatcher(
+        "customers",
+        flush,
+        max_rows=int(os.getenv('CUSTOMER_BATCH_MAX_ROWS', '100')),
+        max_wait_ms=float(os.getenv('CUSTOMER_BATCH_MAX_WAIT_MS', '5')),
+        max_queue=int(os.getenv('CUSTOMER_BATCH_MAX_QUEUE', '1000')),
+    )